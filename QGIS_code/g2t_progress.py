@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+gdal2tiles 进度解析（瓦片24*.py 共用）
+- 只解析 gdal2tiles 自身的输出，不扫描输出目录
+- 按各缩放级的估算瓦片数把百分比折算为已完成瓦片数
+"""
+import re
+
+class G2TProgress:
+    """
+    解析 gdal2tiles 自身的进度输出，每次更新 O(1)，不访问磁盘：
+      Generating Base Tiles:      → 最大缩放级
+      Generating Overview Tiles:  → 其余缩放级，按 maxz-1 → minz 顺序生成
+      0...10...20...  100 - done. → 每个 '.' 为 2.5%
+    """
+    TICK = re.compile(r"\d+|\.")
+    def __init__(self, per_zoom):
+        self.per_zoom = dict(per_zoom or {})
+        zs = sorted(self.per_zoom)
+        self.base_z = zs[-1] if zs else None
+        self.ov_zooms = zs[-2::-1]
+        self.ov_total = sum(self.per_zoom[z] for z in self.ov_zooms)
+        self.total = sum(self.per_zoom.values()) if self.per_zoom else None
+        self.stage = None; self.pct = 0.0; self.buf = ""
+    def _tick_pct(self, s):
+        num, dots = 0, 0
+        for t in self.TICK.findall(s):
+            if t == ".": dots += 1
+            else: num, dots = int(t), 0
+        return min(100.0, num + 2.5*dots)
+    def feed(self, text):
+        """输入新输出文本，返回其中完整的行（供写日志/打印）。"""
+        lines = []
+        for ch in text:
+            if ch in "\r\n":
+                line = self.buf.strip(); self.buf = ""
+                if "Base Tiles" in line: self.stage, self.pct = "base", 0.0
+                elif "Overview Tiles" in line: self.stage, self.pct = "overview", 0.0
+                elif self.stage and "done" in line: self.pct = 100.0
+                if line: lines.append(line)
+            else:
+                self.buf += ch
+                if self.stage and ch in ".0123456789" and re.fullmatch(r"[\d.]+", self.buf):
+                    self.pct = self._tick_pct(self.buf)
+        return lines
+    def zoom_done(self):
+        """各缩放级已完成瓦片数（按进度比例折算）。"""
+        done = {z: 0 for z in self.per_zoom}
+        if self.base_z is None or self.stage is None: return done
+        if self.stage == "base":
+            done[self.base_z] = int(self.per_zoom[self.base_z]*self.pct/100); return done
+        done[self.base_z] = self.per_zoom[self.base_z]
+        left = int(self.ov_total*self.pct/100)
+        for z in self.ov_zooms:
+            take = min(left, self.per_zoom[z]); done[z] = take; left -= take
+        return done
+    def done(self):
+        return sum(self.zoom_done().values())
+    def current(self):
+        """正在生成的缩放级及其完成百分比。"""
+        zd = self.zoom_done()
+        order = ([self.base_z] if self.base_z is not None else []) + list(self.ov_zooms)
+        for z in order:
+            if zd[z] < self.per_zoom[z]: return z, zd[z]/max(1, self.per_zoom[z])*100
+        return (order[-1], 100.0) if order else (None, 0.0)
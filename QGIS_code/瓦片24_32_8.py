@@ -1,15 +1,23 @@
 # === Paste & Run (QGIS Python Console) ===
-import os, sys, subprocess, time, math
+import os, sys, subprocess, time, math, queue, codecs, threading
 from pathlib import Path
 from datetime import datetime
 
 # ---- 修改这里 ----
 input_tif = r"F:\外包\LY\羊八井正射影像和DEM\课题三测区\TIF.tif"
 out_dir   = r"F:\外包\LY\羊八井正射影像和DEM\课题三测区\map_test01"
+code_dir  = r""            # QGIS_code 目录（含 g2t_progress.py）；粘贴到 QGIS 控制台运行时必须填写
 zoom      = "0-19"          # 验证用 24；没问题再改 "20-24" 或 "0-24"
 tile_driver = "PNG"      # 或 "PNG"
 # -------------------
 
+# 进度解析在同目录的 g2t_progress.py；以文件运行时按 __file__ 定位，粘贴运行时没有 __file__，用 code_dir
+_code_dir = Path(code_dir) if code_dir else (Path(__file__).resolve().parent if "__file__" in globals() else None)
+if _code_dir is None or not (_code_dir/"g2t_progress.py").exists():
+    raise SystemExit(f"找不到 g2t_progress.py：请把上面的 code_dir 设为 QGIS_code 目录（当前：{_code_dir}）")
+if str(_code_dir) not in sys.path: sys.path.insert(0, str(_code_dir))
+from g2t_progress import G2TProgress
+
 tile_size   = "256"
 resampling  = "bilinear"
 processes   = "0"
@@ -17,7 +25,7 @@ resume      = True
 webviewer   = "none"
 use_xyz     = True
 s_srs       = None        # 例如 "EPSG:4490"；无则留 None
-poll_s      = 1.0
+poll_s      = 1.0         # 进度刷新间隔（只解析 gdal2tiles 输出，不再扫描输出目录）
 
 def resolve_qgis_python() -> str:
     exe = Path(sys.executable)
@@ -36,7 +44,8 @@ def parse_zoom(zs:str):
         return list(range(min(a,b), max(a,b)+1))
     return [int(zs)]
 
-def estimate_total_tiles(tif_path:Path, zooms):
+def estimate_tiles_per_zoom(tif_path:Path, zooms):
+    """按缩放级估算瓦片数：{z: n}；无法估算时返回 None。"""
     try:
         from osgeo import gdal, osr
         ds = gdal.Open(str(tif_path))
@@ -60,33 +69,35 @@ def estimate_total_tiles(tif_path:Path, zooms):
             n=2**z; x=int((lon+180.0)/360.0*n); lr=math.radians(lat)
             y=int((1.0-math.log(math.tan(lr)+1/math.cos(lr))/math.pi)/2.0*n)
             return max(0,min(n-1,x)), max(0,min(n-1,y))
-        total=0
+        per={}
         for z in zooms:
             x0,y0=lonlat_to_tilexy(min_lon,max_lat,z)
             x1,y1=lonlat_to_tilexy(max_lon,min_lat,z)
             xmin,xmax=min(x0,x1),max(x0,x1); ymin,ymax=min(y0,y1),max(y0,y1)
-            total += max(0,xmax-xmin+1)*max(0,ymax-ymin+1)
-        return total
+            per[z] = max(0,xmax-xmin+1)*max(0,ymax-ymin+1)
+        return per
     except Exception:
         return None
 
-def count_tiles(d:Path, ext:str):
-    c=0; ext=ext.lower()
-    for root,_,files in os.walk(d):
-        for f in files:
-            if f.lower().endswith("."+ext): c+=1
-    return c
+def estimate_total_tiles(tif_path:Path, zooms):
+    per=estimate_tiles_per_zoom(tif_path, zooms)
+    return sum(per.values()) if per else None
+
+def _hms(sec):
+    sec = max(0, int(sec)); return f"{sec//3600:02d}:{(sec%3600)//60:02d}:{sec%60:02d}"
 
-def progress_line(done,total,elapsed,rate):
-    if total and total>0:
+def progress_line(tr, elapsed, rate):
+    done, total = tr.done(), tr.total
+    if total and total>0 and tr.stage:
         pct=done/total*100; width=30; filled=int(width*pct/100)
         bar="█"*filled+"·"*(width-filled)
-        hh=int(elapsed//3600); mm=int((elapsed%3600)//60); ss=int(elapsed%60)
-        s=f"\r[{bar}] {pct:5.1f}%  tiles {done}/{total}  {rate:6.1f}/s  elapsed {hh:02d}:{mm:02d}:{ss:02d}"
+        z, zp = tr.current()
+        eta = _hms((total-done)/rate) if rate>0 else "--:--:--"
+        s=(f"\r[{bar}] {pct:5.1f}%  tiles ~{done}/{total}  z{z} {zp:5.1f}%  {rate:6.1f}/s  "
+           f"elapsed {_hms(elapsed)}  ETA {eta}")
     else:
         sp="⠋⠙⠸⠴⠦⠇"; ch=sp[int(elapsed*5)%len(sp)]
-        hh=int(elapsed//3600); mm=int((elapsed%3600)//60); ss=int(elapsed%60)
-        s=f"\r{ch} tiles {done}  {rate:6.1f}/s  elapsed {hh:02d}:{mm:02d}:{ss:02d}"
+        s=f"\r{ch} {tr.stage or 'starting'} {tr.pct:5.1f}%  elapsed {_hms(elapsed)}"
     print(s, end="", flush=True)
 
 # --- 准备 ---
@@ -106,8 +117,10 @@ if resume: cmd.append("--resume")
 if s_srs:  cmd+=["--s_srs",str(s_srs)]
 cmd+=[str(tif),str(out)]
 
-zooms=parse_zoom(zoom); total_est=estimate_total_tiles(tif,zooms)
+zooms=parse_zoom(zoom); per_zoom=estimate_tiles_per_zoom(tif,zooms)
+total_est=sum(per_zoom.values()) if per_zoom else None
 print("i Estimated total tiles:" , total_est if total_est is not None else "unknown")
+if per_zoom: print("i Per zoom:", ", ".join(f"z{z}={n}" for z,n in sorted(per_zoom.items())))
 with open(log,"a",encoding="utf-8") as lf:
     lf.write(f"\n[{datetime.now():%Y-%m-%d %H:%M:%S}] ===== Run Start =====\n")
     lf.write("PY:  "+py+"\n"); lf.write("CMD: "+" ".join(cmd)+"\n")
@@ -115,34 +128,46 @@ with open(log,"a",encoding="utf-8") as lf:
 print("▶ Launching gdal2tiles ...")
 print("PY:",py); print("CMD:"," ".join(cmd))
 
-start=time.time(); last_time=start; last_count=0; last_poll=0.0
-ext="jpg" if tile_driver.upper()=="JPEG" else "png"
+start=time.time(); last_time=start; last_count=0; last_poll=0.0; rate=0.0
+tracker=G2TProgress(per_zoom)
 ret=1
+
+def _pump(stream, q):
+    # 进度条不换行，必须按块读取；独立线程读，主循环按 poll_s 刷新
+    while True:
+        b=os.read(stream.fileno(), 4096)
+        if not b: break
+        q.put(b)
+    q.put(None)
+
 try:
     with open(log,"a",encoding="utf-8") as lf:
-        proc=subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,
-                              text=True,encoding="utf-8",errors="replace")
+        proc=subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        q=queue.Queue(); dec=codecs.getincrementaldecoder("utf-8")("replace")
+        threading.Thread(target=_pump,args=(proc.stdout,q),daemon=True).start()
+        eof=False
         while True:
-            line=proc.stdout.readline()
+            try: b=q.get(timeout=poll_s)
+            except queue.Empty: b=b""
+            if b is None: eof=True
+            elif b:
+                for msg in tracker.feed(dec.decode(b)):
+                    lf.write(msg+"\n")
+                    if any(k in msg for k in ("Generating","Tile","Overview","Base","ERROR","WARNING")):
+                        print("\n"+msg)
             now=time.time()
-            if line:
-                msg=line.rstrip("\r\n"); lf.write(msg+"\n")
-                if any(k in msg for k in ("Generating","Tile","Overview","Base","ERROR","WARNING")):
-                    print("\n"+msg)
-            if (now-last_poll)>=poll_s:
-                done=count_tiles(out,ext)
-                dt=max(1e-6, now-last_time); rate=(done-last_count)/dt
-                progress_line(done,total_est, now-start, rate)
+            if (now-last_poll)>=poll_s or eof:
+                done=tracker.done()
+                dt=max(1e-6, now-last_time); inst=(done-last_count)/dt
+                rate=inst if rate<=0 else 0.7*rate+0.3*inst
+                progress_line(tracker, now-start, rate)
                 last_poll=now; last_time=now; last_count=done
-            if proc.poll() is not None:
-                done=count_tiles(out,ext)
-                dt=max(1e-6, time.time()-last_time); rate=(done-last_count)/dt
-                progress_line(done,total_est, time.time()-start, rate)
-                print()
+            if eof:
+                proc.wait(); print()
                 ret=proc.returncode; break
     if ret==0:
         print("✅ Done. Output:", out)
-        print(fr"Example (XYZ): {out}\24\X\Y.{ext}")
+        print(fr"Example (XYZ): {out}\24\X\Y.{'jpg' if tile_driver.upper()=='JPEG' else 'png'}")
     else:
         print(f"❌ gdal2tiles failed (exit {ret}). See log:", log)
 finally:
@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+"""
+离线基准测试：判断对 main.py、MQTT 订阅脚本、切片脚本的改动是变快还是变慢
+- static / tiles_mbtiles / tiles_dir：NoCacheHandler 在本机端口上提供静态文件与瓦片，
+  客户端在独立进程中以 --concurrency 个 keep-alive 连接压测 --duration 秒：吞吐、P50/P95/P99 延迟
+- mqtt_log / mqtt_line：仓库中的 mqtt_log_*.txt 经本地 MQTT 代理替身（最小 MQTT 3.1.1 服务端）推送，
+  真实 paho 客户端 + 订阅脚本的 on_message 接收（日志 / 单条文件写到临时目录）；mqtt_line 按设计每秒一条，只测少量消息
+- gpchc_parse / live_feed：批量 GPCHC 解析速度，及 LiveFeed（粗差剔除 + 健康统计）的整条实时处理链
+- tiling：合成 GeoTIFF 切片到 MBTiles 与目录，瓦片 / 秒（瓦片同时作为 tiles_* 的数据）
+- 结果写 JSON（含 git 版本、Python、CPU 数）；--baseline 或 --compare 对比两次结果，
+  超出 --threshold 百分比的变差标为 REGRESSED 并以退出码 1 结束
+- --profile cpu,mem 等同于设置 PROFILE 环境变量，被测组件的 profiling 钩子写出采样结果
+用法：
+  python bench.py -o bench_before.json
+  python bench.py -w static,tiles_mbtiles,gpchc_parse --baseline bench_before.json
+  python bench.py --compare bench_before.json bench_after.json
+"""
+import os
+import sys
+import glob
+import json
+import time
+import socket
+import shutil
+import signal
+import atexit
+import argparse
+import warnings
+import platform
+import importlib
+import tempfile
+import threading
+import subprocess
+import http.client
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+WORKLOADS = ("static", "tiles_mbtiles", "tiles_dir", "mqtt_log", "mqtt_line", "gpchc_parse", "live_feed", "tiling")
+STATIC_FILES = ("three.min.js", "index.html", "googlemaps.html", "panel6.html")
+THRESHOLD_PCT = 10.0
+# 指标方向：后缀 → 越大越好（True）/ 越小越好（False）；其余指标只记录不比较
+DIRECTIONS = {"_per_s": True, "_ms": False, "_s": False}
+
+
+def _percentile(xs: List[float], p: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+# ========== HTTP ==========
+def _client_worker(port: int, paths: List[str], concurrency: int, duration_s: float) -> dict:
+    """在独立进程中运行：concurrency 个线程各持一个 keep-alive 连接，轮流请求 paths。"""
+    lat, nbytes, errors = [], [0], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration_s
+
+    def run(k: int):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine, got, bad, i = [], 0, 0, k
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += concurrency
+            t0 = time.perf_counter()
+            try:
+                conn.request("GET", path)
+                r = conn.getresponse()
+                body = r.read()
+                if r.status not in (200, 204):
+                    bad += 1
+                if r.will_close:
+                    conn.close()
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            except (OSError, http.client.HTTPException):
+                bad += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                continue
+            mine.append(time.perf_counter() - t0)
+            got += len(body)
+        conn.close()
+        with lock:
+            lat.extend(mine)
+            nbytes[0] += got
+            errors[0] += bad
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=run, args=(k,)) for k in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    ms = [x * 1000 for x in lat]
+    return {"requests": len(ms), "errors": errors[0], "concurrency": concurrency,
+            "requests_per_s": round(len(ms) / wall, 1), "mb_per_s": round(nbytes[0] / wall / 1048576, 2),
+            "p50_ms": round(_percentile(ms, 50), 3), "p95_ms": round(_percentile(ms, 95), 3),
+            "p99_ms": round(_percentile(ms, 99), 3)}
+
+
+class _Server:
+    """main.NoCacheHandler（不打印访问日志）以临时目录为 WEB_DIR 运行在随机端口上。"""
+
+    def __init__(self, web_dir: str):
+        import main
+        from http.server import ThreadingHTTPServer
+        from tile_prefetch import TileCache
+        main.WEB_DIR = web_dir
+        main.tile_cache = TileCache(main.TILE_CACHE_MB << 20)
+        self.main = main
+
+        class Handler(main.NoCacheHandler):
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_cache(self):
+        from tile_prefetch import TileCache
+        self.main.tile_cache = TileCache(self.main.TILE_CACHE_MB << 20)
+
+
+def http_load(server: _Server, paths: List[str], concurrency: int, duration_s: float) -> dict:
+    with ProcessPoolExecutor(1) as ex:
+        return ex.submit(_client_worker, server.port, paths, concurrency, duration_s).result()
+
+
+def _tile_paths(out: str, prefix: str) -> List[str]:
+    """目录或 MBTiles 中的全部瓦片 → URL 路径列表。"""
+    from tile_store import is_mbtiles
+    from tile_math import flip_y
+    if is_mbtiles(out):
+        import sqlite3
+        with sqlite3.connect(out) as c:
+            rows = c.execute("SELECT zoom_level, tile_column, tile_row FROM map").fetchall()
+        return [f"{prefix}/{z}/{x}/{flip_y(y, z)}.png" for z, x, y in rows]
+    return [f"{prefix}/{os.path.relpath(p, out).replace(os.sep, '/')}"
+            for p in glob.glob(os.path.join(out, "*", "*", "*.png"))]
+
+
+# ========== 切片 ==========
+def bench_tiling(work: str, size: int, zooms: str, processes: int) -> Dict[str, dict]:
+    from tile_math import parse_zoom
+    from tiler import TilerOptions, make_synthetic_geotiff, tile_raster
+    src = os.path.join(work, "synthetic.tif")
+    make_synthetic_geotiff(src, size)
+    out = {}
+    for name, dst in (("mbtiles", os.path.join(work, "web", "bench.mbtiles")), ("dir", os.path.join(work, "web", "map"))):
+        st = tile_raster(src, dst, TilerOptions(zooms=parse_zoom(zooms), processes=processes), quiet=True)
+        out[name] = {"tiles": st["total"], "seconds": round(st["seconds"], 3), "tiles_per_s": round(st["tiles_per_s"], 1)}
+    return out
+
+
+# ========== GPCHC ==========
+def _log_lines() -> List[str]:
+    lines = []
+    for p in sorted(glob.glob(os.path.join(BASE_DIR, "mqtt_log_*.txt"))):
+        with open(p, "r", encoding="utf-8", errors="ignore") as f:
+            lines += [ln for ln in f if ln.strip()]
+    return lines
+
+
+def bench_gpchc(lines: List[str], min_lines: int) -> dict:
+    from gpchc import parse_log_line
+    reps = max(1, -(-min_lines // max(1, len(lines))))
+    work = lines * reps
+    t0 = time.perf_counter()
+    fixes = sum(1 for ln in work if parse_log_line(ln) is not None)
+    wall = time.perf_counter() - t0
+    return {"lines": len(work), "fixes": fixes, "seconds": round(wall, 3), "lines_per_s": round(len(work) / wall, 1)}
+
+
+def bench_live_feed(lines: List[str], min_lines: int) -> dict:
+    """LiveFeed.feed_line → FixFilter → HealthAggregator / 最新位置，与 main.py 的接线一致。"""
+    from live_feed import LiveFeed
+    from fix_filter import FixFilter
+    from gnss_stats import HealthAggregator
+    reps = max(1, -(-min_lines // max(1, len(lines))))
+    total = {"lines": 0, "fixes": 0, "rejected": 0}
+    t0 = time.perf_counter()
+    now = time.time()
+    for _ in range(reps):
+        # 每遍重新建处理链，否则重复的日志会因时间倒序全部被剔除
+        feed = LiveFeed(os.devnull, stage=FixFilter())
+        feed.subscribe(HealthAggregator(), raw=True)
+        latest = {}
+        feed.subscribe(lambda fix: latest.__setitem__(fix.device, fix))
+        for ln in lines:
+            feed.feed_line(ln, now)
+        st = feed.stats()
+        for k in total:
+            total[k] += st[k]
+    wall = time.perf_counter() - t0
+    return dict(total, seconds=round(wall, 3), lines_per_s=round(total["lines"] / wall, 1))
+
+
+# ========== MQTT ==========
+def _mqtt_packet(ptype: int, body: bytes) -> bytes:
+    n, rl = len(body), bytearray()
+    while True:
+        b, n = n & 0x7F, n >> 7
+        rl.append(b | (0x80 if n else 0))
+        if not n:
+            break
+    return bytes([ptype]) + bytes(rl) + body
+
+
+class BrokerStandIn:
+    """
+    最小 MQTT 3.1.1 服务端：接受一个客户端，回 CONNACK / SUBACK / PINGRESP，
+    订阅确认后把 messages 作为 QoS 0 PUBLISH 一次性推送。
+    """
+
+    def __init__(self, messages: List[Tuple[str, bytes]]):
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.stream = b"".join(_mqtt_packet(0x30, len(t.encode()).to_bytes(2, "big") + t.encode() + p)
+                               for t, p in messages)
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _recv(conn: socket.socket, n: int) -> bytes:
+        buf = b""
+        while len(buf) < n:
+            chunk = conn.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError
+            buf += chunk
+        return buf
+
+    def _read_packet(self, conn) -> Tuple[int, bytes]:
+        ptype = self._recv(conn, 1)[0] >> 4
+        n, shift = 0, 0
+        while True:
+            b = self._recv(conn, 1)[0]
+            n |= (b & 0x7F) << shift
+            shift += 7
+            if not b & 0x80:
+                break
+        return ptype, self._recv(conn, n) if n else b""
+
+    def _serve(self):
+        conn, _ = self.sock.accept()
+        try:
+            while True:
+                ptype, body = self._read_packet(conn)
+                if ptype == 1:          # CONNECT
+                    conn.sendall(b"\x20\x02\x00\x00")
+                elif ptype == 8:        # SUBSCRIBE
+                    conn.sendall(_mqtt_packet(0x90, body[:2] + b"\x00"))
+                    conn.sendall(self.stream)
+                elif ptype == 12:       # PINGREQ
+                    conn.sendall(b"\xd0\x00")
+                elif ptype == 14:       # DISCONNECT
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            conn.close()
+            self.sock.close()
+
+
+def _mqtt_messages(lines: List[str]) -> List[Tuple[str, bytes]]:
+    out = []
+    for ln in lines:
+        if "] " in ln and " -> " in ln:
+            topic, msg = ln.split("] ", 1)[1].split(" -> ", 1)
+            out.append((topic.strip(), msg.rstrip("\r\n").encode("utf-8")))
+    return out
+
+
+def _load_subscriber(name: str, tmp: str):
+    """导入 mqtt_sub_*.py 并把输出改到临时目录；撤销其导入时注册的退出重命名与信号处理。"""
+    saved = {s: signal.getsignal(s) for s in (signal.SIGINT, signal.SIGTERM)}
+    mod = importlib.import_module(name)
+    for s, h in saved.items():
+        signal.signal(s, h)
+    atexit.unregister(mod.finalize_log)
+    mod.LOG_FILE = os.path.join(tmp, f"{name}_running.txt")
+    if hasattr(mod, "TEST_DATA_DIR"):
+        mod.TEST_DATA_DIR = os.path.join(tmp, f"{name}_test_data")
+        os.makedirs(mod.TEST_DATA_DIR, exist_ok=True)
+    return mod
+
+
+def bench_mqtt(name: str, messages: List[Tuple[str, bytes]], tmp: str, timeout_s: float = 600.0) -> dict:
+    import paho.mqtt.client as mqtt
+    mod = _load_subscriber(name, tmp)
+    broker = BrokerStandIn(messages)
+    done, state = threading.Event(), {"n": 0, "t0": None}
+
+    def on_message(client, userdata, msg):
+        if state["t0"] is None:
+            state["t0"] = time.perf_counter()
+        mod.on_message(client, userdata, msg)
+        state["n"] += 1
+        if state["n"] >= len(messages):
+            done.set()
+
+    # 订阅脚本的回调是 paho 1.x 签名
+    api = getattr(mqtt, "CallbackAPIVersion", None)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        client = mqtt.Client(api.VERSION1) if api is not None else mqtt.Client()
+    client.on_connect = mod.on_connect
+    client.on_message = on_message
+    with open(os.devnull, "w", encoding="utf-8") as devnull, redirect_stdout(devnull):
+        client.connect("127.0.0.1", broker.port, 60)
+        client.loop_start()
+        ok = done.wait(timeout_s)
+        wall = time.perf_counter() - (state["t0"] or time.perf_counter())
+        client.disconnect()
+        client.loop_stop()
+    n = state["n"]
+    return {"messages": n, "complete": ok, "seconds": round(wall, 3),
+            "messages_per_s": round(n / wall, 1) if wall > 0 else None}
+
+
+# ========== 汇总 / 对比 ==========
+def _git_rev() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                             text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _direction(metric: str) -> Optional[bool]:
+    for suffix, higher in DIRECTIONS.items():
+        if metric.endswith(suffix):
+            return higher
+    return None
+
+
+def compare(base: dict, cur: dict, threshold_pct: float = THRESHOLD_PCT) -> Tuple[List[dict], int]:
+    """逐项对比两份结果 → (行, 变差项数)；只比较两边都有、有方向的指标。"""
+    rows, regressions = [], 0
+    for wl, metrics in cur.get("results", {}).items():
+        old = base.get("results", {}).get(wl)
+        if not isinstance(old, dict) or not isinstance(metrics, dict):
+            continue
+        for k, v in metrics.items():
+            higher = _direction(k)
+            ov = old.get(k)
+            if higher is None or not isinstance(v, (int, float)) or not isinstance(ov, (int, float)) or not ov:
+                continue
+            change = (v - ov) / abs(ov) * 100
+            worse = -change if higher else change
+            status = "REGRESSED" if worse > threshold_pct else ("improved" if worse < -threshold_pct else "")
+            regressions += status == "REGRESSED"
+            rows.append({"workload": wl, "metric": k, "base": ov, "current": v, "change_pct": round(change, 1),
+                         "status": status})
+    return rows, regressions
+
+
+def print_compare(rows: List[dict], base: dict, cur: dict) -> None:
+    bm, cm = base.get("meta", {}), cur.get("meta", {})
+    print(f"baseline {bm.get('git')} @ {bm.get('time')}  →  current {cm.get('git')} @ {cm.get('time')}")
+    print(f"{'workload':16s} {'metric':16s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+    for r in rows:
+        print(f"{r['workload']:16s} {r['metric']:16s} {r['base']:12g} {r['current']:12g} "
+              f"{r['change_pct']:+7.1f}% {r['status']}")
+
+
+def _flatten(results: Dict[str, dict]) -> Dict[str, dict]:
+    """tiling 的 {mbtiles: {...}, dir: {...}} 展开为 tiling_mbtiles / tiling_dir。"""
+    out = {}
+    for k, v in results.items():
+        if isinstance(v, dict) and v and all(isinstance(x, dict) for x in v.values()):
+            out.update({f"{k}_{sub}": m for sub, m in v.items()})
+        else:
+            out[k] = v
+    return out
+
+
+def run(workloads: List[str], args) -> dict:
+    results: Dict[str, dict] = {}
+    lines = _log_lines()
+    with tempfile.TemporaryDirectory(prefix="bench_") as work:
+        web = os.path.join(work, "web")
+        os.makedirs(web)
+        for f in STATIC_FILES:
+            if os.path.isfile(os.path.join(BASE_DIR, f)):
+                shutil.copy(os.path.join(BASE_DIR, f), web)
+
+        def step(name: str, fn: Callable[[], dict]) -> None:
+            print(f"· {name} ...", flush=True)
+            try:
+                results[name] = fn()
+            except ImportError as e:
+                results[name] = {"skipped": f"缺少依赖：{e.name}"}
+            print(f"  {json.dumps(results[name], ensure_ascii=False)}", flush=True)
+
+        need_tiles = {"tiles_mbtiles", "tiles_dir"} & set(workloads)
+        if "tiling" in workloads or need_tiles:
+            step("tiling", lambda: bench_tiling(work, args.raster_size, args.zoom, args.processes))
+            if "tiling" not in workloads:
+                results.pop("tiling", None)
+        if "static" in workloads or need_tiles:
+            server = _Server(web)
+            try:
+                if "static" in workloads:
+                    step("static", lambda: http_load(server, [f"/{f}" for f in STATIC_FILES
+                                                              if os.path.isfile(os.path.join(web, f))],
+                                                     args.concurrency, args.duration))
+                for name, src, prefix in (("tiles_mbtiles", "bench.mbtiles", "/tiles/bench"),
+                                          ("tiles_dir", "map", "/map")):
+                    if name in workloads:
+                        server.reset_cache()
+                        step(name, lambda: http_load(server, _tile_paths(os.path.join(web, src), prefix),
+                                                     args.concurrency, args.duration))
+            finally:
+                server.close()
+        if "gpchc_parse" in workloads:
+            step("gpchc_parse", lambda: bench_gpchc(lines, args.min_lines))
+        if "live_feed" in workloads:
+            step("live_feed", lambda: bench_live_feed(lines, args.min_lines))
+        msgs = _mqtt_messages(lines)
+        if "mqtt_log" in workloads:
+            step("mqtt_log", lambda: bench_mqtt("mqtt_sub_log", msgs, work))
+        if "mqtt_line" in workloads:
+            # mqtt_sub_line 每条消息独占一个秒级文件名，设计上每秒最多一条
+            step("mqtt_line", lambda: bench_mqtt("mqtt_sub_line", msgs[:args.line_messages], work))
+    return {"meta": {"git": _git_rev(), "time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+                     "platform": platform.platform(), "cpus": os.cpu_count(), "workloads": workloads,
+                     "duration_s": args.duration, "concurrency": args.concurrency,
+                     "profile": os.getenv("PROFILE", "")},
+            "results": _flatten(results)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="离线基准测试（JSON 输出 + 回归对比）")
+    ap.add_argument("-w", "--workloads", default=",".join(WORKLOADS), help=f"逗号分隔：{','.join(WORKLOADS)}")
+    ap.add_argument("-o", "--out", default=None, help="结果 JSON 路径")
+    ap.add_argument("--baseline", default=None, help="与之前的结果 JSON 对比")
+    ap.add_argument("--compare", nargs=2, metavar=("BASE", "CURRENT"), help="只对比两份已有结果，不运行")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD_PCT, help="变差超过此百分比视为回归")
+    ap.add_argument("--duration", type=float, default=5.0, help="每个 HTTP 负载的压测秒数")
+    ap.add_argument("--concurrency", type=int, default=8, help="HTTP 并发连接数")
+    ap.add_argument("--min-lines", type=int, default=200000, help="解析负载至少处理的行数（日志重复使用）")
+    ap.add_argument("--line-messages", type=int, default=3, help="mqtt_line 推送的消息数")
+    ap.add_argument("--raster-size", type=int, default=2048, help="切片负载的合成栅格边长（像素）")
+    ap.add_argument("--zoom", default="14-20", help="切片负载的缩放级")
+    ap.add_argument("--processes", type=int, default=1, help="切片进程数（默认 1，结果可重复）")
+    ap.add_argument("--profile", default=None, help="cpu / mem / cpu,mem：同时开启组件的 profiling 钩子")
+    args = ap.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], "r", encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.compare[1], "r", encoding="utf-8") as f:
+            cur = json.load(f)
+        rows, bad = compare(base, cur, args.threshold)
+        print_compare(rows, base, cur)
+        return 1 if bad else 0
+
+    if args.profile:
+        # 被测模块在导入时读取 PROFILE，必须在导入前设置
+        os.environ["PROFILE"] = args.profile
+    sys.path.insert(0, BASE_DIR)
+    workloads = [w for w in args.workloads.split(",") if w]
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        ap.error(f"未知负载：{','.join(sorted(unknown))}")
+    res = run(workloads, args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=1)
+        print(f"→ {args.out}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        rows, bad = compare(base, res, args.threshold)
+        print_compare(rows, base, res)
+        return 1 if bad else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
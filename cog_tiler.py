@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+COG 动态切片：/cog/<dataset>/{z}/{x}/{y}[.png|.jpg|.webp] 按需渲染（代替预先切好全部缩放级）
+- 源影像（如 无人机采集样本 下的 DOM，.tfw / .prj 地理参考）一次性转换为带内部金字塔的 COG（to_cog）
+- 请求时只做窗口读取 + 重投影到 WebMercator（tiler.render_region）；低级别瓦片直接读内部金字塔
+- 渲染结果进按字节计的有界 LRU 与可选磁盘缓存；键含文件 mtime，COG 更新后自动失效
+- 渲染在进程池中并发执行（每个进程各自打开数据集）；同一瓦片的并发请求共享一次渲染
+用法：
+  python cog_tiler.py convert 无人机采集样本/DOM01/DOM_DOM.tif cog/DOM01.tif
+  python cog_tiler.py bench [工作目录]       # 冷 / 热瓦片延迟
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+
+from tile_math import TILE_SIZE, tile_bounds_3857, tile_range
+from tile_store import BLANK, write_file_atomic
+from tiler import SourceInfo, auto_scale, encode_tile, make_synthetic_geotiff, render_region, source_info
+
+COG_EXTS = {"png": "PNG", "jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP"}
+CACHE_BYTES = 256 << 20
+
+
+# ========== 转换 ==========
+def to_cog(src_path: str, dst_path: str, s_srs: Optional[str] = None, blocksize: int = 512,
+           compress: str = "DEFLATE", overview_resampling: str = "average") -> str:
+    """源栅格 → COG（内部分块 + 内部金字塔）；缺内嵌地理参考时用 .tfw / .prj（或 s_srs）补上。"""
+    info = source_info(src_path, s_srs)
+    opts = dict(driver="COG", BLOCKSIZE=blocksize, COMPRESS=compress, BIGTIFF="IF_SAFER",
+                OVERVIEW_RESAMPLING=overview_resampling.upper(), NUM_THREADS="ALL_CPUS")
+    if compress.upper() in ("DEFLATE", "LZW", "ZSTD"):
+        opts["PREDICTOR"] = "YES"
+    os.makedirs(os.path.dirname(os.path.abspath(dst_path)), exist_ok=True)
+    tmp = f"{dst_path}.{os.getpid()}.tmp"
+    with rasterio.open(src_path) as src:
+        if src.crs is not None and src.transform != Affine.identity() and not s_srs:
+            rasterio.shutil.copy(src, tmp, **opts)
+        else:
+            # 恒等“重投影”的 VRT 只是给数据挂上坐标系 / 仿射变换
+            with WarpedVRT(src, src_crs=info.crs, src_transform=info.transform, crs=info.crs,
+                           transform=info.transform, width=info.width, height=info.height,
+                           resampling=Resampling.nearest) as vrt:
+                rasterio.shutil.copy(vrt, tmp, **opts)
+    os.replace(tmp, dst_path)
+    return dst_path
+
+
+# ========== 进程池工作函数 ==========
+_W: Dict[str, Tuple[int, object]] = {}
+
+
+def _open(path: str, mtime: int):
+    cur = _W.get(path)
+    if cur is None or cur[0] != mtime:
+        if cur is not None:
+            cur[1].close()
+        _W[path] = (mtime, rasterio.open(path))
+    return _W[path][1]
+
+
+def render_tile(info: SourceInfo, mtime: int, z: int, x: int, y: int, driver: str = "PNG",
+                quality: int = 85, tile_size: int = TILE_SIZE, resampling: str = "bilinear") -> bytes:
+    """渲染并编码一张 XYZ 瓦片；全透明返回 BLANK。"""
+    src = _open(info.path, mtime)
+    rgba = render_region(src, info, tile_bounds_3857(x, y, z), tile_size, tile_size, Resampling[resampling])
+    if rgba is None or not rgba[..., 3].any():
+        return BLANK
+    return encode_tile(rgba, driver, quality)
+
+
+# ========== 服务端 ==========
+class CogServer:
+    """
+    root 目录下的 <dataset>.tif 按需出图。get() 线程安全，返回瓦片字节或 BLANK。
+    - cache_bytes：内存 LRU 上限；disk_cache：磁盘缓存目录（None 不启用）
+    - processes：渲染进程数（0 = CPU 数，1 = 在请求线程内渲染）
+    """
+
+    def __init__(self, root: str, processes: int = 0, cache_bytes: int = CACHE_BYTES,
+                 disk_cache: Optional[str] = None, tile_size: int = TILE_SIZE,
+                 resampling: str = "bilinear", quality: int = 85):
+        self.root = root
+        self.processes = processes or os.cpu_count() or 1
+        self.cache_bytes = cache_bytes
+        self.disk_cache = disk_cache
+        self.tile_size = tile_size
+        self.resampling = resampling
+        self.quality = quality
+        self._infos: Dict[str, Tuple[int, SourceInfo]] = {}
+        self._lru: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._lru_size = 0
+        self._inflight: Dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.counters = {"requests": 0, "lru_hits": 0, "disk_hits": 0, "shared": 0, "renders": 0,
+                         "outside": 0, "render_s": 0.0}
+
+    def _count(self, key: str, n=1) -> None:
+        with self._lock:
+            self.counters[key] += n
+
+    def dataset(self, name: str) -> Tuple[int, SourceInfo]:
+        """<name> → (mtime_ns, SourceInfo)；只允许 root 下的文件，按 mtime 缓存。"""
+        base = os.path.basename(name)
+        path = next((p for p in (os.path.join(self.root, base + ext) for ext in (".tif", ".tiff"))
+                     if os.path.isfile(p)), None)
+        if path is None:
+            raise FileNotFoundError(base)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cur = self._infos.get(base)
+        if cur is not None and cur[0] == mtime:
+            return cur
+        info = source_info(path, tile_size=self.tile_size)
+        if info.dtype != "uint8":
+            with rasterio.open(path) as src:
+                info.scale = auto_scale(src, info)
+        with self._lock:
+            self._infos[base] = (mtime, info)
+        return mtime, info
+
+    def _disk_path(self, name: str, mtime: int, z: int, x: int, y: int, ext: str) -> str:
+        return os.path.join(self.disk_cache, name, str(mtime), str(z), str(x), f"{y}.{ext}")
+
+    def _lru_get(self, key: tuple) -> Optional[bytes]:
+        with self._lock:
+            data = self._lru.get(key)
+            if data is not None:
+                self._lru.move_to_end(key)
+            return data
+
+    def _lru_put(self, key: tuple, data: bytes) -> None:
+        with self._lock:
+            if key in self._lru:
+                return
+            self._lru[key] = data
+            self._lru_size += len(data) + 64
+            while self._lru_size > self.cache_bytes and self._lru:
+                _, old = self._lru.popitem(last=False)
+                self._lru_size -= len(old) + 64
+
+    def _render(self, info: SourceInfo, mtime: int, z: int, x: int, y: int, driver: str) -> bytes:
+        args = (info, mtime, z, x, y, driver, self.quality, self.tile_size, self.resampling)
+        if self.processes <= 1:
+            with self._render_lock:
+                return render_tile(*args)
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(self.processes)
+        return self._pool.submit(render_tile, *args).result()
+
+    def get(self, name: str, z: int, x: int, y: int, ext: str = "png") -> bytes:
+        driver = COG_EXTS.get(ext.lower())
+        if driver is None:
+            raise ValueError(f"不支持的瓦片格式：{ext}")
+        mtime, info = self.dataset(name)
+        name = os.path.basename(name)
+        self._count("requests")
+        key = (name, mtime, z, x, y, driver)
+        data = self._lru_get(key)
+        if data is not None:
+            self._count("lru_hits")
+            return data
+        if self.disk_cache:
+            dp = self._disk_path(name, mtime, z, x, y, ext)
+            if os.path.isfile(dp):
+                with open(dp, "rb") as f:
+                    data = f.read()
+                self._count("disk_hits")
+                self._lru_put(key, data)
+                return data
+        xmin, ymin, xmax, ymax = tile_range(info.lonlat_bounds, z)
+        if not (xmin <= x <= xmax and ymin <= y <= ymax):
+            self._count("outside")
+            return BLANK
+
+        # 同一瓦片只渲染一次：后到的请求等待先到者的结果
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if not owner:
+            self._count("shared")
+            return fut.result()
+        try:
+            t0 = time.perf_counter()
+            data = self._render(info, mtime, z, x, y, driver)
+            self._count("render_s", time.perf_counter() - t0)
+            self._count("renders")
+            self._lru_put(key, data)
+            if self.disk_cache:
+                write_file_atomic(self._disk_path(name, mtime, z, x, y, ext), data)
+            fut.set_result(data)
+            return data
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self.counters)
+        n = c["requests"]
+        c["hit_rate"] = (c["lru_hits"] + c["disk_hits"]) / n if n else 0.0
+        c["avg_render_ms"] = c["render_s"] / c["renders"] * 1000 if c["renders"] else 0.0
+        with self._lock:
+            c.update(lru_tiles=len(self._lru), lru_bytes=self._lru_size, datasets=sorted(self._infos))
+        return c
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+# ========== 基准 ==========
+def _pct(v: List[float], p: float) -> float:
+    return float(np.percentile(v, p)) if v else 0.0
+
+
+def _sample_tiles(info: SourceInfo, zooms, per_zoom: int = 16) -> List[Tuple[int, int, int]]:
+    """每级取范围中心附近至多 per_zoom 张瓦片。"""
+    out = []
+    for z in zooms:
+        xmin, ymin, xmax, ymax = tile_range(info.lonlat_bounds, z)
+        cx, cy = (xmin + xmax) // 2, (ymin + ymax) // 2
+        k = 0
+        for x in range(max(xmin, cx - 2), min(xmax, cx + 2) + 1):
+            for y in range(max(ymin, cy - 2), min(ymax, cy + 2) + 1):
+                if k < per_zoom:
+                    out.append((z, x, y))
+                    k += 1
+    return out
+
+
+def bench(work_dir: Optional[str] = None, size: int = 8192, processes: int = 1) -> dict:
+    """
+    冷（首次渲染）/ 磁盘缓存 / 内存 LRU 三种情况下的单瓦片延迟；
+    并对比同一影像不转 COG（条带存储、无金字塔）时的冷瓦片延迟。
+    """
+    work = work_dir or tempfile.mkdtemp(prefix="cog_bench_")
+    raw = os.path.join(work, "synthetic.tif")
+    if not os.path.exists(raw):
+        print(f"i Generating {size}x{size} synthetic GeoTIFF ...")
+        make_synthetic_geotiff(raw, size)
+    cog_dir = os.path.join(work, "cog")
+    cog = os.path.join(cog_dir, "synthetic.tif")
+    t0 = time.perf_counter()
+    to_cog(raw, cog)
+    conv_s = time.perf_counter() - t0
+    strip_dir = os.path.join(work, "strip")
+    strip = os.path.join(strip_dir, "synthetic.tif")
+    if not os.path.exists(strip):
+        os.makedirs(strip_dir, exist_ok=True)
+        with rasterio.open(raw) as src:
+            rasterio.shutil.copy(src, strip, driver="GTiff", COMPRESS="DEFLATE")
+
+    info = source_info(cog)
+    zooms = range(max(0, info.native_zoom - 6), info.native_zoom + 1)
+    tiles = _sample_tiles(info, zooms)
+    result = {"tiles": len(tiles), "convert_s": round(conv_s, 2)}
+
+    def run(server, label):
+        lat = {}
+        for z, x, y in tiles:
+            t = time.perf_counter()
+            server.get("synthetic", z, x, y)
+            lat.setdefault(z, []).append((time.perf_counter() - t) * 1000)
+        allv = [v for vs in lat.values() for v in vs]
+        row = {"p50_ms": round(_pct(allv, 50), 2), "p95_ms": round(_pct(allv, 95), 2),
+               "by_zoom_p50_ms": {z: round(_pct(v, 50), 2) for z, v in sorted(lat.items())}}
+        print(f"{label:12s} p50 {row['p50_ms']:8.2f} ms  p95 {row['p95_ms']:8.2f} ms  "
+              + "  ".join(f"z{z}:{v:.1f}" for z, v in row["by_zoom_p50_ms"].items()))
+        return row
+
+    disk = os.path.join(work, "cache")
+    server = CogServer(cog_dir, processes=processes, disk_cache=disk)
+    try:
+        result["cold"] = run(server, "cold")
+        result["warm_lru"] = run(server, "warm (LRU)")
+    finally:
+        server.close()
+    server = CogServer(cog_dir, processes=processes, disk_cache=disk)
+    try:
+        result["warm_disk"] = run(server, "warm (disk)")
+    finally:
+        server.close()
+    server = CogServer(strip_dir, processes=processes)
+    try:
+        result["cold_no_cog"] = run(server, "cold no-COG")
+    finally:
+        server.close()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="COG 转换与动态切片基准")
+    sub = ap.add_subparsers(dest="cmd")
+    cv = sub.add_parser("convert", help="源栅格 → COG（内部金字塔）")
+    cv.add_argument("input")
+    cv.add_argument("output", nargs="?", help="默认 cog/<文件名>.tif")
+    cv.add_argument("--s_srs", default=None)
+    cv.add_argument("--blocksize", type=int, default=512)
+    cv.add_argument("--compress", default="DEFLATE", help="DEFLATE / LZW / ZSTD / JPEG / WEBP")
+    cv.add_argument("--overview-resampling", default="average")
+    bp = sub.add_parser("bench", help="冷 / 热瓦片延迟")
+    bp.add_argument("work_dir", nargs="?")
+    bp.add_argument("--size", type=int, default=8192)
+    bp.add_argument("--processes", type=int, default=1)
+    args = ap.parse_args()
+
+    if args.cmd == "convert":
+        if not os.path.exists(args.input):
+            raise SystemExit(f"输入影像不存在：{args.input}")
+        out = args.output or os.path.join("cog", os.path.splitext(os.path.basename(args.input))[0] + ".tif")
+        t0 = time.time()
+        to_cog(args.input, out, args.s_srs, args.blocksize, args.compress, args.overview_resampling)
+        print(f"OK {out}  {os.path.getsize(out) / 1048576:.1f} MiB  {time.time() - t0:.1f}s")
+    elif args.cmd == "bench":
+        bench(args.work_dir, args.size, args.processes)
+    else:
+        ap.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
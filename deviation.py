@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+轨迹偏差计算（相对规划参考线）
+- 参考线从 GeoJSON 读取（LineString / MultiLineString），投影到以测区中心为原点的局部平面（米）
+- 线段网格索引：最近线段查询只比较邻近格网内的候选线段，超出搜索半径再整体比对
+- NumPy 向量化投影，输出横向偏差（左正右负）、沿线里程、到线距离
+- 按“趟”（pass）统计：同一条线、方向不变、无长时间中断的一段连续数据
+- 实时：DeviationTracker 作为 LiveFeed 订阅者；批量：python deviation.py --ref 参考线.geojson mqtt_log_*.txt
+"""
+import os
+import sys
+import json
+import math
+import glob
+import argparse
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from gpchc import Fix, iter_file_fixes
+
+EARTH_R = 6378137.0
+CELL_M = 50.0          # 网格边长，也是邻域搜索保证正确的半径
+MAX_OFFSET_M = 20.0    # 超过此距离视为不在任何参考线上
+PASS_GAP_S = 5.0       # 中断超过该时长另起一趟
+REVERSE_M = 2.0        # 沿线反向移动超过该距离视为掉头，另起一趟
+BRUTE_CHUNK = 2048     # 整体比对时每批点数
+LIVE_KEEP = 2000       # 实时结果保留条数
+LIVE_KEEP_PASSES = 500 # 实时分趟统计保留趟数
+CAND_CACHE = 256       # 邻域候选缓存格数（LRU，实时逐点匹配时命中率最高）
+
+
+class ReferenceLines:
+    """参考线集合及其线段网格索引。"""
+
+    def __init__(self, lines: List[dict], cell_m: float = CELL_M):
+        if not lines:
+            raise ValueError("参考线为空")
+        self.names = [ln["name"] for ln in lines]
+        allc = np.concatenate([ln["coords"] for ln in lines])
+        self.lon0 = float(allc[:, 0].mean())
+        self.lat0 = float(allc[:, 1].mean())
+        self.kx = EARTH_R * math.cos(math.radians(self.lat0)) * math.pi / 180.0
+        self.ky = EARTH_R * math.pi / 180.0
+        self.cell = float(cell_m)
+
+        ax, ay, bx, by, line_id, chain0, line_len = [], [], [], [], [], [], []
+        for i, ln in enumerate(lines):
+            x, y = self.to_xy(ln["coords"][:, 0], ln["coords"][:, 1])
+            seg_len = np.hypot(np.diff(x), np.diff(y))
+            keep = seg_len > 0
+            ax.append(x[:-1][keep]); ay.append(y[:-1][keep])
+            bx.append(x[1:][keep]); by.append(y[1:][keep])
+            line_id.append(np.full(int(keep.sum()), i, dtype=np.int32))
+            chain0.append((np.cumsum(seg_len) - seg_len)[keep])
+            line_len.append(float(seg_len.sum()))
+        self.ax, self.ay = np.concatenate(ax), np.concatenate(ay)
+        self.dx, self.dy = np.concatenate(bx) - self.ax, np.concatenate(by) - self.ay
+        self.len2 = self.dx * self.dx + self.dy * self.dy
+        self.seg_line = np.concatenate(line_id)
+        self.seg_chain0 = np.concatenate(chain0)
+        self.line_len = line_len
+        self._build_grid()
+
+    # ---------- 构建 ----------
+    @classmethod
+    def from_geojson(cls, path: str, cell_m: float = CELL_M) -> "ReferenceLines":
+        with open(path, "r", encoding="utf-8") as f:
+            gj = json.load(f)
+        feats = gj.get("features", [gj]) if gj.get("type") == "FeatureCollection" else [gj]
+        lines = []
+        for k, feat in enumerate(feats):
+            geom = feat.get("geometry", feat)
+            props = feat.get("properties") or {}
+            name = str(props.get("name", props.get("id", f"line{k}")))
+            if geom.get("type") == "LineString":
+                parts = [geom["coordinates"]]
+            elif geom.get("type") == "MultiLineString":
+                parts = geom["coordinates"]
+            else:
+                continue
+            for j, part in enumerate(parts):
+                coords = np.asarray(part, dtype=np.float64)[:, :2]
+                if len(coords) >= 2:
+                    lines.append({"name": name if len(parts) == 1 else f"{name}#{j}", "coords": coords})
+        return cls(lines, cell_m)
+
+    def to_xy(self, lon, lat):
+        return ((np.asarray(lon, dtype=np.float64) - self.lon0) * self.kx,
+                (np.asarray(lat, dtype=np.float64) - self.lat0) * self.ky)
+
+    def _build_grid(self) -> None:
+        """把每条线段登记到其外包框覆盖的所有格网。"""
+        grid: Dict[tuple, list] = {}
+        x0 = np.floor(np.minimum(self.ax, self.ax + self.dx) / self.cell).astype(int)
+        x1 = np.floor(np.maximum(self.ax, self.ax + self.dx) / self.cell).astype(int)
+        y0 = np.floor(np.minimum(self.ay, self.ay + self.dy) / self.cell).astype(int)
+        y1 = np.floor(np.maximum(self.ay, self.ay + self.dy) / self.cell).astype(int)
+        for s in range(len(self.ax)):
+            for cx in range(x0[s], x1[s] + 1):
+                for cy in range(y0[s], y1[s] + 1):
+                    grid.setdefault((cx, cy), []).append(s)
+        self.grid = grid
+        self._cand_cache: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._cand_lock = threading.Lock()
+
+    def _candidates(self, cx: int, cy: int) -> np.ndarray:
+        """(cx, cy) 及其 8 邻格内的线段编号；按查询格做有界 LRU 缓存（轨迹可覆盖任意多格）。"""
+        key = (cx, cy)
+        with self._cand_lock:
+            cand = self._cand_cache.get(key)
+            if cand is not None:
+                self._cand_cache.move_to_end(key)
+                return cand
+        ids = set()
+        for i in (-1, 0, 1):
+            for j in (-1, 0, 1):
+                ids.update(self.grid.get((cx + i, cy + j), ()))
+        cand = np.fromiter(sorted(ids), dtype=np.int64, count=len(ids))
+        with self._cand_lock:
+            self._cand_cache[key] = cand
+            if len(self._cand_cache) > CAND_CACHE:
+                self._cand_cache.popitem(last=False)
+        return cand
+
+    # ---------- 匹配 ----------
+    def _project(self, px, py, segs):
+        """点集（n）对候选线段集（m）投影，返回每点最近线段及参数。"""
+        ax, ay = self.ax[segs], self.ay[segs]
+        dx, dy = self.dx[segs], self.dy[segs]
+        rx = px[:, None] - ax[None, :]
+        ry = py[:, None] - ay[None, :]
+        t = np.clip((rx * dx + ry * dy) / self.len2[segs], 0.0, 1.0)
+        ex = rx - t * dx
+        ey = ry - t * dy
+        d2 = ex * ex + ey * ey
+        k = np.argmin(d2, axis=1)
+        rows = np.arange(len(px))
+        seg = segs[k]
+        tk = t[rows, k]
+        side = np.sign(dx[k] * ry[rows, k] - dy[k] * rx[rows, k])
+        side[side == 0] = 1.0
+        return seg, tk, np.sqrt(d2[rows, k]), side
+
+    def match(self, lon, lat, max_offset: float = MAX_OFFSET_M) -> Dict[str, np.ndarray]:
+        """批量匹配最近参考线段。返回 line / seg / xte / along / dist / on_line 数组。"""
+        px, py = self.to_xy(np.atleast_1d(lon), np.atleast_1d(lat))
+        n = len(px)
+        seg = np.full(n, -1, dtype=np.int64)
+        tt = np.zeros(n)
+        dist = np.full(n, np.inf)
+        side = np.ones(n)
+
+        cx = np.floor(px / self.cell).astype(np.int64)
+        cy = np.floor(py / self.cell).astype(np.int64)
+        order = np.lexsort((cy, cx))
+        cxs, cys = cx[order], cy[order]
+        brk = np.flatnonzero((np.diff(cxs) != 0) | (np.diff(cys) != 0)) + 1
+        for grp in np.split(order, brk):
+            if len(grp) == 0:
+                continue
+            cand = self._candidates(int(cx[grp[0]]), int(cy[grp[0]]))
+            if len(cand) == 0:
+                continue
+            s, t, d, sd = self._project(px[grp], py[grp], cand)
+            seg[grp], tt[grp], dist[grp], side[grp] = s, t, d, sd
+
+        # 邻域内没有足够近的线段：与全部线段比对
+        far = np.flatnonzero(dist > self.cell)
+        all_segs = np.arange(len(self.ax))
+        for i in range(0, len(far), BRUTE_CHUNK):
+            idx = far[i:i + BRUTE_CHUNK]
+            s, t, d, sd = self._project(px[idx], py[idx], all_segs)
+            seg[idx], tt[idx], dist[idx], side[idx] = s, t, d, sd
+
+        return {
+            "line": self.seg_line[seg],
+            "seg": seg,
+            "xte": side * dist,
+            "along": self.seg_chain0[seg] + tt * np.sqrt(self.len2[seg]),
+            "dist": dist,
+            "on_line": dist <= max_offset,
+        }
+
+
+# ========== 分趟统计 ==========
+class PassTracker:
+    """逐点 O(1) 分趟并累计统计；实时与批量共用同一套规则。"""
+
+    def __init__(self, names: List[str], gap_s: float = PASS_GAP_S, reverse_m: float = REVERSE_M):
+        self.names = names
+        self.gap_s = gap_s
+        self.reverse_m = reverse_m
+        self.passes: List[dict] = []
+        self.closed = 0
+        self.current: Optional[dict] = None
+
+    def _close(self) -> None:
+        cur = self.current
+        if cur is not None:
+            n = cur["n"]
+            mean = cur["sum"] / n
+            cur["xte_mean"] = mean
+            cur["xte_std"] = math.sqrt(max(0.0, cur["sumsq"] / n - mean * mean))
+            cur["xte_rms"] = math.sqrt(cur["sumsq"] / n)
+            self.passes.append(cur)
+            self.closed += 1
+        self.current = None
+
+    def update(self, i: int, t: float, line: int, xte: float, along: float, on_line: bool) -> Optional[dict]:
+        """加入一点；返回该点所属的趟（不在线上时返回 None）。"""
+        cur = self.current
+        if not on_line:
+            self._close()
+            return None
+        if cur is not None:
+            if line != cur["line_id"] or t - cur["t1"] > self.gap_s:
+                self._close()
+                cur = None
+            else:
+                d = along - cur["along_end"]
+                if cur["direction"] == 0 and abs(d) >= self.reverse_m:
+                    cur["direction"] = 1 if d > 0 else -1
+                elif cur["direction"] * d <= -self.reverse_m:
+                    self._close()
+                    cur = None
+        if cur is None:
+            cur = self.current = {
+                "line_id": line, "line": self.names[line], "i0": i, "i1": i + 1,
+                "t0": t, "t1": t, "along_start": along, "along_end": along,
+                "direction": 0, "n": 0, "sum": 0.0, "sumsq": 0.0, "max_abs": 0.0,
+            }
+        cur["i1"] = i + 1
+        cur["t1"] = t
+        cur["n"] += 1
+        cur["sum"] += xte
+        cur["sumsq"] += xte * xte
+        cur["max_abs"] = max(cur["max_abs"], abs(xte))
+        if cur["direction"] == 0 or (along - cur["along_end"]) * cur["direction"] > 0:
+            cur["along_end"] = along
+        return cur
+
+    def finish(self) -> List[dict]:
+        self._close()
+        return self.passes
+
+
+def _public_pass(p: dict) -> dict:
+    out = {k: v for k, v in p.items() if k not in ("sum", "sumsq", "line_id")}
+    out["length_m"] = abs(p["along_end"] - p["along_start"])
+    return out
+
+
+# ========== 批量报告 ==========
+def report_for_fixes(ref: ReferenceLines, fixes: List[Fix], max_offset: float = MAX_OFFSET_M) -> dict:
+    if not fixes:
+        return {"points": 0, "matched": 0, "passes": []}
+    lon = np.fromiter((f.lon for f in fixes), dtype=np.float64, count=len(fixes))
+    lat = np.fromiter((f.lat for f in fixes), dtype=np.float64, count=len(fixes))
+    t = np.fromiter((f.t for f in fixes), dtype=np.float64, count=len(fixes))
+    m = ref.match(lon, lat, max_offset)
+    tracker = PassTracker(ref.names)
+    line, xte, along, on = m["line"].tolist(), m["xte"].tolist(), m["along"].tolist(), m["on_line"].tolist()
+    tl = t.tolist()
+    for i in range(len(fixes)):
+        tracker.update(i, tl[i], line[i], xte[i], along[i], on[i])
+    passes = []
+    for p in tracker.finish():
+        a = np.abs(m["xte"][p["i0"]:p["i1"]][m["on_line"][p["i0"]:p["i1"]]])
+        q = _public_pass(p)
+        q["xte_p95_abs"] = float(np.percentile(a, 95)) if len(a) else None
+        passes.append(q)
+    on_xte = m["xte"][m["on_line"]]
+    return {
+        "points": len(fixes),
+        "matched": int(m["on_line"].sum()),
+        "xte_rms": float(np.sqrt(np.mean(on_xte ** 2))) if len(on_xte) else None,
+        "xte_p95_abs": float(np.percentile(np.abs(on_xte), 95)) if len(on_xte) else None,
+        "passes": passes,
+    }
+
+
+def report_for_log(ref: ReferenceLines, path: str, max_offset: float = MAX_OFFSET_M) -> dict:
+    rep = report_for_fixes(ref, list(iter_file_fixes(path)), max_offset)
+    rep["log"] = os.path.basename(path)
+    return rep
+
+
+# ========== 实时 ==========
+class DeviationTracker:
+    """LiveFeed 订阅者：逐点匹配参考线，保留最近结果与分趟统计。"""
+
+    def __init__(self, ref: ReferenceLines, max_offset: float = MAX_OFFSET_M, keep: int = LIVE_KEEP):
+        self.ref = ref
+        self.max_offset = max_offset
+        self.results = deque(maxlen=keep)
+        self.seq = 0
+        self.tracker = PassTracker(ref.names)
+        self._lock = threading.Lock()
+
+    def __call__(self, fix: Fix) -> None:
+        m = self.ref.match(fix.lon, fix.lat, self.max_offset)
+        on = bool(m["on_line"][0])
+        line = int(m["line"][0])
+        with self._lock:
+            self.seq += 1
+            cur = self.tracker.update(self.seq, fix.t, line, float(m["xte"][0]), float(m["along"][0]), on)
+            self.results.append({
+                "seq": self.seq, "t": fix.t, "lon": fix.lon, "lat": fix.lat,
+                "line": self.ref.names[line], "xte": float(m["xte"][0]), "along": float(m["along"][0]),
+                "dist": float(m["dist"][0]), "on_line": on,
+                "pass": self.tracker.closed if cur is not None else None,
+            })
+            if len(self.tracker.passes) > LIVE_KEEP_PASSES:
+                del self.tracker.passes[:-LIVE_KEEP_PASSES]
+
+    def snapshot(self, since: int = 0, passes: int = 20) -> dict:
+        with self._lock:
+            cur = self.tracker.current
+            return {
+                "seq": self.seq,
+                "results": [r for r in self.results if r["seq"] > since],
+                "current_pass": None if cur is None else _public_pass(dict(cur, xte_mean=cur["sum"] / cur["n"])),
+                "passes": [_public_pass(p) for p in self.tracker.passes[-passes:]],
+            }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="轨迹相对参考线的偏差报告")
+    ap.add_argument("--ref", required=True, help="参考线 GeoJSON")
+    ap.add_argument("logs", nargs="*", help="mqtt_log_*.txt（默认：脚本目录下全部）")
+    ap.add_argument("--max-offset", type=float, default=MAX_OFFSET_M, help="在线判定距离（米）")
+    ap.add_argument("--out", help="输出 JSON（默认打印到终端）")
+    args = ap.parse_args()
+
+    ref = ReferenceLines.from_geojson(args.ref)
+    here = os.path.dirname(os.path.abspath(__file__))
+    logs = args.logs or sorted(glob.glob(os.path.join(here, "mqtt_log_*.txt")))
+    reports = [report_for_log(ref, p, args.max_offset) for p in logs]
+    text = json.dumps(reports, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + "\n")
+    for r in reports:
+        print(f"{r['log']}: {r['matched']}/{r['points']} matched, {len(r['passes'])} passes, "
+              f"rms {r.get('xte_rms')}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
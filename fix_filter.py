@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+定位粗差剔除与中断检测（解析之后、各消费者之前的一道处理）
+- 校验和 / 状态 / 零坐标 / 时间倒序 检查
+- 物理合理性：相邻有效点间的位移与速度变化不得超过速度、加速度上限（含噪声余量）
+- 轻量常速度卡尔曼门限：东/北两轴各一个 [位置, 速度] 二状态滤波，新息马氏距离超限则剔除
+- 中断检测：与上一有效点间隔超过 GAP_S 时标记 gap 并重置滤波
+- 每条 Fix 为 O(1) 标量运算，按设备分别维护状态；各类剔除计数可通过 /api/filter/stats 查看
+"""
+import math
+import threading
+from collections import deque
+from typing import Dict, Iterable, Iterator, Optional
+
+from gpchc import Fix
+
+EARTH_R = 6378137.0
+
+MAX_SPEED_MPS = 50.0     # 速度上限
+MAX_ACC_MPS2 = 15.0      # 加速度上限（约 1.5g）
+POS_NOISE_M = 5.0        # 位移检查的定位噪声余量
+VEL_NOISE_MPS = 1.0      # 速度变化检查的噪声余量
+GAP_S = 2.0              # 超过此间隔视为数据中断
+KF_POS_SIGMA_M = 1.0     # 观测噪声（位置标准差）
+KF_ACC_SIGMA = 3.0       # 过程噪声（加速度标准差）
+KF_GATE_CHI2 = 18.4      # 2 自由度、99.99% 门限
+REINIT_AFTER = 10        # 连续剔除次数达到后以新位置重新初始化
+KEEP_REJECTED = 100      # 保留最近剔除记录条数
+
+REASONS = ("checksum", "status", "zero", "range", "time", "speed", "accel", "kalman")
+
+
+class _Axis:
+    """单轴常速度卡尔曼滤波：状态 [x, v]，协方差 [[pxx, pxv], [pxv, pvv]]。"""
+
+    __slots__ = ("x", "v", "pxx", "pxv", "pvv")
+
+    def __init__(self, x: float, v: float):
+        self.x, self.v = x, v
+        self.pxx, self.pxv, self.pvv = KF_POS_SIGMA_M ** 2, 0.0, 4.0
+
+    def predict(self, dt: float):
+        q = KF_ACC_SIGMA ** 2
+        x = self.x + self.v * dt
+        pxx = self.pxx + 2 * dt * self.pxv + dt * dt * self.pvv + q * dt ** 4 / 4
+        pxv = self.pxv + dt * self.pvv + q * dt ** 3 / 2
+        pvv = self.pvv + q * dt * dt
+        return x, pxx, pxv, pvv
+
+    def update(self, z: float, pred) -> None:
+        x, pxx, pxv, pvv = pred
+        s = pxx + KF_POS_SIGMA_M ** 2
+        kx, kv = pxx / s, pxv / s
+        y = z - x
+        self.x = x + kx * y
+        self.v = self.v + kv * y
+        self.pxx = (1 - kx) * pxx
+        self.pxv = (1 - kx) * pxv
+        self.pvv = pvv - kv * pxv
+
+
+class _DeviceState:
+    __slots__ = ("last", "lat0", "lon0", "kx", "ex", "ny", "streak")
+
+    def __init__(self):
+        self.last: Optional[Fix] = None
+        self.ex: Optional[_Axis] = None
+        self.ny: Optional[_Axis] = None
+        self.streak = 0
+
+    def reset(self, fix: Fix) -> None:
+        self.lat0, self.lon0 = fix.lat, fix.lon
+        self.kx = EARTH_R * math.cos(math.radians(fix.lat)) * math.pi / 180.0
+        self.ex = _Axis(0.0, fix.ve)
+        self.ny = _Axis(0.0, fix.vn)
+        self.streak = 0
+
+    def xy(self, fix: Fix):
+        return (fix.lon - self.lon0) * self.kx, (fix.lat - self.lat0) * EARTH_R * math.pi / 180.0
+
+
+class FixFilter:
+    """按设备的粗差剔除 / 中断标记。调用 filter(fix) 返回通过的 Fix（可能带 gap 标记）或 None。"""
+
+    def __init__(self, max_speed: float = MAX_SPEED_MPS, max_acc: float = MAX_ACC_MPS2,
+                 gap_s: float = GAP_S, check_checksum: bool = True):
+        self.max_speed = max_speed
+        self.max_acc = max_acc
+        self.gap_s = gap_s
+        self.check_checksum = check_checksum
+        self.states: Dict[str, _DeviceState] = {}
+        self.counters = {"in": 0, "out": 0, "gaps": 0, "reinit": 0, **{r: 0 for r in REASONS}}
+        self.rejected = deque(maxlen=KEEP_REJECTED)
+        self._lock = threading.Lock()
+
+    def __call__(self, fix: Fix) -> Optional[Fix]:
+        return self.filter(fix)
+
+    def _reject(self, fix: Fix, reason: str, st: Optional[_DeviceState] = None) -> None:
+        self.counters[reason] += 1
+        self.rejected.append({"t": fix.t, "lat": fix.lat, "lon": fix.lon, "device": fix.device, "reason": reason})
+        if st is not None:
+            st.streak += 1
+
+    def filter(self, fix: Fix) -> Optional[Fix]:
+        with self._lock:
+            return self._filter(fix)
+
+    def _filter(self, fix: Fix) -> Optional[Fix]:
+        c = self.counters
+        c["in"] += 1
+        if self.check_checksum and fix.checksum_ok is False:
+            self._reject(fix, "checksum")
+            return None
+        if fix.status == 0 or (fix.status >> 4) == 0:
+            self._reject(fix, "status")
+            return None
+        if abs(fix.lat) < 1e-6 and abs(fix.lon) < 1e-6:
+            self._reject(fix, "zero")
+            return None
+        if not (-90.0 <= fix.lat <= 90.0 and -180.0 <= fix.lon <= 180.0):
+            self._reject(fix, "range")
+            return None
+
+        st = self.states.get(fix.device)
+        if st is None:
+            st = self.states[fix.device] = _DeviceState()
+        last = st.last
+        if last is None or fix.t - last.t > self.gap_s or st.streak >= REINIT_AFTER:
+            if last is not None:
+                if st.streak >= REINIT_AFTER:
+                    c["reinit"] += 1
+                else:
+                    c["gaps"] += 1
+                    fix = fix._replace(gap=True)
+            st.reset(fix)
+            st.last = fix
+            c["out"] += 1
+            return fix
+
+        dt = fix.t - last.t
+        if dt <= 0:
+            self._reject(fix, "time", st)
+            return None
+        # 物理合理性
+        x, y = st.xy(fix)
+        lx, ly = st.xy(last)
+        if math.hypot(x - lx, y - ly) > self.max_speed * dt + POS_NOISE_M:
+            self._reject(fix, "speed", st)
+            return None
+        if abs(fix.speed - last.speed) > self.max_acc * dt + VEL_NOISE_MPS:
+            self._reject(fix, "accel", st)
+            return None
+        # 卡尔曼门限
+        pe, pn = st.ex.predict(dt), st.ny.predict(dt)
+        r2 = KF_POS_SIGMA_M ** 2
+        d2 = (x - pe[0]) ** 2 / (pe[1] + r2) + (y - pn[0]) ** 2 / (pn[1] + r2)
+        if d2 > KF_GATE_CHI2:
+            self._reject(fix, "kalman", st)
+            return None
+        st.ex.update(x, pe)
+        st.ny.update(y, pn)
+        st.streak = 0
+        st.last = fix
+        c["out"] += 1
+        return fix
+
+    def process(self, fixes: Iterable[Fix]) -> Iterator[Fix]:
+        """批量/流式用法：只产出通过的点。"""
+        for f in fixes:
+            out = self.filter(f)
+            if out is not None:
+                yield out
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self.counters)
+            c["rejected_total"] = sum(c[r] for r in REASONS)
+            c["reject_rate"] = c["rejected_total"] / c["in"] if c["in"] else 0.0
+            return {"counters": c, "recent_rejected": list(self.rejected)[-20:]}
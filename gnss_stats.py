@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+GNSS/INS 实时健康统计（增量滚动窗口）
+- 每台设备、每个指标维护 1s / 1min / 整个会话 三种窗口
+- 每条 Fix 更新为 O(1)：窗口由固定数量的时间桶组成，过期桶在被复用时清零
+- 分位数使用对数分桶草图（相对误差约 1%），可按桶合并
+- 只消费实时数据（LiveFeed），不读取历史日志
+"""
+import math
+import threading
+from typing import Dict, Optional
+
+from gpchc import Fix, fix_rank
+
+# 相对误差 1% 的对数分桶
+SKETCH_ALPHA = 0.01
+SKETCH_MAX_BINS = 512
+QUANTILES = (0.5, 0.9, 0.99)
+
+# 窗口：名称 → (跨度秒, 桶数)；None 表示整个会话
+WINDOWS = {
+    "1s": (1.0, 10),
+    "1min": (60.0, 60),
+    "session": None,
+}
+
+# 数据间隔超过名义间隔的倍数记为丢包；超过 RESYNC_S 视为数据源重新同步（不计丢包数）
+GAP_FACTOR = 1.5
+RESYNC_S = 60.0
+
+
+class QuantileSketch:
+    """对数分桶分位数草图（DDSketch 思路），正负值分开计数，可合并。"""
+
+    __slots__ = ("gamma", "log_gamma", "pos", "neg", "zero", "count")
+
+    def __init__(self, alpha: float = SKETCH_ALPHA):
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.pos: Dict[int, int] = {}
+        self.neg: Dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        if x > 1e-9:
+            k = math.ceil(math.log(x) / self.log_gamma)
+            self.pos[k] = self.pos.get(k, 0) + 1
+            if len(self.pos) > SKETCH_MAX_BINS:
+                self._collapse(self.pos)
+        elif x < -1e-9:
+            k = math.ceil(math.log(-x) / self.log_gamma)
+            self.neg[k] = self.neg.get(k, 0) + 1
+            if len(self.neg) > SKETCH_MAX_BINS:
+                self._collapse(self.neg)
+        else:
+            self.zero += 1
+
+    @staticmethod
+    def _collapse(bins: Dict[int, int]) -> None:
+        """超出桶数上限时合并最小的两个桶（只损失极小值附近的精度）。"""
+        a, b = sorted(bins)[:2]
+        bins[b] += bins.pop(a)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        for k, c in other.pos.items():
+            self.pos[k] = self.pos.get(k, 0) + c
+        for k, c in other.neg.items():
+            self.neg[k] = self.neg.get(k, 0) + c
+        self.zero += other.zero
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for k in sorted(self.neg, reverse=True):
+            seen += self.neg[k]
+            if seen > rank:
+                return -2 * self.gamma ** k / (self.gamma + 1)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for k in sorted(self.pos):
+            seen += self.pos[k]
+            if seen > rank:
+                return 2 * self.gamma ** k / (self.gamma + 1)
+        return None
+
+
+class _Bucket:
+    """一个时间桶内的计数 / 和 / 平方和 / 极值 / 草图。"""
+
+    __slots__ = ("epoch", "n", "sum", "sumsq", "min", "max", "sketch")
+
+    def __init__(self, quantiles: bool = True):
+        self.sketch = QuantileSketch() if quantiles else None
+        self.reset(-1)
+
+    def reset(self, epoch: int) -> None:
+        self.epoch = epoch
+        self.n = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        if self.sketch is not None:
+            self.sketch = QuantileSketch()
+
+    def add(self, x: float) -> None:
+        self.n += 1
+        self.sum += x
+        self.sumsq += x * x
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        if self.sketch is not None:
+            self.sketch.add(x)
+
+
+def _summary(n, s, ss, lo, hi, sketch) -> dict:
+    if n == 0:
+        return {"n": 0}
+    mean = s / n
+    out = {
+        "n": n,
+        "sum": s,
+        "mean": mean,
+        "std": math.sqrt(max(0.0, ss / n - mean * mean)),
+        "min": lo,
+        "max": hi,
+    }
+    if sketch is not None:
+        for q in QUANTILES:
+            out[f"p{int(q * 100)}"] = sketch.quantile(q)
+    return out
+
+
+class RollingStat:
+    """固定跨度的滚动窗口；span=None 时为会话累计。"""
+
+    __slots__ = ("span", "nbuckets", "width", "buckets")
+
+    def __init__(self, span: Optional[float] = None, nbuckets: int = 1, quantiles: bool = True):
+        self.span = span
+        self.nbuckets = nbuckets if span else 1
+        self.width = span / nbuckets if span else None
+        self.buckets = [_Bucket(quantiles) for _ in range(self.nbuckets)]
+
+    def add(self, t: float, x: float) -> None:
+        if self.span is None:
+            b = self.buckets[0]
+        else:
+            epoch = int(t // self.width)
+            b = self.buckets[epoch % self.nbuckets]
+            if b.epoch != epoch:
+                b.reset(epoch)
+        b.add(x)
+
+    def snapshot(self, now: float) -> dict:
+        live = self.buckets
+        if self.span is not None:
+            cur = int(now // self.width)
+            live = [b for b in self.buckets if cur - self.nbuckets < b.epoch <= cur]
+        n, s, ss, lo, hi = 0, 0.0, 0.0, math.inf, -math.inf
+        sketch = QuantileSketch() if self.buckets[0].sketch is not None else None
+        for b in live:
+            if b.n == 0:
+                continue
+            n += b.n
+            s += b.sum
+            ss += b.sumsq
+            lo = min(lo, b.min)
+            hi = max(hi, b.max)
+            if sketch is not None:
+                sketch.merge(b.sketch)
+        return _summary(n, s, ss, lo, hi, sketch)
+
+
+def _windows(quantiles: bool = True) -> Dict[str, RollingStat]:
+    return {name: RollingStat(*(w or (None, 1)), quantiles=quantiles) for name, w in WINDOWS.items()}
+
+
+class _Counter:
+    """按窗口计数的事件计数器（丢包、定位质量下降等）。"""
+
+    __slots__ = ("stats",)
+
+    def __init__(self):
+        self.stats = _windows(quantiles=False)
+
+    def add(self, t: float, k: float = 1.0) -> None:
+        for st in self.stats.values():
+            st.add(t, k)
+
+    def snapshot(self, now: float) -> dict:
+        return {name: round(st.snapshot(now).get("sum", 0.0)) for name, st in self.stats.items()}
+
+
+# 指标 → 从 Fix 取值
+METRICS = {
+    "speed": lambda f: f.speed,
+    "ve": lambda f: f.ve,
+    "vn": lambda f: f.vn,
+    "vu": lambda f: f.vu,
+    "acc_x": lambda f: f.acc_x,
+    "acc_y": lambda f: f.acc_y,
+    "acc_z": lambda f: f.acc_z,
+    "nsv1": lambda f: f.nsv1,
+    "nsv2": lambda f: f.nsv2,
+    "age": lambda f: f.age,
+    "fix_quality": lambda f: fix_rank(f.status),   # 0 无效 … 4 RTK 固定
+}
+
+
+class DeviceHealth:
+    """单台设备的全部滚动统计。"""
+
+    def __init__(self, device: str):
+        self.device = device
+        self.metrics = {m: _windows() for m in METRICS}
+        # 接收间隔（抖动）与数据间隔（GPS 周内秒差）
+        self.intervals = {k: _windows() for k in ("recv_interval", "data_interval")}
+        self.gaps = _Counter()
+        self.missing = _Counter()
+        self.quality_drops = _Counter()
+        self.checksum_errors = _Counter()
+        self.resyncs = _Counter()
+        self.total = 0
+        self.last: Optional[Fix] = None
+        self.last_t: Optional[float] = None
+        self.nominal_dt: Optional[float] = None
+        self.first_t: Optional[float] = None
+
+    def update(self, fix: Fix, t: float) -> None:
+        self.total += 1
+        if self.first_t is None:
+            self.first_t = t
+        for m, get in METRICS.items():
+            x = float(get(fix))
+            for st in self.metrics[m].values():
+                st.add(t, x)
+        if fix.checksum_ok is False:
+            self.checksum_errors.add(t)
+        prev = self.last
+        if prev is not None:
+            for st in self.intervals["recv_interval"].values():
+                st.add(t, t - self.last_t)
+            dt = round(fix.tow - prev.tow, 3) if fix.week == prev.week else None
+            if dt is None or dt < 0 or dt > RESYNC_S:
+                self.resyncs.add(t)
+            elif dt > 0:
+                for st in self.intervals["data_interval"].values():
+                    st.add(t, dt)
+                # 名义间隔：取观测到的最小正间隔（GPCHC 输出频率固定）
+                if self.nominal_dt is None or dt < self.nominal_dt:
+                    self.nominal_dt = dt
+                if dt > GAP_FACTOR * self.nominal_dt:
+                    self.gaps.add(t)
+                    self.missing.add(t, round(dt / self.nominal_dt) - 1)
+            if fix_rank(fix.status) < fix_rank(prev.status):
+                self.quality_drops.add(t)
+        self.last = fix
+        self.last_t = t
+
+    def snapshot(self, now: float) -> dict:
+        last = self.last
+        return {
+            "device": self.device,
+            "total": self.total,
+            "session_s": (self.last_t - self.first_t) if self.first_t is not None else 0.0,
+            "last": None if last is None else {
+                "t": last.t, "lat": last.lat, "lon": last.lon, "alt": last.alt,
+                "status": last.status, "nsv1": last.nsv1, "nsv2": last.nsv2, "speed": last.speed,
+            },
+            "age_s": (now - self.last_t) if self.last_t is not None else None,
+            "nominal_interval_s": self.nominal_dt,
+            "metrics": {m: {name: st.snapshot(now) for name, st in wins.items()} for m, wins in self.metrics.items()},
+            "intervals": {m: {name: st.snapshot(now) for name, st in wins.items()} for m, wins in self.intervals.items()},
+            "gaps": self.gaps.snapshot(now),
+            "missing_messages": self.missing.snapshot(now),
+            "quality_drops": self.quality_drops.snapshot(now),
+            "checksum_errors": self.checksum_errors.snapshot(now),
+            "resyncs": self.resyncs.snapshot(now),
+        }
+
+
+class HealthAggregator:
+    """按设备汇总的健康统计；作为 LiveFeed 订阅者使用。"""
+
+    def __init__(self):
+        self.devices: Dict[str, DeviceHealth] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, fix: Fix) -> None:
+        self.update(fix)
+
+    def update(self, fix: Fix, t: Optional[float] = None) -> None:
+        t = t if t is not None else (fix.recv_t if fix.recv_t is not None else fix.t)
+        key = fix.device or "default"
+        with self._lock:
+            dev = self.devices.get(key)
+            if dev is None:
+                dev = self.devices[key] = DeviceHealth(key)
+            dev.update(fix, t)
+
+    def snapshot(self, device: Optional[str] = None, now: Optional[float] = None) -> dict:
+        with self._lock:
+            devs = [d for k, d in self.devices.items() if device in (None, k)]
+            if now is None:
+                now = max((d.last_t for d in devs if d.last_t is not None), default=0.0)
+            return {"devices": {d.device: d.snapshot(now) for d in devs}}
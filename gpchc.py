@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+GPCHC（华测组合导航）语句解析工具
+- 与页面端 tryParseGPCHC / parseBracketTimestamp / parseTimestampFromFilename 保持同一套规则
+- 供服务端各处理模块（二进制轨迹、统计、导出等）共用
+"""
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, NamedTuple, Optional
+
+# GPS 时间起点（与页面 gpsWeekTowToDate 相同，不做闰秒修正）
+GPS_EPOCH = datetime(1980, 1, 6, tzinfo=timezone.utc)
+
+_RE_BRACKET_TS = re.compile(r"\[(\d{4}-\d{2}-\d{2})\s+(\d{2}:\d{2}:\d{2})(?:\.(\d{1,6}))?\]")
+_RE_FILENAME_TS = re.compile(r"(\d{4})_(\d{2})_(\d{2})_(\d{2})_(\d{2})_(\d{2})")
+_RE_TOPIC = re.compile(r"\]\s+(\S+)\s+->")
+
+# 同一文件内无时间戳的行，按 200ms 递增（与页面一致）
+FILE_LINE_STEP_S = 0.2
+
+# 状态字高 4 位（GNSS 解状态）→ 质量等级（越大越好）。原值不是有序量：4 RTK 固定优于 5 RTK 浮点，
+# 6–9 依次为 1 / 2 / 4 / 5 的无定向版本，与对应有定向状态同级；未列出的值按无效（0）
+FIX_RANK = {0: 0, 1: 1, 2: 2, 5: 3, 4: 4, 6: 1, 7: 2, 8: 4, 9: 3}
+
+
+class Fix(NamedTuple):
+    """一条 GPCHC 定位结果（时间为 Unix 秒，角度为度，速度 m/s）。"""
+    t: float
+    lat: float
+    lon: float
+    alt: float
+    heading: float = 0.0
+    pitch: float = 0.0
+    roll: float = 0.0
+    ve: float = 0.0
+    vn: float = 0.0
+    vu: float = 0.0
+    speed: float = 0.0
+    acc_x: float = 0.0
+    acc_y: float = 0.0
+    acc_z: float = 0.0
+    nsv1: int = 0
+    nsv2: int = 0
+    status: int = 0
+    age: float = 0.0
+    week: int = 0
+    tow: float = 0.0
+    checksum_ok: Optional[bool] = None
+    device: str = ""
+    recv_t: Optional[float] = None
+    gap: bool = False          # 由 fix_filter 标记：与上一有效点之间存在数据中断
+
+
+def _num(x) -> float:
+    """与页面 num() 相同：去掉 *校验和 后转浮点，失败返回 nan。"""
+    if x is None:
+        return float("nan")
+    s = str(x).strip()
+    star = s.find("*")
+    if star >= 0:
+        s = s[:star]
+    try:
+        return float(s)
+    except ValueError:
+        return float("nan")
+
+
+def _finite(v: float) -> bool:
+    return v == v and v not in (float("inf"), float("-inf"))
+
+
+def fix_rank(status: int) -> int:
+    """GPCHC 状态字 → 质量等级：0 无效、1 单点、2 伪距差分、3 RTK 浮点、4 RTK 固定。"""
+    return FIX_RANK.get(status >> 4, 0)
+
+
+def nmea_checksum_ok(sentence: str) -> Optional[bool]:
+    """校验 NMEA 异或校验和；语句不带 *XX 时返回 None。"""
+    start = sentence.find("$")
+    star = sentence.find("*", start + 1)
+    if start < 0 or star < 0 or len(sentence) < star + 3:
+        return None
+    try:
+        expect = int(sentence[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+    c = 0
+    for ch in sentence[start + 1:star]:
+        c ^= ord(ch)
+    return c == expect
+
+
+def gps_week_tow_to_unix(week: float, tow: float) -> Optional[float]:
+    """GPS 周 + 周内秒 → Unix 秒。"""
+    if not (_finite(week) and _finite(tow)):
+        return None
+    return (GPS_EPOCH + timedelta(seconds=week * 7 * 86400 + tow)).timestamp()
+
+
+def parse_bracket_timestamp(line: str) -> Optional[float]:
+    """解析日志行首的 [YYYY-MM-DD HH:MM:SS(.fff)]（本地时间），返回 Unix 秒。"""
+    m = _RE_BRACKET_TS.search(line)
+    if not m:
+        return None
+    try:
+        dt = datetime.strptime(f"{m.group(1)} {m.group(2)}", "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+    frac = m.group(3)
+    return dt.timestamp() + (int(frac) / 10 ** len(frac) if frac else 0.0)
+
+
+def parse_timestamp_from_filename(path: str) -> Optional[float]:
+    """解析 test_data 文件名 YYYY_MM_DD_HH_MM_SS（本地时间），返回 Unix 秒。"""
+    m = _RE_FILENAME_TS.search(os.path.basename(str(path)))
+    if not m:
+        return None
+    try:
+        return datetime(*(int(g) for g in m.groups())).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_gpchc(line: str, recv_t: Optional[float] = None, device: str = "",
+                fallback_t: Optional[float] = None) -> Optional[Fix]:
+    """
+    解析一行中的 $GPCHC 语句；无经纬度时返回 None。
+    时间优先级与页面一致：recv_t（行首方括号时间）> GPS 周秒 > fallback_t（文件名时间）。
+    """
+    i = line.find("$GPCHC")
+    if i < 0:
+        return None
+    sentence = line[i:].strip()
+    p = sentence.split(",")
+    if len(p) < 15:
+        return None
+    lat, lon = _num(p[12]), _num(p[13])
+    if not (_finite(lat) and _finite(lon)):
+        return None
+    alt = _num(p[14])
+    week, tow = _num(p[1]), _num(p[2])
+
+    def f(k: int) -> float:
+        v = _num(p[k]) if k < len(p) else float("nan")
+        return v if _finite(v) else 0.0
+
+    def status_of(k: int) -> int:
+        if k >= len(p):
+            return 0
+        try:
+            return int(p[k].split("*")[0].strip() or "0", 16)
+        except ValueError:
+            return 0
+
+    t_gps = gps_week_tow_to_unix(week, tow)
+    t = recv_t if recv_t is not None else (t_gps if t_gps is not None else fallback_t)
+    if t is None:
+        return None
+    return Fix(
+        t=t, lat=lat, lon=lon, alt=alt if _finite(alt) else 0.0,
+        heading=f(3), pitch=f(4), roll=f(5),
+        ve=f(15), vn=f(16), vu=f(17), speed=f(18),
+        acc_x=f(9), acc_y=f(10), acc_z=f(11),
+        nsv1=int(f(19)), nsv2=int(f(20)), status=status_of(21), age=f(22),
+        week=int(week) if _finite(week) else 0, tow=tow if _finite(tow) else 0.0,
+        checksum_ok=nmea_checksum_ok(sentence), device=device, recv_t=recv_t,
+    )
+
+
+def parse_log_line(line: str, file_time: Optional[float] = None, idx_in_file: int = 0) -> Optional[Fix]:
+    """
+    解析 mqtt_log_*.txt / test_data/*.txt 的一行：
+    [时间] 主题 -> $GPCHC,...   或裸 $GPCHC 语句。
+    """
+    if "$GPCHC" not in line:
+        return None
+    m = _RE_TOPIC.search(line)
+    fallback_t = file_time + idx_in_file * FILE_LINE_STEP_S if file_time is not None else None
+    return parse_gpchc(line, recv_t=parse_bracket_timestamp(line),
+                       device=m.group(1) if m else "", fallback_t=fallback_t)
+
+
+def iter_lines_with_offsets(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[tuple]:
+    """按行读取文件（二进制方式，保证偏移精确），产出 (行起始偏移, 行结束偏移, 文本)。只产出完整行。"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        off = start
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            nxt = off + len(raw)
+            if end is not None and nxt > end:
+                break
+            yield off, nxt, raw.decode("utf-8", errors="ignore")
+            off = nxt
+
+
+def iter_file_fixes(path: str) -> Iterator[Fix]:
+    """逐行流式解析一个日志文件（常量内存）。"""
+    file_time = parse_timestamp_from_filename(path)
+    idx = 0
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            fix = parse_log_line(line, file_time, idx)
+            if fix is not None:
+                yield fix
+                idx += 1
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+实时数据源：跟踪 mqtt_sub_*.py 正在写入的 mqtt_log_running.txt
+- 启动时定位到文件末尾，只处理之后新追加的行（不回读历史）
+- 文件被重命名/替换（订阅端重启）后，从新文件开头继续
+- 解析出的 Fix 按注册顺序分发给各消费者（统计、偏差、预取等）
+- 可设置处理阶段 stage（如 fix_filter.FixFilter）：普通订阅者只收到通过的点，
+  raw=True 的订阅者（如健康统计）收到全部原始点
+"""
+import os
+import time
+import threading
+from typing import Callable, List, Optional
+
+from gpchc import Fix, parse_log_line
+from profiling import sampled
+
+POLL_S = 0.05  # 轮询间隔；100Hz 数据每次约 5 行
+
+
+class LiveFeed:
+    """尾随日志文件并把新 Fix 分发给订阅者。"""
+
+    def __init__(self, path: str, poll_s: float = POLL_S,
+                 stage: Optional[Callable[[Fix], Optional[Fix]]] = None):
+        self.path = path
+        self.poll_s = poll_s
+        self.stage = stage
+        self.subscribers: List[Callable[[Fix], None]] = []
+        self.raw_subscribers: List[Callable[[Fix], None]] = []
+        self.lines = 0
+        self.fixes = 0
+        self.parse_errors = 0
+        self.rejected = 0
+        self.subscriber_errors = 0
+        self._pos = None
+        self._ino = None
+        self._buf = b""
+
+    def subscribe(self, fn: Callable[[Fix], None], raw: bool = False) -> None:
+        (self.raw_subscribers if raw else self.subscribers).append(fn)
+
+    def _dispatch(self, fns, fix: Fix) -> None:
+        for fn in fns:
+            try:
+                fn(fix)
+            except Exception:
+                self.subscriber_errors += 1
+
+    def publish(self, fix: Fix) -> None:
+        """把一条 Fix 依次交给订阅者；单个订阅者异常不影响其余订阅者。"""
+        self.fixes += 1
+        self._dispatch(self.raw_subscribers, fix)
+        if self.stage is not None:
+            fix = self.stage(fix)
+            if fix is None:
+                self.rejected += 1
+                return
+        self._dispatch(self.subscribers, fix)
+
+    @sampled("ingest")
+    def feed_line(self, line: str, recv_t: float = None) -> None:
+        """处理一行日志文本（也供回放/基准测试直接调用）。"""
+        self.lines += 1
+        fix = parse_log_line(line)
+        if fix is None:
+            if "$GPCHC" in line:
+                self.parse_errors += 1
+            return
+        if fix.recv_t is None and recv_t is not None:
+            fix = fix._replace(recv_t=recv_t)
+        self.publish(fix)
+
+    def poll_once(self) -> int:
+        """读取一次新增内容，返回处理的行数。"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            # 尚未开始记录或订阅端退出时已改名：之后出现的文件全部是新数据
+            self._pos, self._ino, self._buf = 0, None, b""
+            return 0
+        if self._pos is None:
+            self._pos, self._ino = st.st_size, st.st_ino
+        elif st.st_ino != self._ino or st.st_size < self._pos:
+            self._pos, self._ino, self._buf = 0, st.st_ino, b""
+        if st.st_size == self._pos:
+            return 0
+        with open(self.path, "rb") as f:
+            f.seek(self._pos)
+            data = f.read(st.st_size - self._pos)
+        self._pos += len(data)
+        data = self._buf + data
+        lines = data.split(b"\n")
+        self._buf = lines.pop()
+        now = time.time()
+        n = 0
+        for raw in lines:
+            if raw.strip():
+                self.feed_line(raw.decode("utf-8", errors="ignore"), now)
+                n += 1
+        return n
+
+    def run(self, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            if not self.poll_once():
+                stop_event.wait(self.poll_s)
+
+    def start(self, stop_event: threading.Event) -> threading.Thread:
+        t = threading.Thread(target=self.run, args=(stop_event,), daemon=True)
+        t.start()
+        return t
+
+    def stats(self) -> dict:
+        return {
+            "path": os.path.basename(self.path),
+            "lines": self.lines,
+            "fixes": self.fixes,
+            "parse_errors": self.parse_errors,
+            "rejected": self.rejected,
+            "subscriber_errors": self.subscriber_errors,
+        }
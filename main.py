@@ -6,10 +6,47 @@ import shutil
 import threading
 import webbrowser
 import socket
+import json
+import fnmatch
+import re
+from urllib.parse import urlsplit, parse_qs, unquote
 from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
+from live_feed import LiveFeed
+from gnss_stats import HealthAggregator
+from fix_filter import FixFilter
+from tile_prefetch import TileCache, Prefetcher, load_tile, tile_stamp
+from profiling import sampled, start as start_profiling
+
 PORT = int(os.getenv("PORT", 8000))
 WEB_DIR = os.path.abspath(os.path.dirname(__file__))
+LIVE_LOG = os.path.join(WEB_DIR, "mqtt_log_running.txt")  # mqtt_sub_*.py 的运行中日志
+REF_LINES = os.getenv("REF_LINES", os.path.join(WEB_DIR, "reference_lines.geojson"))  # 规划参考线
+TILE_BLANK = os.getenv("TILE_BLANK", "png")  # 已记录的空白瓦片：png = 共享透明 PNG，204 = 无内容
+TERRAIN_MAX_AGE = int(os.getenv("TERRAIN_MAX_AGE", 30 * 86400))  # 地形瓦片缓存时长（URL 带版本号）
+COG_DIR = os.getenv("COG_DIR", os.path.join(WEB_DIR, "cog"))           # 动态切片的 COG 目录（cog_tiler.py convert）
+COG_PROCESSES = int(os.getenv("COG_PROCESSES", 0))                     # 渲染进程数，0 = CPU 数
+COG_CACHE_MB = int(os.getenv("COG_CACHE_MB", 256))                     # 内存 LRU 上限
+COG_DISK_CACHE = os.getenv("COG_DISK_CACHE", "")                       # 磁盘缓存目录，空 = 不启用
+TILE_CACHE_MB = int(os.getenv("TILE_CACHE_MB", 128))                   # 瓦片内存缓存上限（含预取）
+PREFETCH_S = float(os.getenv("PREFETCH_S", 20))                        # 沿路线预取的预测时长，0 = 不预取
+MODEL_CACHE = os.getenv("MODEL_CACHE", os.path.join(WEB_DIR, "model_cache"))  # STL → GLB 转换结果
+MODEL_MAX_MB = int(os.getenv("MODEL_MAX_MB", 512))                     # 上传 STL 大小上限
+MODEL_CACHE_MB = int(os.getenv("MODEL_CACHE_MB", 2048))                 # model_cache 总体积上限（超出删最久未用）
+
+# 实时数据：跟踪运行中日志，经粗差剔除后分发给各消费者（健康统计看原始数据）
+fix_filter = FixFilter()
+live_feed = LiveFeed(LIVE_LOG, stage=fix_filter)
+health = HealthAggregator()
+live_feed.subscribe(health, raw=True)
+_latest = {}
+live_feed.subscribe(lambda fix: _latest.__setitem__(fix.device, fix))
+# 瓦片缓存与沿路线预取（缩放级 / 瓦片集取自客户端最近的请求）
+tile_cache = TileCache(TILE_CACHE_MB << 20)
+prefetcher = Prefetcher(tile_cache, lambda *key: load_tile(_get_tile_reader(), *key), horizon_s=PREFETCH_S,
+                        stamp=tile_stamp)
+if PREFETCH_S > 0:
+    live_feed.subscribe(prefetcher)
 
 def _purge_py_caches(root: str) -> None:
     """删除 __pycache__ 目录与 *.pyc 缓存文件。"""
@@ -23,13 +60,404 @@ def _purge_py_caches(root: str) -> None:
                 except OSError:
                     pass
 
+def _resolve_ref(name: str) -> str:
+    """参考线文件：缺省为 REF_LINES，否则只允许 WEB_DIR 下的 *.geojson。"""
+    if not name:
+        path = REF_LINES
+    else:
+        base = os.path.basename(name)
+        if not base.lower().endswith(".geojson"):
+            raise FileNotFoundError(base)
+        path = os.path.join(WEB_DIR, base)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(os.path.basename(path))
+    return path
+
+def _resolve_log(name: str) -> str:
+    """只允许访问 WEB_DIR 下的 mqtt_log_*.txt，防止路径穿越。"""
+    base = os.path.basename(name or "")
+    if not fnmatch.fnmatch(base, "mqtt_log_*.txt"):
+        raise FileNotFoundError(base)
+    path = os.path.join(WEB_DIR, base)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(base)
+    return path
+
+# ========== 接口 ==========
+_track_store = None
+
+def _get_track_store():
+    global _track_store
+    if _track_store is None:
+        from track_codec import TrackStore
+        _track_store = TrackStore()
+    return _track_store
+
+def api_track_index(handler, query):
+    """GET /api/track/index?log=mqtt_log_xxx.txt → 分段索引 JSON"""
+    handler.send_json(_get_track_store().index(_resolve_log(query.get("log", ""))))
+
+def api_track_segment(handler, query):
+    """GET /api/track/segment?log=...&seg=N → GTRK 二进制段"""
+    path = _resolve_log(query.get("log", ""))
+    buf = _get_track_store().segment(path, int(query.get("seg", "0")))
+    handler.send_bytes(buf, "application/octet-stream")
+
+def api_stats(handler, query):
+    """GET /api/stats[?device=/dtu_serial_rx] → 实时健康统计快照"""
+    snap = health.snapshot(query.get("device"), now=time.time())
+    snap["feed"] = live_feed.stats()
+    handler.send_json(snap)
+
+_deviation = None
+_deviation_reports = {}
+
+def start_deviation_tracker() -> None:
+    """存在参考线文件时，把偏差计算接入实时数据。"""
+    global _deviation
+    if not os.path.isfile(REF_LINES):
+        return
+    from deviation import ReferenceLines, DeviationTracker
+    _deviation = DeviationTracker(ReferenceLines.from_geojson(REF_LINES))
+    live_feed.subscribe(_deviation)
+
+def api_deviation_live(handler, query):
+    """GET /api/deviation/live?since=SEQ → 新增逐点偏差 + 当前趟 / 最近趟统计"""
+    if _deviation is None:
+        raise FileNotFoundError(os.path.basename(REF_LINES))
+    handler.send_json(_deviation.snapshot(int(query.get("since", "0"))))
+
+def api_deviation_report(handler, query):
+    """GET /api/deviation/report?log=mqtt_log_xxx.txt[&ref=xxx.geojson] → 整个日志的分趟偏差报告"""
+    from deviation import ReferenceLines, report_for_log
+    log = _resolve_log(query.get("log", ""))
+    ref = _resolve_ref(query.get("ref", ""))
+    st, rst = os.stat(log), os.stat(ref)
+    stamp = (st.st_size, st.st_mtime, rst.st_mtime)
+    # 每个 (日志, 参考线) 只保留最新一份：运行中的日志持续增长，按版本累积会无限占用内存
+    cached = _deviation_reports.get((log, ref))
+    if cached is None or cached[0] != stamp:
+        cached = _deviation_reports[(log, ref)] = (stamp, report_for_log(ReferenceLines.from_geojson(ref), log))
+    handler.send_json(cached[1])
+
+def api_export(handler, query):
+    """
+    GET /api/export?log=a.txt,b.txt&format=gpx[&simplify=0.5&every=1&bbox=...&min_quality=..&clean=1]
+    log=test_data 时导出 test_data 目录；clean=1 时经粗差剔除；响应为分块传输，服务端常量内存。
+    """
+    from track_export import FORMATS, pipeline, _parse_bbox
+    fmt = query.get("format", "geojsonseq")
+    if fmt not in FORMATS:
+        raise ValueError(f"format: {fmt}")
+    names = [n for n in query.get("log", "").split(",") if n]
+    if not names:
+        raise ValueError("log")
+    sources = [os.path.join(WEB_DIR, "test_data") if n == "test_data" else _resolve_log(n) for n in names]
+    filters = dict(bbox=_parse_bbox(query.get("bbox", "")), every=int(query.get("every", "1")),
+                   min_quality=int(query["min_quality"]) if "min_quality" in query else None)
+    stage = FixFilter().process if query.get("clean") == "1" else None
+    chunks = pipeline(sources, fmt, simplify_m=float(query.get("simplify", "0")), stage=stage, **filters)
+    first = next(chunks, b"")  # 先取第一块，参数/依赖错误仍能返回 400
+    name = os.path.splitext(os.path.basename(sources[0]))[0] + FORMATS[fmt][0]
+    handler.send_chunked(first, chunks, FORMATS[fmt][1],
+                         {"Content-Disposition": f'attachment; filename="{name}"'})
+
+def api_filter_stats(handler, query):
+    """GET /api/filter/stats → 粗差剔除 / 中断计数与最近剔除记录"""
+    handler.send_json(fix_filter.stats())
+
+def api_cog_stats(handler, query):
+    """GET /api/cog/stats → 动态切片的缓存命中与渲染耗时"""
+    handler.send_json(_get_cog_server().stats())
+
+def api_prefetch_stats(handler, query):
+    """GET /api/prefetch/stats → 瓦片缓存命中率、预取命中 / 浪费与当前预取目标"""
+    handler.send_json({"cache": tile_cache.stats(), "prefetch": prefetcher.stats()})
+
+_model_cache = None
+
+def _get_model_cache():
+    global _model_cache
+    if _model_cache is None:
+        from stl_glb import ModelCache
+        _model_cache = ModelCache(MODEL_CACHE, max_bytes=MODEL_CACHE_MB << 20)
+    return _model_cache
+
+def api_model_upload(handler, query):
+    """
+    POST /api/model/upload[?name=part.stl&budgets=200000,50000,10000]，请求体为 STL（budgets 见 stl_glb.check_budgets）
+    → {id, lods: [{triangles, bytes, url, …}], stl_bytes, …}；同一内容再次上传直接返回缓存结果
+    """
+    data = handler.read_body(MODEL_MAX_MB << 20)   # 先读完请求体，400 才能送达客户端
+    budgets = [b for b in query.get("budgets", "").split(",") if b] or None   # put() 内用 check_budgets 校验
+    meta = _get_model_cache().put(data, query.get("name", ""), budgets)
+    for lod in meta["lods"]:
+        lod["url"] = f"api/model/glb?id={meta['id']}&lod={lod['lod']}"
+    handler.send_json(meta)
+
+def api_model_glb(handler, query):
+    """GET /api/model/glb?id=..&lod=N → GLB（内容寻址，可长期缓存）"""
+    path = _get_model_cache().glb_path(query.get("id", ""), int(query.get("lod", "0")))
+    with open(path, "rb") as f:
+        data = f.read()
+    handler.cache_control = "public, max-age=31536000, immutable"
+    handler.send_bytes(data, "model/gltf-binary")
+
+def api_live_latest(handler, query):
+    """GET /api/live/latest → 每台设备最近一条通过粗差剔除的定位（供页面轮询，代替读 test_data 原始文本）"""
+    handler.send_json({dev: fix._asdict() for dev, fix in list(_latest.items())})
+
+API_ROUTES = {
+    "/api/track/index": api_track_index,
+    "/api/track/segment": api_track_segment,
+    "/api/stats": api_stats,
+    "/api/filter/stats": api_filter_stats,
+    "/api/cog/stats": api_cog_stats,
+    "/api/live/latest": api_live_latest,
+    "/api/prefetch/stats": api_prefetch_stats,
+    "/api/model/glb": api_model_glb,
+    "/api/deviation/live": api_deviation_live,
+    "/api/deviation/report": api_deviation_report,
+    "/api/export": api_export,
+}
+
+POST_ROUTES = {
+    "/api/model/upload": api_model_upload,
+}
+
+# ========== 瓦片 ==========
+_TILE_RE = re.compile(r"^/(?P<root>.+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.(?P<ext>png|jpg|jpeg|webp)$")
+_TILE_TYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}
+_tile_reader = None
+_blank_png = None
+
+def _get_tile_reader():
+    global _tile_reader
+    if _tile_reader is None:
+        from tile_store import TileReader
+        _tile_reader = TileReader()
+    return _tile_reader
+
+def _send_blank_tile(handler):
+    global _blank_png
+    if TILE_BLANK == "204":
+        handler.send_response(204)
+        handler.send_header("Content-Length", "0")
+        handler.end_headers()
+        return
+    if _blank_png is None:
+        from tile_store import blank_png
+        _blank_png = blank_png()
+    handler.send_bytes(_blank_png, "image/png")
+
+def serve_tile(handler, path: str) -> bool:
+    """
+    瓦片请求：/tiles/<name>/{z}/{x}/{y}.ext 读取 WEB_DIR/<name>.mbtiles；目录布局（如 map/{z}/{x}/{y}.png）
+    读取对应文件，不存在但记录为空白的瓦片返回空白瓦片。两者都经 tile_cache（预取目标，按文件大小 + 修改时间
+    校验版本，重切后立即可见），其余交给静态文件处理。
+    """
+    m = _TILE_RE.match(unquote(path))
+    if m is None:
+        return False
+    root, ext = m["root"], m["ext"]
+    z, x, y = int(m["z"]), int(m["x"]), int(m["y"])
+    from tile_store import BLANK, sniff_format
+    if root.startswith("tiles/") and "/" not in root[6:]:
+        mb = os.path.join(WEB_DIR, os.path.basename(root[6:]) + ".mbtiles")
+        if not os.path.isfile(mb):
+            raise FileNotFoundError(os.path.basename(mb))
+        src = ("mbtiles", mb)
+    else:
+        tdir = os.path.normpath(os.path.join(WEB_DIR, *root.split("/")))
+        if not tdir.startswith(WEB_DIR + os.sep):
+            return False
+        src = ("dir", tdir, ext)
+    key = (src, z, x, y)
+    stamp = tile_stamp(*key)
+    data = tile_cache.get(key, stamp)
+    if data is None:
+        data = load_tile(_get_tile_reader(), src, z, x, y)
+        if data is None:
+            if src[0] == "mbtiles":
+                raise FileNotFoundError(f"{z}/{x}/{y}")
+            return False
+        tile_cache.put(key, data, stamp=stamp)
+    prefetcher.note_request(src, z)
+    if data == BLANK:
+        _send_blank_tile(handler)
+    else:
+        # AUTO 编码的瓦片集中同一扩展名下可能混有 JPEG / WEBP / PNG
+        handler.send_bytes(data, _TILE_TYPES[sniff_format(data) or ext])
+    return True
+
+# ========== COG 动态切片 ==========
+_COG_RE = re.compile(r"^/cog/(?P<name>[^/]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)(?:\.(?P<ext>png|jpg|jpeg|webp))?$")
+_cog_server = None
+_cog_lock = threading.Lock()
+
+def _get_cog_server():
+    global _cog_server
+    with _cog_lock:
+        if _cog_server is None:
+            from cog_tiler import CogServer
+            _cog_server = CogServer(COG_DIR, processes=COG_PROCESSES, cache_bytes=COG_CACHE_MB << 20,
+                                    disk_cache=COG_DISK_CACHE or None)
+        return _cog_server
+
+def serve_cog(handler, path: str) -> bool:
+    """/cog/<dataset>/{z}/{x}/{y}[.png|.jpg|.webp]：COG_DIR/<dataset>.tif 按需渲染（缺省 PNG）。"""
+    m = _COG_RE.match(unquote(path))
+    if m is None:
+        return False
+    ext = m["ext"] or "png"
+    data = _get_cog_server().get(m["name"], int(m["z"]), int(m["x"]), int(m["y"]), ext)
+    from tile_store import BLANK
+    if data == BLANK:
+        _send_blank_tile(handler)
+    else:
+        handler.send_bytes(data, _TILE_TYPES[ext])
+    return True
+
+# ========== 地形 ==========
+_TERRAIN_RE = re.compile(r"^/terrain/(?P<name>[^/]+)/(?:layer\.json|(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.terrain)$")
+
+def serve_terrain(handler, path: str) -> bool:
+    """
+    Cesium 地形：/terrain/<name>/layer.json 与 /terrain/<name>/{z}/{x}/{y}.terrain（terrain.py 生成，gzip 存储）。
+    客户端接受 gzip 时原样发送（Content-Encoding: gzip），否则解压；ETag 命中返回 304。
+    瓦片 URL 带 layer.json 的版本号，可长期缓存；layer.json 每次重新验证。
+    """
+    m = _TERRAIN_RE.match(unquote(path))
+    if m is None:
+        return False
+    tdir = os.path.join(WEB_DIR, "terrain", os.path.basename(m["name"]))
+    if m["z"] is None:
+        fp = os.path.join(tdir, "layer.json")
+    else:
+        fp = os.path.join(tdir, m["z"], m["x"], m["y"] + ".terrain")
+    if not os.path.isfile(fp):
+        raise FileNotFoundError(os.path.relpath(fp, WEB_DIR))
+    st = os.stat(fp)
+    gz = m["z"] is not None and "gzip" in (handler.headers.get("Accept-Encoding") or "")
+    etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}{"" if gz or m["z"] is None else "-id"}"'
+    handler.cache_control = "no-cache" if m["z"] is None else f"public, max-age={TERRAIN_MAX_AGE}"
+    if etag in (handler.headers.get("If-None-Match") or ""):
+        handler.send_response(304)
+        handler.send_header("ETag", etag)
+        handler.end_headers()
+        return True
+    with open(fp, "rb") as f:
+        data = f.read()
+    headers = {"ETag": etag}
+    if m["z"] is None:
+        ctype = "application/json; charset=utf-8"
+    else:
+        ctype = "application/vnd.quantized-mesh"
+        if gz:
+            headers["Content-Encoding"] = "gzip"
+        else:
+            import gzip
+            data = gzip.decompress(data)
+    handler.send_bytes(data, ctype, headers=headers)
+    return True
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
 class NoCacheHandler(SimpleHTTPRequestHandler):
-    """强制禁用缓存的静态服务器处理器。"""
+    """强制禁用缓存的静态服务器处理器（地形瓦片等显式设置 cache_control 的响应除外）。"""
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive 与分块传输
+    disable_nagle_algorithm = True  # 头与正文分两次写出，Nagle + 延迟确认会让每个 keep-alive 请求多等约 40 ms
+    cache_control = None
+
+    @sampled("http")
+    def do_GET(self):
+        url = urlsplit(self.path)
+        fn = API_ROUTES.get(url.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.cache_control = None
+        try:
+            if fn is None:
+                if not (serve_tile(self, url.path) or serve_terrain(self, url.path) or serve_cog(self, url.path)):
+                    super().do_GET()
+                return
+            fn(self, query)
+        except FileNotFoundError as e:
+            self.send_json({"error": f"not found: {e}"}, 404)
+        except (ValueError, IndexError, KeyError) as e:
+            self.send_json({"error": str(e) or type(e).__name__}, 400)
+
+    @sampled("http")
+    def do_POST(self):
+        url = urlsplit(self.path)
+        fn = POST_ROUTES.get(url.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.cache_control = None
+        if fn is None:
+            self.close_connection = True  # 未读取的请求体不能留在 keep-alive 连接上
+            self.send_json({"error": f"not found: {url.path}"}, 404)
+            return
+        try:
+            fn(self, query)
+        except FileNotFoundError as e:
+            self.close_connection = True
+            self.send_json({"error": f"not found: {e}"}, 404)
+        except (ValueError, IndexError, KeyError) as e:
+            self.close_connection = True
+            self.send_json({"error": str(e) or type(e).__name__}, 400)
+
+    def read_body(self, limit: int) -> bytes:
+        """读取 Content-Length 指定的请求体；超过 limit 时不读取并断开连接。"""
+        n = int(self.headers.get("Content-Length") or 0)
+        if n <= 0:
+            raise ValueError("请求体为空")
+        if n > limit:
+            self.close_connection = True
+            raise ValueError(f"请求体超过 {limit >> 20} MB")
+        return self.rfile.read(n)
+
+    def send_bytes(self, body: bytes, content_type: str, status: int = 200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_chunked(self, first: bytes, rest, content_type: str, headers=None):
+        """Transfer-Encoding: chunked 流式响应。"""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        try:
+            for chunk in _prepend(first, rest):
+                if chunk:
+                    self.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        except Exception:
+            # 流已开始，无法再返回错误码：直接断开连接
+            self.close_connection = True
+
+    def send_json(self, obj, status: int = 200):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_bytes(body, "application/json; charset=utf-8", status)
+
     def end_headers(self):
-        # 彻底禁止缓存
-        self.send_header("Cache-Control", "no-store, no-cache, must-revalidate, max-age=0")
-        self.send_header("Pragma", "no-cache")
-        self.send_header("Expires", "0")
+        if self.cache_control:
+            self.send_header("Cache-Control", self.cache_control)
+        else:
+            # 彻底禁止缓存
+            self.send_header("Cache-Control", "no-store, no-cache, must-revalidate, max-age=0")
+            self.send_header("Pragma", "no-cache")
+            self.send_header("Expires", "0")
         self.send_header("Vary", "Accept-Encoding")
         super().end_headers()
 
@@ -54,13 +482,18 @@ def start_server(stop_event: threading.Event):
             httpd.handle_request()
 
 if __name__ == "__main__":
-    # 1) 清理 Python 字节码缓存
+    # 1) 清理 Python 字节码缓存；PROFILE 环境变量开启性能采样（见 profiling.py）
     _purge_py_caches(WEB_DIR)
+    start_profiling()
 
-    # 2) 启动服务器
+    # 2) 启动服务器与实时数据跟踪
     stop_event = threading.Event()
     t = threading.Thread(target=start_server, args=(stop_event,), daemon=True)
     t.start()
+    start_deviation_tracker()
+    live_feed.start(stop_event)
+    if PREFETCH_S > 0:
+        prefetcher.start(stop_event)
 
     # 3) 打开浏览器，并带时间戳避免历史缓存
     ts = int(time.time() * 1000)
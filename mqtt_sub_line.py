@@ -7,6 +7,8 @@ import atexit
 from datetime import datetime
 from time import sleep
 
+from profiling import sampled, start as start_profiling
+
 # ========== MQTT 服务器信息 ==========
 MQTT_BROKER = "47.101.130.178"
 MQTT_PORT = 9003
@@ -52,6 +54,7 @@ def _fmt_sec_filename(dt: datetime) -> str:
     """返回秒级文件名：YYYY_MM_DD_HH_MM_SS.txt"""
     return f"{dt.strftime('%Y_%m_%d_%H_%M_%S')}.txt"
 
+@sampled("mqtt")
 def on_message(client, userdata, msg):
     message = msg.payload.decode("utf-8", errors="ignore")
     now = datetime.now()
@@ -88,6 +91,7 @@ def on_message(client, userdata, msg):
 
 # ========== 主程序 ==========
 def main():
+    start_profiling()  # PROFILE 环境变量开启性能采样（见 profiling.py）
     client = mqtt.Client()
     client.username_pw_set(MQTT_USER, MQTT_PASS)
     client.on_connect = on_connect
@@ -6,6 +6,8 @@ import sys
 import atexit
 from datetime import datetime
 
+from profiling import sampled, start as start_profiling
+
 # MQTT 服务器信息
 MQTT_BROKER = "47.101.130.178"
 MQTT_PORT = 9003
@@ -45,6 +47,7 @@ def on_connect(client, userdata, flags, rc):
 
 
 # 消息回调
+@sampled("mqtt")
 def on_message(client, userdata, msg):
     message = msg.payload.decode("utf-8", errors="ignore")
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -60,6 +63,7 @@ def on_message(client, userdata, msg):
 
 def main():
     # 创建客户端
+    start_profiling()  # PROFILE 环境变量开启性能采样（见 profiling.py）
     client = mqtt.Client()
     client.username_pw_set(MQTT_USER, MQTT_PASS)  # 设置用户名和密码
     client.on_connect = on_connect
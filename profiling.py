@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+生产环境可选的性能采样（默认关闭，关闭时被装饰函数原样返回、零开销）
+- PROFILE=cpu：被 @sampled(name) 装饰的入口（HTTP 请求、MQTT on_message、实时解析、切片任务）
+  每 PROFILE_SAMPLE 次调用取 1 次用 cProfile 记录，按 name 累加；各线程分别记录后合并
+- PROFILE=mem：tracemalloc 跟踪分配，周期性输出占用最多的代码行及与上一周期的增量
+- 每 PROFILE_EVERY_S 秒（及进程退出时）写出到 PROFILE_DIR：
+  <name>-<pid>-<时间>.prof（pstats，可用 snakeviz / python -m pstats 查看）+ 同名 .txt 摘要；mem-<pid>-<时间>.txt
+- 切片进程池的子进程各自写出（文件名带 pid）
+用法：
+  PROFILE=cpu,mem PROFILE_EVERY_S=300 python main.py
+  python -m pstats profiles/http-1234-20251116_150000.prof
+"""
+import os
+import io
+import time
+import atexit
+import pstats
+import multiprocessing.util
+import cProfile
+import threading
+import tracemalloc
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+PROFILE = {p.strip() for p in os.getenv("PROFILE", "").lower().split(",") if p.strip()}
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.abspath(os.path.dirname(__file__)), "profiles"))
+PROFILE_EVERY_S = float(os.getenv("PROFILE_EVERY_S", 60))
+PROFILE_SAMPLE = max(1, int(os.getenv("PROFILE_SAMPLE", 20)))   # 每 N 次调用采样 1 次
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", 30))                 # 摘要中列出的行数
+MEM_FRAMES = 10
+
+_lock = threading.Lock()
+_stats: Dict[str, pstats.Stats] = {}
+_calls: Dict[str, int] = {}
+_samples: Dict[str, int] = {}
+_started_pid: Optional[int] = None
+_last_snapshot = None
+_local = threading.local()
+
+
+def sampled(name: str) -> Callable:
+    """装饰器：PROFILE 含 cpu 时按 PROFILE_SAMPLE 抽样记录 cProfile，否则原样返回函数。"""
+    def deco(fn):
+        if "cpu" not in PROFILE:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start()
+            with _lock:
+                n = _calls[name] = _calls.get(name, 0) + 1
+            if n % PROFILE_SAMPLE or getattr(_local, "active", False):
+                return fn(*args, **kwargs)
+            # 同一线程内嵌套的被装饰函数不再单独记录（已包含在外层记录中）
+            prof = cProfile.Profile()
+            _local.active = True
+            try:
+                return prof.runcall(fn, *args, **kwargs)
+            finally:
+                _local.active = False
+                _add(name, prof)
+        return wrapper
+    return deco
+
+
+def _add(name: str, prof: cProfile.Profile) -> None:
+    prof.create_stats()
+    with _lock:
+        _samples[name] = _samples.get(name, 0) + 1
+        st = _stats.get(name)
+        if st is None:
+            _stats[name] = pstats.Stats(prof)
+        else:
+            st.add(prof)
+
+
+def start() -> None:
+    """启动周期写出线程（与 tracemalloc）；每个进程一次，fork 出的子进程会重新启动。"""
+    global _started_pid
+    if not PROFILE or _started_pid == os.getpid():
+        return
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        _stats.clear()
+        _calls.clear()
+        _samples.clear()
+    if "mem" in PROFILE and not tracemalloc.is_tracing():
+        tracemalloc.start(MEM_FRAMES)
+    threading.Thread(target=_dump_loop, daemon=True).start()
+    if multiprocessing.parent_process() is not None:
+        # 进程池子进程以 os._exit 退出，不执行 atexit，只执行 multiprocessing 的终结器
+        multiprocessing.util.Finalize(None, dump, exitpriority=10)
+    else:
+        atexit.register(dump)
+
+
+def _dump_loop() -> None:
+    while True:
+        time.sleep(PROFILE_EVERY_S)
+        try:
+            dump()
+        except Exception:
+            pass
+
+
+def dump() -> None:
+    """写出本周期的 CPU / 内存采样并清空累计。"""
+    global _last_snapshot
+    with _lock:
+        stats, samples = dict(_stats), dict(_samples)
+        _stats.clear()
+        _samples.clear()
+    if not stats and "mem" not in PROFILE:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tag = f"{os.getpid()}-{time.strftime('%Y%m%d_%H%M%S')}"
+    for name, st in stats.items():
+        base = os.path.join(PROFILE_DIR, f"{name}-{tag}")
+        st.dump_stats(base + ".prof")
+        buf = io.StringIO()
+        print(f"{name}: {samples.get(name, 0)} sampled calls (1 in {PROFILE_SAMPLE})", file=buf)
+        pstats.Stats(base + ".prof", stream=buf).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+    if "mem" in PROFILE and tracemalloc.is_tracing():
+        snap = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+        cur, peak = tracemalloc.get_traced_memory()
+        lines = [f"traced {cur / 1048576:.1f} MB, peak {peak / 1048576:.1f} MB", "", "top by line:"]
+        lines += [str(s) for s in snap.statistics("lineno")[:PROFILE_TOP]]
+        if _last_snapshot is not None:
+            lines += ["", "growth since last dump:"]
+            lines += [str(s) for s in snap.compare_to(_last_snapshot, "lineno")[:PROFILE_TOP]]
+        _last_snapshot = snap
+        with open(os.path.join(PROFILE_DIR, f"mem-{tag}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
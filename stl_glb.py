@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+"""
+STL → GLB 模型预处理（panel6.html 姿态播放器用 GLTFLoader + DRACOLoader 加载，代替主线程解析原始 STL）
+- 读取二进制 / ASCII STL，合并重复顶点（STL 每个三角形独立存 3 个顶点，合并后顶点数约为原来的 1/6）
+- 二次误差度量（QEM）简化：Lindstrom 的二次误差顶点聚类——每个顶点累积相邻面的平面二次型，
+  按网格聚类后解每个格子的最优位置；网格分辨率二分搜索到三角形预算。全程 NumPy 向量化，
+  百万面级 CAD 导出也只需数秒（逐边折叠的纯 Python 实现要慢两个数量级）
+- 多级 LOD（LOD_BUDGETS），每级一个 GLB；装有 DracoPy 时使用 KHR_draco_mesh_compression，
+  否则写普通 GLB（float32 位置 + uint16/uint32 索引）
+- 结果按 STL 内容 + 参数的哈希缓存到 model_cache/<id>/（lod0.glb … + meta.json），同一文件再次上传直接命中
+- main.py：POST /api/model/upload（请求体为 STL）→ 各级 LOD 地址与体积 / 耗时统计；
+  GET /api/model/glb?id=..&lod=N → GLB（内容寻址，长缓存）
+用法：
+  python stl_glb.py convert part.stl [--budgets 200000,50000,10000] [--no-draco]   # 输出体积 / 解析耗时对比
+  python stl_glb.py bench [--triangles 1000000]                                      # 合成模型，普通 GLB 与 Draco 各转换一次
+"""
+import os
+import sys
+import shutil
+import json
+import math
+import time
+import hashlib
+import argparse
+import struct
+import tempfile
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+LOD_BUDGETS = (200000, 50000, 10000)
+MAX_LODS = 4                  # 单次转换最多几级（每级一次简化）
+MAX_BUDGET = 2000000          # 单级三角形预算上限
+CACHE_MAX_BYTES = 2 << 30     # model_cache 总体积上限，超出时删除最久未用的模型
+PIPELINE_VERSION = 1          # 算法或输出格式变化时加一，旧缓存自动失效
+WELD_EPS = 1e-6               # 顶点合并容差（相对包围盒对角线）
+DRACO_QUANT_BITS = 14
+DRACO_LEVEL = 7
+
+_STL_DTYPE = np.dtype([("normal", "<f4", (3,)), ("v", "<f4", (3, 3)), ("attr", "<u2")])
+
+
+# ========== 读取 / 合并 ==========
+def read_stl(data: bytes) -> np.ndarray:
+    """STL 字节 → (N, 3, 3) float32 三角形顶点。"""
+    if len(data) >= 84:
+        n = struct.unpack_from("<I", data, 80)[0]
+        if 84 + 50 * n == len(data):
+            return np.frombuffer(data, _STL_DTYPE, n, 84)["v"].copy()
+    head = data[:512].lstrip().lower()
+    if not head.startswith(b"solid"):
+        raise ValueError("不是有效的 STL 文件")
+    # ASCII：只取 vertex 行的 3 个数
+    text = data.decode("ascii", errors="ignore")
+    vals = [ln.split()[1:4] for ln in text.splitlines() if ln.lstrip().startswith("vertex")]
+    if not vals or len(vals) % 3:
+        raise ValueError("ASCII STL 中的顶点数不是 3 的倍数")
+    return np.asarray(vals, dtype=np.float32).reshape(-1, 3, 3)
+
+
+def weld(tris: np.ndarray, eps: float = WELD_EPS) -> Tuple[np.ndarray, np.ndarray]:
+    """合并容差内的重复顶点，去掉退化与重复三角形 → (vertices float32 (V,3), faces uint32 (F,3))。"""
+    pts = tris.reshape(-1, 3).astype(np.float64)
+    lo, hi = pts.min(axis=0), pts.max(axis=0)
+    tol = max(float(np.linalg.norm(hi - lo)) * eps, 1e-12)
+    q = np.round((pts - lo) / tol).astype(np.int64)
+    _, first, inv = np.unique(_row_keys(q), return_index=True, return_inverse=True)
+    verts = pts[first].astype(np.float32)
+    faces = inv.reshape(-1, 3)
+    return verts, _clean_faces(faces).astype(np.uint32)
+
+
+def _row_keys(a: np.ndarray) -> np.ndarray:
+    """(N, 3) 非负整数 → 每行一个可排序的键；能装进 int64 时用一维键（比 np.unique(axis=0) 快一个数量级）。"""
+    span = int(a.max()) + 1 if len(a) else 1
+    if span ** 3 < 2 ** 63:
+        a = a.astype(np.int64)
+        return (a[:, 0] * span + a[:, 1]) * span + a[:, 2]
+    return np.ascontiguousarray(a.astype(np.int64)).view([("", np.int64)] * 3).ravel()
+
+
+def _clean_faces(faces: np.ndarray) -> np.ndarray:
+    """去掉有重复顶点的退化面与重复面（保留先出现的那个及其朝向）。"""
+    f = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    if not len(f):
+        return f
+    _, keep = np.unique(_row_keys(np.sort(f, axis=1)), return_index=True)
+    return f[np.sort(keep)]
+
+
+def _compact(verts: np.ndarray, faces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """删除未被引用的顶点并重排索引。"""
+    used, inv = np.unique(faces, return_inverse=True)
+    return verts[used], inv.reshape(-1, 3).astype(np.uint32)
+
+
+# ========== 简化 ==========
+_TRIU = np.triu_indices(4)
+
+
+def vertex_quadrics(verts: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """每个顶点的面积加权平面二次型（4×4 对称阵的上三角 10 项）→ (V, 10)。"""
+    v = verts.astype(np.float64)
+    a, b, c = v[faces[:, 0]], v[faces[:, 1]], v[faces[:, 2]]
+    n = np.cross(b - a, c - a)
+    area2 = np.linalg.norm(n, axis=1)
+    ok = area2 > 0
+    n[ok] /= area2[ok, None]
+    p = np.concatenate([n, -np.einsum("ij,ij->i", n, a)[:, None]], axis=1)        # (F, 4) 平面 [n, d]
+    fq = (p[:, :, None] * p[:, None, :])[:, _TRIU[0], _TRIU[1]] * (area2 / 2)[:, None]
+    q = np.zeros((len(v), 10))
+    for k in range(3):
+        np.add.at(q, faces[:, k], fq)
+    return q
+
+
+def _cluster(verts: np.ndarray, lo: np.ndarray, cell: float) -> Tuple[np.ndarray, np.ndarray]:
+    key = np.floor((verts - lo) / cell).astype(np.int64)
+    _, cid = np.unique(_row_keys(key), return_inverse=True)
+    return cid.ravel(), key
+
+
+def _cluster_faces(faces: np.ndarray, cid: np.ndarray) -> np.ndarray:
+    return _clean_faces(cid[faces])
+
+
+def _optimal_positions(verts: np.ndarray, q: np.ndarray, cid: np.ndarray, key: np.ndarray,
+                       lo: np.ndarray, cell: float) -> np.ndarray:
+    """每个格子求二次误差最小的位置（向格内顶点均值做 Tikhonov 正则，并夹紧在格子内）。"""
+    nc = int(cid.max()) + 1
+    cnt = np.bincount(cid, minlength=nc)[:, None]
+    mean = np.stack([np.bincount(cid, verts[:, k], nc) for k in range(3)], axis=1) / cnt
+    qs = np.stack([np.bincount(cid, q[:, k], nc) for k in range(10)], axis=1)
+    full = np.zeros((nc, 4, 4))
+    full[:, _TRIU[0], _TRIU[1]] = qs
+    full[:, _TRIU[1], _TRIU[0]] = qs
+    A, b = full[:, :3, :3], -full[:, :3, 3]
+    lam = (np.trace(A, axis1=1, axis2=2) / 3 * 1e-3 + 1e-12)[:, None]
+    x = np.linalg.solve(A + lam[:, :, None] * np.eye(3), (b + lam * mean)[:, :, None])[:, :, 0]
+    ckey = np.zeros((nc, 3), dtype=np.int64)
+    ckey[cid] = key
+    cmin = lo + ckey * cell
+    return np.clip(x, cmin, cmin + cell)
+
+
+def decimate(verts: np.ndarray, faces: np.ndarray, target: int,
+             q: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    二次误差顶点聚类到不超过 target 个三角形 → (vertices, faces, 格子边长)。
+    格子边长即简化误差的上界；q 为 vertex_quadrics() 结果（多级 LOD 共用）。
+    """
+    if len(faces) <= target:
+        return verts, faces, 0.0
+    v = verts.astype(np.float64)
+    if q is None:
+        q = vertex_quadrics(verts, faces)
+    lo = v.min(axis=0)
+    size = float((v.max(axis=0) - lo).max()) or 1.0
+    # 分辨率越高三角形越多：在 [2, 2^16] 个格子之间二分到不超过 target 的最大分辨率
+    best = None
+    a, b = 1.0, 16.0
+    for _ in range(18):
+        mid = (a + b) / 2
+        cell = size / 2 ** mid
+        cid, _ = _cluster(v, lo, cell)
+        f = _cluster_faces(faces, cid)
+        if len(f) <= target:
+            best, a = (cell, f), mid
+            if len(f) >= target * 0.95:
+                break
+        else:
+            b = mid
+        if b - a < 0.005:
+            break
+    if best is None:
+        cell = size / 2
+        cid, _ = _cluster(v, lo, cell)
+        best = (cell, _cluster_faces(faces, cid))
+    cell, f = best
+    cid, key = _cluster(v, lo, cell)
+    pos = _optimal_positions(v, q, cid, key, lo, cell).astype(np.float32)
+    nv, nf = _compact(pos, f)
+    return nv, nf, cell
+
+
+# ========== GLB ==========
+def draco_available() -> bool:
+    try:
+        import DracoPy  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _pad4(b: bytes, fill: bytes = b"\0") -> bytes:
+    return b + fill * (-len(b) % 4)
+
+
+def write_glb(verts: np.ndarray, faces: np.ndarray, draco: bool = False) -> bytes:
+    """单网格 GLB；draco=True 时几何数据为 KHR_draco_mesh_compression（需要 DracoPy）。"""
+    verts = np.ascontiguousarray(verts, dtype=np.float32)
+    pos_acc = {"componentType": 5126, "count": len(verts), "type": "VEC3",
+               "min": verts.min(axis=0).tolist(), "max": verts.max(axis=0).tolist()}
+    idx_type = 5123 if len(verts) < 65536 else 5125
+    idx_acc = {"componentType": idx_type, "count": int(faces.size), "type": "SCALAR"}
+    prim = {"attributes": {"POSITION": 0}, "indices": 1, "mode": 4}
+    gltf = {"asset": {"version": "2.0", "generator": "stl_glb.py"}, "scene": 0,
+            "scenes": [{"nodes": [0]}], "nodes": [{"mesh": 0}], "meshes": [{"primitives": [prim]}]}
+    if draco:
+        import DracoPy
+        enc = DracoPy.encode(verts, faces.astype(np.uint32), quantization_bits=DRACO_QUANT_BITS,
+                             compression_level=DRACO_LEVEL)
+        # Draco 会重排 / 合并顶点并量化位置，访问器的数量与范围按解码结果填写
+        dec = DracoPy.decode(enc)
+        pts = np.asarray(dec.points, np.float32).reshape(-1, 3)
+        pos_acc.update(count=len(pts), min=pts.min(axis=0).tolist(), max=pts.max(axis=0).tolist())
+        idx_acc["count"] = int(np.asarray(dec.faces).size)
+        idx_acc["componentType"] = 5123 if len(dec.points) < 65536 else 5125
+        bin_ = _pad4(enc)
+        gltf["bufferViews"] = [{"buffer": 0, "byteOffset": 0, "byteLength": len(enc)}]
+        prim["extensions"] = {"KHR_draco_mesh_compression": {"bufferView": 0, "attributes": {"POSITION": 0}}}
+        gltf["extensionsUsed"] = gltf["extensionsRequired"] = ["KHR_draco_mesh_compression"]
+    else:
+        vb = verts.tobytes()
+        ib = faces.astype(np.uint16 if idx_type == 5123 else np.uint32).tobytes()
+        bin_ = _pad4(vb) + _pad4(ib)
+        gltf["bufferViews"] = [
+            {"buffer": 0, "byteOffset": 0, "byteLength": len(vb), "target": 34962},
+            {"buffer": 0, "byteOffset": len(_pad4(vb)), "byteLength": len(ib), "target": 34963},
+        ]
+        pos_acc["bufferView"], idx_acc["bufferView"] = 0, 1
+    gltf["accessors"] = [pos_acc, idx_acc]
+    gltf["buffers"] = [{"byteLength": len(bin_)}]
+    js = _pad4(json.dumps(gltf, separators=(",", ":")).encode("utf-8"), b" ")
+    total = 12 + 8 + len(js) + 8 + len(bin_)
+    return (struct.pack("<III", 0x46546C67, 2, total) + struct.pack("<II", len(js), 0x4E4F534A) + js
+            + struct.pack("<II", len(bin_), 0x004E4942) + bin_)
+
+
+def read_glb(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """读取 write_glb 写出的 GLB → (vertices, faces)；用于校验与解析耗时对比。访问器数量与数据不符时 ValueError。"""
+    magic, _, total = struct.unpack_from("<III", data, 0)
+    if magic != 0x46546C67 or total != len(data):
+        raise ValueError("不是有效的 GLB")
+    jlen = struct.unpack_from("<I", data, 12)[0]
+    gltf = json.loads(data[20:20 + jlen])
+    bin_ = memoryview(data)[28 + jlen:]
+    prim = gltf["meshes"][0]["primitives"][0]
+    ext = prim.get("extensions", {}).get("KHR_draco_mesh_compression")
+    if ext is not None:
+        import DracoPy
+        bv = gltf["bufferViews"][ext["bufferView"]]
+        mesh = DracoPy.decode(bytes(bin_[bv.get("byteOffset", 0):bv.get("byteOffset", 0) + bv["byteLength"]]))
+        pos = np.asarray(mesh.points, np.float32).reshape(-1, 3)
+        idx = np.asarray(mesh.faces, np.uint32).reshape(-1, 3)
+        # 加载器按访问器的 count 分配缓冲区，与解码结果不一致时模型会缺面或错乱
+        counts = (gltf["accessors"][prim["attributes"]["POSITION"]]["count"], gltf["accessors"][prim["indices"]]["count"])
+        if counts != (len(pos), idx.size):
+            raise ValueError(f"Draco 访问器数量 {counts} 与解码结果 {(len(pos), idx.size)} 不一致")
+        return pos, idx
+
+    def accessor(i, dtype, width):
+        acc = gltf["accessors"][i]
+        bv = gltf["bufferViews"][acc["bufferView"]]
+        return np.frombuffer(bin_, dtype, acc["count"] * width, bv.get("byteOffset", 0)).reshape(-1, width)
+
+    pos = accessor(prim["attributes"]["POSITION"], np.float32, 3)
+    idx_acc = gltf["accessors"][prim["indices"]]
+    idx = accessor(prim["indices"], np.uint16 if idx_acc["componentType"] == 5123 else np.uint32, 1)
+    return pos, idx.reshape(-1, 3)
+
+
+# ========== 流水线 / 缓存 ==========
+def check_budgets(budgets: Sequence[int]) -> Tuple[int, ...]:
+    """校验各级三角形预算：1..MAX_BUDGET，至多 MAX_LODS 级；不合法时 ValueError。"""
+    budgets = tuple(int(b) for b in budgets)
+    if not budgets or len(budgets) > MAX_LODS:
+        raise ValueError(f"budgets: 需要 1–{MAX_LODS} 级")
+    bad = [b for b in budgets if not 1 <= b <= MAX_BUDGET]
+    if bad:
+        raise ValueError(f"budgets: {bad} 超出 1–{MAX_BUDGET}")
+    return budgets
+
+
+def convert(data: bytes, budgets: Sequence[int] = LOD_BUDGETS, draco: Optional[bool] = None) -> Tuple[List[bytes], dict]:
+    """STL 字节 → ([lod0.glb, lod1.glb, …], 统计)。lod0 为不超过 budgets[0] 的最高精度。"""
+    draco = draco_available() if draco is None else draco
+    t0 = time.perf_counter()
+    tris = read_stl(data)
+    t_parse = time.perf_counter() - t0
+    verts, faces = weld(tris)
+    t_weld = time.perf_counter() - t0 - t_parse
+    q = vertex_quadrics(verts, faces)
+    diag = float(np.linalg.norm(verts.max(axis=0) - verts.min(axis=0))) if len(verts) else 0.0
+    glbs, lods = [], []
+    prev = None
+    for budget in sorted(set(int(b) for b in budgets), reverse=True):
+        if prev is not None and prev <= budget:
+            continue
+        t1 = time.perf_counter()
+        v, f, cell = decimate(verts, faces, budget, q)
+        t_dec = time.perf_counter() - t1
+        glb = write_glb(v, f, draco)
+        t2 = time.perf_counter()
+        read_glb(glb)
+        glbs.append(glb)
+        lods.append({"lod": len(lods), "budget": budget, "triangles": int(len(f)), "vertices": int(len(v)),
+                     "bytes": len(glb), "error": round(cell / diag, 6) if diag else 0.0,
+                     "decimate_ms": round(t_dec * 1000, 1), "parse_ms": round((time.perf_counter() - t2) * 1000, 2)})
+        prev = len(f)
+        if prev <= 4:
+            break
+    stats = {"stl_bytes": len(data), "stl_triangles": int(len(tris)), "stl_parse_ms": round(t_parse * 1000, 2),
+             "welded_vertices": int(len(verts)), "welded_triangles": int(len(faces)),
+             "weld_ms": round(t_weld * 1000, 1), "draco": draco, "lods": lods,
+             "seconds": round(time.perf_counter() - t0, 3)}
+    return glbs, stats
+
+
+class ModelCache:
+    """
+    按 STL 内容 + 参数哈希缓存转换结果；同一模型的并发上传只转换一次。
+    总体积超过 max_bytes 时按最近使用时间（meta.json 的修改时间，命中时更新）删除旧模型。
+    """
+
+    def __init__(self, root: str, budgets: Sequence[int] = LOD_BUDGETS, draco: Optional[bool] = None,
+                 max_bytes: int = CACHE_MAX_BYTES):
+        self.root = root
+        self.budgets = check_budgets(budgets)
+        self.max_bytes = max_bytes
+        self.draco = draco_available() if draco is None else draco
+        self._lock = threading.Lock()
+        self._busy: Dict[str, threading.Lock] = {}
+
+    def model_id(self, data: bytes, budgets: Sequence[int]) -> str:
+        h = hashlib.sha256(data)
+        h.update(f"|v{PIPELINE_VERSION}|{','.join(map(str, budgets))}|{int(self.draco)}".encode())
+        return h.hexdigest()[:20]
+
+    def meta(self, mid: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.root, mid, "meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, data: bytes, name: str = "", budgets: Optional[Sequence[int]] = None) -> dict:
+        """转换（或命中缓存）并返回 meta：id、各级 LOD 统计；cached 表示本次是否命中。"""
+        budgets = check_budgets(budgets) if budgets else self.budgets
+        mid = self.model_id(data, budgets)
+        with self._lock:
+            lock = self._busy.setdefault(mid, threading.Lock())
+        try:
+            with lock:
+                meta = self.meta(mid)
+                if meta is not None:
+                    os.utime(os.path.join(self.root, mid, "meta.json"))
+                    return dict(meta, cached=True)
+                glbs, stats = convert(data, budgets, self.draco)
+                d = os.path.join(self.root, mid)
+                os.makedirs(d, exist_ok=True)
+                for i, glb in enumerate(glbs):
+                    _write_atomic(os.path.join(d, f"lod{i}.glb"), glb)
+                meta = dict(stats, id=mid, name=os.path.basename(name))
+                _write_atomic(os.path.join(d, "meta.json"), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        finally:
+            # 转换失败（无效 STL 等）时也要释放，否则每次失败的上传都留下一个锁
+            with self._lock:
+                self._busy.pop(mid, None)
+        self.prune(keep=mid)
+        return dict(meta, cached=False)
+
+    def prune(self, keep: str = "") -> int:
+        """删除最久未用的模型直到总体积不超过 max_bytes（keep 除外），返回删除数。"""
+        models, total = [], 0
+        for e in os.scandir(self.root):
+            if not e.is_dir():
+                continue
+            try:
+                used = os.path.getmtime(os.path.join(e.path, "meta.json"))
+            except OSError:
+                continue          # 正在转换（或转换失败留下的）目录不计入
+            size = sum(f.stat().st_size for f in os.scandir(e.path) if f.is_file())
+            models.append((used, e.name, size))
+            total += size
+        removed = 0
+        for _, name, size in sorted(models):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def glb_path(self, mid: str, lod: int) -> str:
+        if not (len(mid) == 20 and all(c in "0123456789abcdef" for c in mid)):
+            raise ValueError(f"id: {mid}")
+        path = os.path.join(self.root, mid, f"lod{int(lod)}.glb")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{mid}/lod{lod}")
+        return path
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def make_synthetic_stl(triangles: int = 1000000) -> bytes:
+    """合成二进制 STL：带凹凸纹理的圆环面（每个三角形独立存顶点，同 CAD 导出）。"""
+    n = max(8, int(math.sqrt(triangles / 2)))
+    u = np.linspace(0, 2 * np.pi, n + 1)[:-1]
+    U, V = np.meshgrid(u, u, indexing="ij")
+    r = 0.3 + 0.02 * np.sin(12 * U) * np.cos(9 * V)
+    pts = np.stack([(1 + r * np.cos(V)) * np.cos(U), (1 + r * np.cos(V)) * np.sin(U), r * np.sin(V)], axis=-1)
+    i, j = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    i1, j1 = (i + 1) % n, (j + 1) % n
+    quads = np.stack([pts[i, j], pts[i1, j], pts[i1, j1], pts[i, j1]], axis=2).reshape(-1, 4, 3)
+    tris = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]]).astype(np.float32)
+    rec = np.zeros(len(tris), _STL_DTYPE)
+    rec["v"] = tris
+    return b"stl_glb synthetic".ljust(80, b" ") + struct.pack("<I", len(tris)) + rec.tobytes()
+
+
+def print_stats(stats: dict) -> None:
+    print(f"STL  {stats['stl_bytes'] / 1048576:8.2f} MB  {stats['stl_triangles']:>9d} tris  "
+          f"parse {stats['stl_parse_ms']:.1f} ms  (welded {stats['welded_vertices']} verts, {stats['weld_ms']:.0f} ms)")
+    print(f"{'LOD':>4s} {'tris':>9s} {'verts':>9s} {'MB':>8s} {'ratio':>7s} {'error':>9s} {'decimate ms':>12s} "
+          f"{'parse ms':>9s}   draco={stats['draco']}")
+    for l in stats["lods"]:
+        print(f"{l['lod']:4d} {l['triangles']:9d} {l['vertices']:9d} {l['bytes'] / 1048576:8.3f} "
+              f"{l['bytes'] / stats['stl_bytes']:7.3f} {l['error']:9.2e} {l['decimate_ms']:12.1f} {l['parse_ms']:9.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="STL → 多级 LOD GLB（Draco 可选）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    cv = sub.add_parser("convert", help="转换 STL，写出 lod*.glb")
+    cv.add_argument("stl")
+    cv.add_argument("-o", "--out", default=None, help="输出目录（默认与 STL 同名）")
+    bn = sub.add_parser("bench", help="合成模型上的转换耗时与体积")
+    bn.add_argument("--triangles", type=int, default=1000000)
+    for p in (cv, bn):
+        p.add_argument("--budgets", default=",".join(map(str, LOD_BUDGETS)), help="各级三角形预算，逗号分隔")
+        p.add_argument("--no-draco", action="store_true", help="不使用 Draco 压缩")
+    args = ap.parse_args()
+    budgets = check_budgets(b for b in args.budgets.split(",") if b)
+    draco = False if args.no_draco else draco_available()
+    if args.cmd == "bench":
+        data = make_synthetic_stl(args.triangles)
+        if not (args.no_draco or draco):
+            print("⚠️ 未安装 DracoPy，跳过 Draco（pip install dracopy）")
+        # convert() 逐级读回 GLB，Draco 时同时校验访问器数量
+        for d in (False, True) if draco else (False,):
+            _, stats = convert(data, budgets, d)
+            print_stats(stats)
+        return 0
+    with open(args.stl, "rb") as f:
+        data = f.read()
+    glbs, stats = convert(data, budgets, draco)
+    out = args.out or os.path.splitext(args.stl)[0]
+    os.makedirs(out, exist_ok=True)
+    for i, glb in enumerate(glbs):
+        _write_atomic(os.path.join(out, f"lod{i}.glb"), glb)
+    print_stats(stats)
+    print(f"→ {out}/lod0..{len(glbs) - 1}.glb")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+"""
+DEM → Cesium 离线地形（quantized-mesh-1.0 + layer.json），代替把 dem.tif 当作 PNG 影像切片
+- 瓦片方案同 Cesium 的 GeographicTilingScheme：EPSG:4326、TMS（Y 自下而上）、0 级 2×1 张
+- 每张瓦片在其经纬度范围上采样 65×65 高程网格（边界采样点与相邻瓦片重合），按块窗口读取 + 双线性重投影
+- 自适应简化：RTIN（直角三角形不规则网，同 mapbox/martini）按误差合并三角形；
+  误差上限取 Cesium 对该级地形假设的几何误差（E0 / 2^z），平坦区域只剩很少的三角形
+- 编码：顶点 zigzag 增量、索引高水位编码、四边顶点表（Cesium 据此生成裙边），gzip 存为 {z}/{x}/{y}.terrain
+- 无效值（nodata / DEM 范围外）填 --fill-height；DEM 为正常高时用 --height-offset 加高程异常转为椭球高
+- 任务按“缩放级 × 空间块”切分，进程池并行；main.py 以 /terrain/<name>/ 提供（gzip 传输、ETag、长缓存）
+用法：
+  python terrain.py dem.tif terrain/survey -z 0-18 --processes 8 --height-offset 8.5
+  googlemaps.html?terrain=survey
+"""
+import os
+import sys
+import gzip
+import json
+import math
+import time
+import hashlib
+import argparse
+import struct
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds as window_from_bounds
+
+from tile_math import parse_zoom
+from tile_store import write_file_atomic
+from tiler import SourceInfo, Progress, source_info
+
+GEO_CRS = CRS.from_epsg(4326)
+WGS84_A = 6378137.0
+WGS84_B = 6356752.3142451793
+WGS84_E2 = 1 - (WGS84_B / WGS84_A) ** 2
+QMAX = 32767
+GRID = 65
+# Cesium 对 0 级地形的几何误差估计：a · 2π · 0.25 / (65 · 2)
+LEVEL0_ERROR = WGS84_A * 2 * math.pi * 0.25 / (GRID * 2)
+LAYER_JSON = "layer.json"
+TERRAIN_EXT = "terrain"
+
+
+@dataclass
+class TerrainOptions:
+    zooms: List[int]
+    grid: int = GRID                # 每张瓦片的采样网格边长（2^k + 1）
+    error_scale: float = 1.0        # 简化误差 = error_scale × 该级几何误差
+    fill_height: float = 0.0        # nodata / 范围外高程
+    height_offset: float = 0.0      # 加到 DEM 上的常数（正常高 → 椭球高）
+    processes: int = 0              # 0 = CPU 数
+    block: int = 8                  # 每个任务块 block×block 张瓦片
+    s_srs: Optional[str] = None
+
+
+# ========== 瓦片方案 ==========
+def tile_size_deg(z: int) -> float:
+    return 180.0 / (1 << z)
+
+
+def tile_bounds(x: int, y: int, z: int) -> Tuple[float, float, float, float]:
+    """TMS 地理瓦片的经纬度范围 (west, south, east, north)。"""
+    s = tile_size_deg(z)
+    return -180.0 + x * s, -90.0 + y * s, -180.0 + (x + 1) * s, -90.0 + (y + 1) * s
+
+
+def tile_range(bounds, z: int) -> Tuple[int, int, int, int]:
+    """经纬度范围在 z 级覆盖的瓦片号 (xmin, ymin, xmax, ymax)。"""
+    w, s, e, n = bounds
+    size = tile_size_deg(z)
+    nx, ny = 2 << z, 1 << z
+
+    def clamp(v, hi):
+        return max(0, min(hi - 1, v))
+
+    return (clamp(int((w + 180.0) / size), nx), clamp(int((s + 90.0) / size), ny),
+            clamp(int((e + 180.0) / size), nx), clamp(int((n + 90.0) / size), ny))
+
+
+def level_error(z: int) -> float:
+    """Cesium 对 z 级地形瓦片假设的几何误差（米）。"""
+    return LEVEL0_ERROR / (1 << z)
+
+
+def max_zoom_for(info: SourceInfo, grid: int = GRID) -> int:
+    """网格间距不粗于 DEM 分辨率的最小级别。"""
+    w, s, e, n = info.lonlat_bounds
+    res = min((e - w) / info.width, (n - s) / info.height)
+    return max(0, int(math.ceil(math.log2(180.0 / ((grid - 1) * res)))))
+
+
+def level_ranges(info: SourceInfo, zooms: List[int]) -> Dict[int, Tuple[int, int, int, int]]:
+    """各级需要生成的瓦片范围；0 级总是两张全部生成（Cesium 要求）。"""
+    out = {}
+    for z in zooms:
+        out[z] = (0, 0, 1, 0) if z == 0 else tile_range(info.lonlat_bounds, z)
+    return out
+
+
+# ========== 采样 ==========
+def _grid_transform(bounds, grid: int) -> Affine:
+    """像元中心落在瓦片边界与等分点上的网格变换。"""
+    w, _, e, n = bounds
+    d = (e - w) / (grid - 1)
+    return Affine(d, 0, w - d / 2, 0, -d, n + d / 2)
+
+
+def read_dem(src, info: SourceInfo, bounds, width: int, height: int):
+    """读取覆盖经纬度区域的 DEM 窗口（按目标分辨率降采样），返回 (float32 数组, transform)；无交集返回 None。"""
+    sb = transform_bounds(GEO_CRS, info.crs, *bounds, densify_pts=21)
+    win = window_from_bounds(*sb, transform=info.transform)
+    col0 = max(0, int(math.floor(win.col_off)) - 2)
+    row0 = max(0, int(math.floor(win.row_off)) - 2)
+    col1 = min(info.width, int(math.ceil(win.col_off + win.width)) + 2)
+    row1 = min(info.height, int(math.ceil(win.row_off + win.height)) + 2)
+    if col1 <= col0 or row1 <= row0:
+        return None
+    win = Window(col0, row0, col1 - col0, row1 - row0)
+    f = max(1.0, min(win.width / width, win.height / height))
+    out_w, out_h = max(2, int(round(win.width / f))), max(2, int(round(win.height / f)))
+    tf = info.transform * Affine.translation(col0, row0) * Affine.scale(win.width / out_w, win.height / out_h)
+    arr = src.read(1, window=win, out_shape=(out_h, out_w), resampling=Resampling.average, masked=True)
+    return arr.astype(np.float32).filled(np.nan), tf
+
+
+def sample_heights(read, info: SourceInfo, bounds, grid: int, opts: TerrainOptions) -> np.ndarray:
+    """把已读取的 DEM 块重投影到瓦片的 grid×grid 采样网格（行自北向南），无效值已填充。"""
+    out = np.full((grid, grid), np.nan, dtype=np.float32)
+    if read is not None:
+        arr, tf = read
+        reproject(arr, out, src_transform=tf, src_crs=info.crs, src_nodata=np.nan,
+                  dst_transform=_grid_transform(bounds, grid), dst_crs=GEO_CRS, dst_nodata=np.nan,
+                  resampling=Resampling.bilinear)
+    out += opts.height_offset
+    out[~np.isfinite(out)] = opts.fill_height
+    return out
+
+
+# ========== RTIN 简化 ==========
+@lru_cache(maxsize=4)
+def _rtin_levels(grid: int) -> list:
+    """
+    RTIN 三角形（编号 id = i + 2 的隐式二叉树，同 martini）按层从深到浅分组，
+    每层给出斜边中点、两端点及两个子三角形斜边中点的网格下标（只与 grid 有关，缓存）。
+    """
+    size = grid - 1
+    if size & (size - 1) or size < 2:
+        raise ValueError(f"grid 须为 2^k + 1：{grid}")
+    n = size * size * 2 - 2
+    ids = np.arange(n, dtype=np.int64) + 2
+    odd = (ids & 1).astype(bool)
+    z = np.zeros(n, dtype=np.int64)
+    ax, ay, bx, by, cx, cy = z.copy(), z.copy(), z.copy(), z.copy(), z.copy(), z.copy()
+    bx[odd] = by[odd] = cx[odd] = size       # 左下三角形
+    ax[~odd] = ay[~odd] = cy[~odd] = size    # 右上三角形
+    k = 1
+    while True:
+        s = ids >> k
+        act = s > 1
+        if not act.any():
+            break
+        left = act & ((s & 1) == 1)
+        right = act & ~left
+        mx, my = (ax + bx) >> 1, (ay + by) >> 1
+        nax = np.where(left, cx, np.where(right, bx, ax))
+        nay = np.where(left, cy, np.where(right, by, ay))
+        nbx = np.where(left, ax, np.where(right, cx, bx))
+        nby = np.where(left, ay, np.where(right, cy, by))
+        cx, cy = np.where(act, mx, cx), np.where(act, my, cy)
+        ax, ay, bx, by = nax, nay, nbx, nby
+        k += 1
+    mx, my = (ax + bx) >> 1, (ay + by) >> 1
+    cx, cy = mx + my - ay, my + ax - mx
+    depth = np.floor(np.log2(ids)).astype(np.int64)
+    levels = []
+    for d in range(int(depth.max()), 0, -1):
+        sel = depth == d
+        leaf = d == depth.max()
+        levels.append((
+            (my * grid + mx)[sel], (ay * grid + ax)[sel], (by * grid + bx)[sel],
+            None if leaf else (((ay + cy) >> 1) * grid + ((ax + cx) >> 1))[sel],
+            None if leaf else (((by + cy) >> 1) * grid + ((bx + cx) >> 1))[sel],
+        ))
+    return levels
+
+
+def rtin_errors(heights: np.ndarray) -> np.ndarray:
+    """各网格点作为斜边中点时的最大插值误差（含所有子三角形），展平为 grid² 数组。"""
+    grid = heights.shape[0]
+    t = heights.astype(np.float64).ravel()
+    err = np.zeros(grid * grid)
+    for mid, a, b, lc, rc in _rtin_levels(grid):
+        np.maximum.at(err, mid, np.abs((t[a] + t[b]) * 0.5 - t[mid]))
+        if lc is not None:
+            np.maximum.at(err, mid, np.maximum(err[lc], err[rc]))
+    return err
+
+
+def rtin_mesh(heights: np.ndarray, max_error: float, max_span: float = math.inf) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    误差不超过 max_error、斜边不长于 max_span（网格单位）的最粗三角网。返回 (顶点网格坐标 (N, 2) [列, 行], 三角形 (M, 3) 顶点下标)；
+    三角形在“东向 / 北向”坐标下为逆时针。
+    """
+    grid = heights.shape[0]
+    size = grid - 1
+    err = rtin_errors(heights)
+    # 两个根三角形 (a, b, c)；逐层并行细分
+    tri = np.array([[0, 0, size, size, size, 0], [size, size, 0, 0, 0, size]], dtype=np.int64)
+    done = []
+    while len(tri):
+        ax, ay, bx, by, cx, cy = tri.T
+        mx, my = (ax + bx) >> 1, (ay + by) >> 1
+        split = (np.abs(ax - cx) + np.abs(ay - cy) > 1) & (
+            (err[my * grid + mx] > max_error) | (np.hypot(ax - bx, ay - by) > max_span))
+        done.append(tri[~split])
+        t = tri[split]
+        m = np.stack([(t[:, 0] + t[:, 2]) >> 1, (t[:, 1] + t[:, 3]) >> 1], axis=1)
+        tri = np.concatenate([np.concatenate([t[:, 4:6], t[:, 0:2], m], axis=1),
+                              np.concatenate([t[:, 2:4], t[:, 4:6], m], axis=1)])
+    tri = np.concatenate(done)
+    flat = np.stack([tri[:, 1] * grid + tri[:, 0], tri[:, 3] * grid + tri[:, 2],
+                     tri[:, 5] * grid + tri[:, 4]], axis=1)
+    used, inv = np.unique(flat, return_inverse=True)
+    return np.stack([used % grid, used // grid], axis=1), inv.reshape(-1, 3)
+
+
+# ========== quantized-mesh 编码 ==========
+def lonlat_to_ecef(lon, lat, h) -> np.ndarray:
+    lon, lat = np.radians(lon), np.radians(lat)
+    sl = np.sin(lat)
+    nr = WGS84_A / np.sqrt(1 - WGS84_E2 * sl * sl)
+    return np.stack([(nr + h) * np.cos(lat) * np.cos(lon), (nr + h) * np.cos(lat) * np.sin(lon),
+                     (nr * (1 - WGS84_E2) + h) * sl], axis=-1)
+
+
+def horizon_occlusion_point(ecef: np.ndarray, center: np.ndarray) -> np.ndarray:
+    """同 Cesium EllipsoidalOccluder.computeHorizonCullingPoint：椭球缩放空间中的地平线遮挡点。"""
+    radii = np.array([WGS84_A, WGS84_A, WGS84_B])
+    d = center / radii
+    d = d / np.linalg.norm(d)
+    p = ecef / radii
+    mag2 = np.einsum("ij,ij->i", p, p)
+    mag = np.sqrt(mag2)
+    dirs = p / mag[:, None]
+    mag2, mag = np.maximum(mag2, 1.0), np.maximum(mag, 1.0)
+    cos_a = dirs @ d
+    sin_a = np.linalg.norm(np.cross(dirs, d), axis=1)
+    cos_b = 1.0 / mag
+    sin_b = np.sqrt(mag2 - 1.0) * cos_b
+    den = cos_a * cos_b - sin_a * sin_b
+    if (den <= 0).any():
+        # 跨度接近半球的瓦片（0 级）没有有限的遮挡点，取远处一点（只在背面时剔除）
+        return d * 1e3
+    return d * float((1.0 / den).max())
+
+
+def _zigzag_delta(v: np.ndarray) -> np.ndarray:
+    d = np.diff(v.astype(np.int32), prepend=0)
+    return ((d << 1) ^ (d >> 31)).astype(np.uint16)
+
+
+def encode_quantized_mesh(heights: np.ndarray, bounds, max_error: float) -> Tuple[bytes, int, int]:
+    """高程网格 → quantized-mesh-1.0 字节（未压缩），以及顶点数、三角形数。"""
+    grid = heights.shape[0]
+    w, s, e, n = bounds
+    # 三角形是 ECEF 中的直线段：大瓦片（低级别）即使高程平坦也要细分，使弦高（≈ R·l²/8）不超过误差上限
+    span = math.sqrt(8 * max_error / WGS84_A) / math.radians((e - w) / (grid - 1))
+    verts, tris = rtin_mesh(heights, max_error, span)
+    # 顶点按在索引流中首次出现的顺序重排，满足高水位编码的要求
+    idx = tris.ravel()
+    _, first = np.unique(idx, return_index=True)
+    order = np.argsort(first, kind="stable")
+    remap = np.empty(len(order), dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    verts, idx = verts[order], remap[idx]
+
+    col, row = verts[:, 0], verts[:, 1]
+    h = heights[row, col].astype(np.float64)
+    hmin, hmax = float(h.min()), float(h.max())
+    u = np.rint(col * (QMAX / (grid - 1))).astype(np.int32)
+    v = np.rint((grid - 1 - row) * (QMAX / (grid - 1))).astype(np.int32)
+    q = (np.rint((h - hmin) / (hmax - hmin) * QMAX) if hmax > hmin else np.zeros(len(h))).astype(np.int32)
+
+    lon = w + col / (grid - 1) * (e - w)
+    lat = n - row / (grid - 1) * (n - s)
+    ecef = lonlat_to_ecef(lon, lat, h)
+    lo, hi = ecef.min(axis=0), ecef.max(axis=0)
+    center = (lo + hi) / 2
+    radius = float(np.linalg.norm(ecef - center, axis=1).max())
+    occ = horizon_occlusion_point(ecef, center)
+
+    nv = len(verts)
+    out = [struct.pack("<3d2f4d3d", *center, hmin, hmax, *center, radius, *occ),
+           struct.pack("<I", nv), _zigzag_delta(u).tobytes(), _zigzag_delta(v).tobytes(), _zigzag_delta(q).tobytes()]
+    size = 88 + 4 + 6 * nv
+    wide = nv > 65536
+    itype = np.uint32 if wide else np.uint16
+    if wide and size % 4:
+        out.append(b"\0" * (4 - size % 4))
+    hw = np.maximum.accumulate(idx)
+    code = np.concatenate([[0], hw[:-1] + 1]) - idx
+    out += [struct.pack("<I", len(idx) // 3), code.astype(itype).tobytes()]
+    for edge, key in ((u == 0, v), (v == 0, u), (u == QMAX, v), (v == QMAX, u)):    # 西、南、东、北
+        ev = np.nonzero(edge)[0]
+        ev = ev[np.argsort(key[ev], kind="stable")]
+        out += [struct.pack("<I", len(ev)), ev.astype(itype).tobytes()]
+    return b"".join(out), nv, len(idx) // 3
+
+
+# ========== 并行生成 ==========
+_W: dict = {}
+
+
+def terrain_path(out_dir: str, z: int, x: int, y: int) -> str:
+    return os.path.join(out_dir, str(z), str(x), f"{y}.{TERRAIN_EXT}")
+
+
+def iter_jobs(ranges: Dict[int, Tuple[int, int, int, int]], block: int) -> Iterator[Tuple[int, int, int, int, int]]:
+    """(z, x0, y0, x1, y1)：按缩放级从深到浅、块内瓦片闭区间。"""
+    for z in sorted(ranges, reverse=True):
+        xmin, ymin, xmax, ymax = ranges[z]
+        for bx in range(xmin, xmax + 1, block):
+            for by in range(ymin, ymax + 1, block):
+                yield z, bx, by, min(bx + block - 1, xmax), min(by + block - 1, ymax)
+
+
+def _init_worker(info: SourceInfo, opts: TerrainOptions, out_dir: str) -> None:
+    _W["src"] = rasterio.open(info.path)
+    _W["info"] = info
+    _W["opts"] = opts
+    _W["out"] = out_dir
+
+
+def _read_block(src, info: SourceInfo, opts: TerrainOptions, job):
+    """一次读取整个任务块与 DEM 相交部分（分辨率约为采样网格的 2 倍）。"""
+    z, x0, y0, x1, y1 = job
+    w, s, _, _ = tile_bounds(x0, y0, z)
+    _, _, e, n = tile_bounds(x1, y1, z)
+    dw, ds, de, dn = info.lonlat_bounds
+    pad = tile_size_deg(z) / (opts.grid - 1)
+    iw, i_s, ie, i_n = max(w, dw - pad), max(s, ds - pad), min(e, de + pad), min(n, dn + pad)
+    if iw >= ie or i_s >= i_n:
+        return None
+    step = pad / 2
+    return read_dem(src, info, (iw, i_s, ie, i_n), int(math.ceil((ie - iw) / step)) + 2,
+                    int(math.ceil((i_n - i_s) / step)) + 2)
+
+
+def _run_block(job) -> dict:
+    src, info, opts, out_dir = _W["src"], _W["info"], _W["opts"], _W["out"]
+    z, x0, y0, x1, y1 = job
+    read = _read_block(src, info, opts, job)
+    max_error = level_error(z) * opts.error_scale
+    st = {"job": job, "tiles": 0, "vertices": 0, "triangles": 0, "raw": 0, "bytes": 0}
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            bounds = tile_bounds(x, y, z)
+            heights = sample_heights(read, info, bounds, opts.grid, opts)
+            data, nv, nt = encode_quantized_mesh(heights, bounds, max_error)
+            gz = gzip.compress(data, 6, mtime=0)
+            write_file_atomic(terrain_path(out_dir, z, x, y), gz)
+            st["tiles"] += 1
+            st["vertices"] += nv
+            st["triangles"] += nt
+            st["raw"] += len(data)
+            st["bytes"] += len(gz)
+    return st
+
+
+def _run_jobs(todo: list, info: SourceInfo, opts: TerrainOptions, out_dir: str, collect) -> None:
+    procs = opts.processes or os.cpu_count() or 1
+    if procs <= 1:
+        _init_worker(info, opts, out_dir)
+        for j in todo:
+            collect(_run_block(j))
+        return
+    with ProcessPoolExecutor(procs, initializer=_init_worker, initargs=(info, opts, out_dir)) as ex:
+        pending = set()
+        for j in todo:
+            pending.add(ex.submit(_run_block, j))
+            if len(pending) >= procs * 4:
+                fin, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fu in fin:
+                    collect(fu.result())
+        for fu in pending:
+            collect(fu.result())
+
+
+def layer_json(info: SourceInfo, opts: TerrainOptions, ranges, version: str) -> dict:
+    """Cesium CesiumTerrainProvider 读取的 layer.json；tiles 带 ?v= 版本号，重新生成后浏览器缓存自动失效。"""
+    zs = sorted(ranges)
+    available = []
+    for z in range(zs[-1] + 1):
+        r = ranges.get(z)
+        available.append([{"startX": r[0], "startY": r[1], "endX": r[2], "endY": r[3]}] if r else [])
+    return {
+        "tilejson": "2.1.0",
+        "name": os.path.splitext(os.path.basename(info.path))[0],
+        "version": version,
+        "format": "quantized-mesh-1.0",
+        "scheme": "tms",
+        "tiles": ["{z}/{x}/{y}.terrain?v={version}"],
+        "projection": "EPSG:4326",
+        "bounds": [round(v, 9) for v in info.lonlat_bounds],
+        "minzoom": zs[0],
+        "maxzoom": zs[-1],
+        "available": available,
+    }
+
+
+def build_terrain(src_path: str, out_dir: str, opts: TerrainOptions, quiet: bool = False) -> dict:
+    """地形生成主入口，返回统计信息。"""
+    info = source_info(src_path, opts.s_srs)
+    zooms = sorted(set(opts.zooms) | {0})     # Cesium 从 0 级开始请求
+    ranges = level_ranges(info, zooms)
+    per_zoom = {z: (r[2] - r[0] + 1) * (r[3] - r[1] + 1) for z, r in ranges.items()}
+    todo = list(iter_jobs(ranges, opts.block))
+    if not quiet:
+        print(f"i Terrain {os.path.basename(src_path)}  zooms {zooms[0]}-{zooms[-1]}  "
+              f"tiles {sum(per_zoom.values())}  jobs {len(todo)}")
+    os.makedirs(out_dir, exist_ok=True)
+    prog = Progress(per_zoom)
+    tot = {"tiles": 0, "vertices": 0, "triangles": 0, "raw": 0, "bytes": 0}
+
+    def collect(r):
+        for k in tot:
+            tot[k] += r[k]
+        prog.add(r["job"][0], r["tiles"])
+        if not quiet:
+            prog.line()
+
+    t0 = time.time()
+    _run_jobs(todo, info, opts, out_dir, collect)
+    sec = time.time() - t0
+    st = os.stat(src_path)
+    version = "1.0." + hashlib.blake2b(json.dumps([st.st_size, st.st_mtime_ns, asdict(opts)], sort_keys=True)
+                                       .encode(), digest_size=4).hexdigest()
+    write_file_atomic(os.path.join(out_dir, LAYER_JSON),
+                      json.dumps(layer_json(info, opts, ranges, version), ensure_ascii=False, indent=1).encode("utf-8"))
+    full = 2 * (opts.grid - 1) ** 2 * tot["tiles"]
+    tot.update(seconds=round(sec, 3), tiles_per_s=round(tot["tiles"] / sec, 1) if sec > 0 else 0.0,
+               triangle_ratio=round(tot["triangles"] / full, 4) if full else 0.0, version=version)
+    if not quiet:
+        prog.line(force=True)
+        print(f"\nOK {tot['tiles']} tiles in {sec:.1f}s ({tot['tiles_per_s']}/s)  "
+              f"triangles {tot['triangles']} ({tot['triangle_ratio'] * 100:.1f}% of full grid)  "
+              f"{tot['bytes'] / 1024:.0f} KiB gzip / {tot['raw'] / 1024:.0f} KiB raw")
+    return tot
+
+
+# ========== 基准 ==========
+def make_synthetic_dem(path: str, size: int = 2048, pixel_m: float = 0.5,
+                       lon: float = 120.6474, lat: float = 31.4636) -> str:
+    """在测区附近生成一张 float32 DEM（UTM 51N）：平缓地面 + 几处土堆 + 一条沟，含少量 nodata。"""
+    from rasterio.warp import transform as warp_transform
+    crs = CRS.from_epsg(32651)
+    (x,), (y,) = warp_transform("EPSG:4326", crs, [lon], [lat])
+    tf = Affine(pixel_m, 0, x - size * pixel_m / 2, 0, -pixel_m, y + size * pixel_m / 2)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    h = 3.0 + 0.8 * xx + 0.5 * np.sin(yy * 7.0)
+    for cx, cy, r, a in ((0.3, 0.3, 0.08, 6.0), (0.7, 0.6, 0.12, 9.0), (0.5, 0.8, 0.05, 4.0)):
+        h += a * np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * r * r))
+    h -= 2.5 * np.exp(-((xx - yy - 0.1) ** 2) / 0.0004)
+    h[: size // 16, : size // 16] = -9999.0
+    profile = dict(driver="GTiff", width=size, height=size, count=1, dtype="float32", crs=crs, transform=tf,
+                   nodata=-9999.0, tiled=True, blockxsize=256, blockysize=256, compress="deflate")
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(h.astype(np.float32), 1)
+    return path
+
+
+def bench(work_dir: Optional[str] = None, size: int = 2048, procs_list=(1, 2, 4)) -> List[dict]:
+    """合成 DEM 上不同进程数的生成速度、简化率与体积。"""
+    import tempfile
+    work = work_dir or tempfile.mkdtemp(prefix="terrain_bench_")
+    src = os.path.join(work, "synthetic_dem.tif")
+    if not os.path.exists(src):
+        make_synthetic_dem(src, size)
+    zmax = max_zoom_for(source_info(src))
+    rows = []
+    for p in procs_list:
+        opts = TerrainOptions(zooms=list(range(zmax + 1)), processes=p)
+        st = build_terrain(src, os.path.join(work, f"terrain_p{p}"), opts, quiet=True)
+        rows.append({"processes": p, **st})
+        print(f"processes={p:2d}  tiles={st['tiles']:6d}  {st['seconds']:7.2f}s  {st['tiles_per_s']:8.1f} tiles/s  "
+              f"triangles {st['triangle_ratio'] * 100:5.1f}%  avg {st['bytes'] / max(1, st['tiles']):.0f} B/tile")
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="DEM → Cesium quantized-mesh 地形瓦片")
+    ap.add_argument("input", nargs="?", help="输入 DEM（GeoTIFF，可用 .tfw / .prj）")
+    ap.add_argument("output", nargs="?", help="输出目录，如 terrain/survey")
+    ap.add_argument("-z", "--zoom", default=None, help='级别，如 "0-18"（默认 0 到 DEM 分辨率对应级）')
+    ap.add_argument("--grid", type=int, default=GRID, help="每张瓦片采样网格边长（2^k+1）")
+    ap.add_argument("--error-scale", type=float, default=1.0, help="简化误差相对 Cesium 几何误差的倍数")
+    ap.add_argument("--fill-height", type=float, default=0.0, help="nodata / DEM 范围外的高程")
+    ap.add_argument("--height-offset", type=float, default=0.0, help="加到 DEM 的常数（高程异常，正常高 → 椭球高）")
+    ap.add_argument("--processes", type=int, default=0)
+    ap.add_argument("--block", type=int, default=8, help="每个任务块的瓦片边长数")
+    ap.add_argument("--s_srs", default=None)
+    ap.add_argument("--bench", action="store_true", help="在合成 DEM 上测试生成速度")
+    ap.add_argument("--bench-size", type=int, default=2048)
+    args = ap.parse_args()
+
+    if args.bench:
+        bench(args.input, args.bench_size)
+        return
+    if not args.input or not args.output:
+        ap.print_help()
+        sys.exit(1)
+    if not os.path.exists(args.input):
+        raise SystemExit(f"输入 DEM 不存在：{args.input}")
+    zoom = args.zoom or f"0-{max_zoom_for(source_info(args.input, args.s_srs), args.grid)}"
+    opts = TerrainOptions(
+        zooms=parse_zoom(zoom), grid=args.grid, error_scale=args.error_scale, fill_height=args.fill_height,
+        height_offset=args.height_offset, processes=args.processes, block=args.block, s_srs=args.s_srs,
+    )
+    build_terrain(args.input, args.output, opts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+"""
+底图瓦片下载（跨平台，代替 basemap/EsriTileDownloader.ps1）
+- asyncio + 标准库实现的 HTTP/1.1 客户端：按主机保持 keep-alive 连接池，不再每张瓦片新建 TLS 连接
+- 并发数（--concurrency）与速率上限（--rate，令牌桶）可配置
+- 重试：网络错误 / 429 / 5xx 按指数退避 × 随机抖动重试，遵循 Retry-After；404 记为缺失不再重试
+- 直接写入 MBTiles（tile_store.MBTilesStore，按内容去重）；下载状态存于同一库的 download_state 表，
+  与瓦片同一事务提交，中断后重新运行即从断点继续（默认同时重试上次失败的瓦片）
+- 瓦片范围与 PS1 的 Get-TileX / Get-TileY、QGIS 脚本 estimate_total_tiles 一致（tile_math），
+  East < West 视为跨 180° 经线，拆成两段
+- --selftest 在本地替身瓦片服务器上验证（含注入失败、断点续传、连接复用）
+用法：
+  python tile_downloader.py Esri_map.mbtiles -z 16-19 --bbox 120.6457,31.4615,120.6502,31.4654 --concurrency 8
+  python tile_downloader.py --selftest
+"""
+import os
+import ssl
+import sys
+import time
+import random
+import asyncio
+import argparse
+import sqlite3
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from tile_math import flip_y, lonlat_to_tilexy, parse_zoom, tiles_per_zoom
+from tile_store import MBTilesStore, sniff_format
+
+ESRI_URL = "https://services.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
+USER_AGENT = "YourProject/1.0"
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS download_state (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+                                           status TEXT, attempts INTEGER, error TEXT,
+                                           PRIMARY KEY (zoom_level, tile_column, tile_row));
+"""
+DONE, MISSING, FAILED = "done", "missing", "failed"
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+BATCH = 256                     # 每批提交的瓦片数
+
+
+# ========== 瓦片范围 ==========
+def iter_tiles(bbox: Optional[Tuple[float, float, float, float]], zooms: List[int]) -> Iterator[Tuple[int, int, int]]:
+    """(z, x, y) XYZ 瓦片号；bbox = (west, south, east, north)，None 为全球。"""
+    for z in zooms:
+        n = 1 << z
+        if bbox is None:
+            segs, (y0, y1) = [(0, n - 1)], (0, n - 1)
+        else:
+            w, s, e, nn = bbox
+            lons = [(w, e)] if e >= w else [(w, 180.0), (-180.0, e)]
+            _, ya = lonlat_to_tilexy(w, nn, z)
+            _, yb = lonlat_to_tilexy(w, s, z)
+            y0, y1 = min(ya, yb), max(ya, yb)
+            segs = []
+            for lw, le in lons:
+                xa, _ = lonlat_to_tilexy(lw, 0.0, z)
+                xb, _ = lonlat_to_tilexy(le, 0.0, z)
+                segs.append((min(xa, xb), max(xa, xb)))
+        for x0, x1 in segs:
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    yield z, x, y
+
+
+def count_tiles(bbox, zooms: List[int]) -> int:
+    if bbox is None:
+        return sum(4 ** z for z in zooms)
+    w, s, e, n = bbox
+    if e >= w:
+        return sum(tiles_per_zoom(bbox, zooms).values())
+    return sum(tiles_per_zoom((w, s, 180.0, n), zooms).values()) + sum(tiles_per_zoom((-180.0, s, e, n), zooms).values())
+
+
+# ========== HTTP 连接池 ==========
+class _Conn:
+    __slots__ = ("reader", "writer", "used")
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer, self.used = reader, writer, 0
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class HttpPool:
+    """极简异步 HTTP/1.1 GET 客户端：每个 (scheme, host, port) 维护空闲连接栈，响应读完后连接放回复用。"""
+
+    def __init__(self, user_agent: str = USER_AGENT, timeout: float = 30.0, max_idle: int = 64):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle: Dict[tuple, List[_Conn]] = {}
+        self._ssl = ssl.create_default_context()
+        self.connections = 0     # 新建连接数
+        self.requests = 0
+
+    async def _connect(self, key) -> _Conn:
+        scheme, host, port = key
+        r, w = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl if scheme == "https" else None), self.timeout)
+        self.connections += 1
+        return _Conn(r, w)
+
+    async def _read_response(self, conn: _Conn) -> Tuple[int, Dict[str, str], bytes, bool]:
+        r = conn.reader
+        line = await r.readline()
+        if not line:
+            raise ConnectionResetError("connection closed")
+        parts = line.decode("latin-1").split(None, 2)
+        status = int(parts[1])
+        headers: Dict[str, str] = {}
+        while True:
+            h = await r.readline()
+            if h in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = h.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        keep = headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await r.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await r.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await r.readexactly(size))
+                await r.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await r.readexactly(int(headers["content-length"]))
+        else:
+            body, keep = await r.read(), False
+        return status, headers, body, keep
+
+    async def get(self, url: str) -> Tuple[int, Dict[str, str], bytes]:
+        u = urlsplit(url)
+        key = (u.scheme, u.hostname, u.port or (443 if u.scheme == "https" else 80))
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        req = (f"GET {path} HTTP/1.1\r\nHost: {u.netloc}\r\nUser-Agent: {self.user_agent}\r\n"
+               f"Accept: */*\r\nConnection: keep-alive\r\n\r\n").encode("latin-1")
+        idle = self._idle.setdefault(key, [])
+        while True:
+            reused = bool(idle)
+            conn = idle.pop() if reused else await self._connect(key)
+            try:
+                conn.writer.write(req)
+                await conn.writer.drain()
+                status, headers, body, keep = await asyncio.wait_for(self._read_response(conn), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+                conn.close()
+                if reused:
+                    continue        # 服务器已关闭的空闲连接：换一条重发
+                raise ConnectionError(str(e) or type(e).__name__) from e
+            except BaseException:
+                conn.close()
+                raise
+            self.requests += 1
+            conn.used += 1
+            if keep and len(idle) < self.max_idle:
+                idle.append(conn)
+            else:
+                conn.close()
+            return status, headers, body
+
+    def close(self) -> None:
+        for conns in self._idle.values():
+            for c in conns:
+                c.close()
+        self._idle.clear()
+
+
+class RateLimiter:
+    """令牌桶：平均 rate 次/秒，允许 burst 次突发；rate <= 0 不限速。"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_s(attempt: int, base: float = 0.15, cap: float = 5.0) -> float:
+    """第 attempt 次失败后的等待：同 PS1 的 150ms × 2^(n-1)（上限 5s），再乘 0.5~1.5 的随机抖动。"""
+    return min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+# ========== 下载 ==========
+class Downloader:
+    def __init__(self, out: str, url: str = ESRI_URL, concurrency: int = 8, rate: float = 0.0,
+                 retries: int = 3, timeout: float = 30.0, user_agent: str = USER_AGENT):
+        if not out.lower().endswith(".mbtiles"):
+            raise ValueError("输出须为 *.mbtiles")
+        self.out = out
+        self.url = url
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.retries = max(1, retries)
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.stats = {"total": 0, "skipped": 0, "done": 0, "missing": 0, "failed": 0, "retries": 0, "bytes": 0}
+        self.fmt: Optional[str] = None
+
+    def _state(self, db) -> Dict[Tuple[int, int, int], str]:
+        db.executescript(STATE_SCHEMA)
+        return {(z, x, flip_y(row, z)): st for z, x, row, st in
+                db.execute("SELECT zoom_level, tile_column, tile_row, status FROM download_state")}
+
+    async def _fetch(self, pool: HttpPool, limiter: RateLimiter, z: int, x: int, y: int):
+        """返回 (status, data, attempts, error)。"""
+        url = self.url.format(z=z, x=x, y=y)
+        err = ""
+        for attempt in range(1, self.retries + 1):
+            await limiter.acquire()
+            wait_s = None
+            try:
+                status, headers, body = await pool.get(url)
+                if status == 200 and body:
+                    return DONE, body, attempt, ""
+                if status in (204, 404):
+                    return MISSING, None, attempt, f"HTTP {status}"
+                err = f"HTTP {status}"
+                if status not in RETRY_STATUS:
+                    break
+                ra = headers.get("retry-after", "")
+                wait_s = float(ra) if ra.replace(".", "", 1).isdigit() else None
+            except (ConnectionError, OSError, asyncio.TimeoutError, ValueError) as e:
+                err = f"{type(e).__name__}: {e}"
+            if attempt < self.retries:
+                self.stats["retries"] += 1
+                await asyncio.sleep(wait_s if wait_s is not None else backoff_s(attempt))
+        return FAILED, None, self.retries, err
+
+    async def run_async(self, bbox, zooms: List[int], retry_failed: bool = True,
+                        max_tiles: Optional[int] = None, quiet: bool = False) -> dict:
+        store = MBTilesStore(self.out, "jpg", encode=None, dedup=True)
+        store.autocommit = False
+        db = store.db
+        state = self._state(db)
+        skip = {DONE, MISSING} if retry_failed else {DONE, MISSING, FAILED}
+        total = count_tiles(bbox, zooms)
+        st = self.stats
+        st["total"] = total
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        results: list = []
+        pool = HttpPool(self.user_agent, self.timeout)
+        limiter = RateLimiter(self.rate, burst=self.concurrency)
+        t0 = time.time()
+        last = [0.0]
+
+        def flush() -> None:
+            if not results:
+                return
+            rows = []
+            for z, x, y, status, data, attempts, err in results:
+                if data is not None:
+                    store.put_encoded(z, x, y, data)
+                    st["bytes"] += len(data)
+                    self.fmt = self.fmt or sniff_format(data) or "jpg"
+                rows.append((z, x, flip_y(y, z), status, attempts, err))
+                st[status] += 1
+            store.absorb(store.drain())
+            db.executemany("INSERT OR REPLACE INTO download_state VALUES (?, ?, ?, ?, ?, ?)", rows)
+            db.commit()       # 瓦片与状态同一事务：中断时不会出现“有瓦片无状态”或反之
+            results.clear()
+            if not quiet and time.time() - last[0] >= 1.0:
+                last[0] = time.time()
+                n = st["skipped"] + st["done"] + st["missing"] + st["failed"]
+                el = time.time() - t0
+                print(f"\r{n / max(1, total) * 100:5.1f}%  {n}/{total}  ok {st['done']}  failed {st['failed']}  "
+                      f"{(n - st['skipped']) / el if el else 0:6.1f}/s  conns {pool.connections}", end="", flush=True)
+
+        async def worker():
+            while True:
+                job = await queue.get()
+                if job is None:
+                    return
+                z, x, y = job
+                status, data, attempts, err = await self._fetch(pool, limiter, z, x, y)
+                results.append((z, x, y, status, data, attempts, err))
+                if len(results) >= BATCH:
+                    flush()
+
+        tasks = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+        try:
+            queued = 0
+            for job in iter_tiles(bbox, zooms):
+                if state.get(job) in skip:
+                    st["skipped"] += 1
+                    continue
+                if max_tiles is not None and queued >= max_tiles:
+                    break
+                await queue.put(job)
+                queued += 1
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+            flush()
+            pool.close()
+            fmt = self.fmt or db.execute("SELECT value FROM metadata WHERE name='format'").fetchone()
+            store.ext = fmt if isinstance(fmt, str) else (fmt[0] if fmt else "jpg")
+            w, s, e, n = bbox or (-180.0, -85.05112878, 180.0, 85.05112878)
+            store.close({"name": os.path.splitext(os.path.basename(self.out))[0], "type": "baselayer",
+                         "minzoom": min(zooms), "maxzoom": max(zooms), "bounds": (w, s, e, n)})
+        st["seconds"] = round(time.time() - t0, 3)
+        st["tiles_per_s"] = round((st["done"] + st["missing"] + st["failed"]) / st["seconds"], 1) if st["seconds"] else 0.0
+        st["connections"] = pool.connections
+        st["requests"] = pool.requests
+        if not quiet:
+            print(f"\nOK {st['done']} downloaded, {st['skipped']} already present, {st['missing']} missing, "
+                  f"{st['failed']} failed  ({st['requests']} requests over {st['connections']} connections, "
+                  f"{st['bytes'] / 1048576:.1f} MiB, {st['seconds']:.1f}s)")
+            if st["failed"]:
+                print("  Failed tiles are kept in download_state; run again to retry them.")
+        return st
+
+    def run(self, bbox, zooms: List[int], **kw) -> dict:
+        return asyncio.run(self.run_async(bbox, zooms, **kw))
+
+
+def failed_tiles(out: str) -> List[Tuple[int, int, int, str]]:
+    """download_state 中失败的 (z, x, y, error)，对应 PS1 的 failed_tiles.txt。"""
+    with sqlite3.connect(out) as db:
+        return [(z, x, flip_y(row, z), err) for z, x, row, err in db.execute(
+            "SELECT zoom_level, tile_column, tile_row, error FROM download_state WHERE status=?", (FAILED,))]
+
+
+# ========== 本地替身瓦片服务器 ==========
+class StandInServer:
+    """
+    测试用瓦片服务器：GET /tile/{z}/{y}/{x} 返回小 JPEG（内容随瓦片号变化）。
+    - fail_rate：按比例返回 503（每张瓦片的前 fail_times 次请求），验证重试
+    - latency_ms：每次响应前的延迟；connections / requests 计数用于验证连接复用
+    """
+
+    def __init__(self, fail_rate: float = 0.0, fail_times: int = 1, latency_ms: float = 0.0, missing_rate: float = 0.0):
+        self.fail_rate = fail_rate
+        self.fail_times = fail_times
+        self.latency_ms = latency_ms
+        self.missing_rate = missing_rate
+        self.connections = 0
+        self.requests = 0
+        self.hits: Dict[Tuple[int, int, int], int] = {}
+        self._lock = threading.Lock()
+        self._images: Dict[int, bytes] = {}
+        self.httpd = None
+
+    def _image(self, shade: int) -> bytes:
+        if shade not in self._images:
+            from io import BytesIO
+            from PIL import Image
+            buf = BytesIO()
+            Image.new("RGB", (256, 256), (shade, 255 - shade, 128)).save(buf, "JPEG", quality=80)
+            self._images[shade] = buf.getvalue()
+        return self._images[shade]
+
+    def start(self) -> str:
+        srv = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with srv._lock:
+                    srv.connections += 1
+
+            def log_message(self, *a):
+                pass
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                with srv._lock:
+                    srv.requests += 1
+                try:
+                    z, y, x = int(parts[-3]), int(parts[-2]), int(parts[-1])
+                except (ValueError, IndexError):
+                    return self._send(400, b"")
+                key = (z, x, y)
+                with srv._lock:
+                    n = srv.hits[key] = srv.hits.get(key, 0) + 1
+                if srv.latency_ms:
+                    time.sleep(srv.latency_ms / 1000.0)
+                rnd = random.Random(hash(key))
+                if rnd.random() < srv.missing_rate:
+                    return self._send(404, b"")
+                if rnd.random() < srv.fail_rate and n <= srv.fail_times:
+                    return self._send(503, b"busy", {"Retry-After": "0"})
+                self._send(200, srv._image((x * 7 + y * 13 + z) % 256), {"Content-Type": "image/jpeg"})
+
+            def _send(self, code, body, headers=None):
+                self.send_response(code)
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+        ThreadingHTTPServer.daemon_threads = True
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/tile/{{z}}/{{y}}/{{x}}"
+
+    def stop(self) -> None:
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+def selftest(work_dir: Optional[str] = None, concurrency: int = 8) -> dict:
+    """替身服务器上：先下载一部分后中断，再续传完成；检查瓦片数与 estimate_total_tiles 一致、失败已重试、连接已复用。"""
+    bbox = (120.6457, 31.4615, 120.6502, 31.4654)      # 同 basemap/powershell.txt 示例
+    zooms = parse_zoom("16-20")
+    expected = count_tiles(bbox, zooms)
+    work = work_dir or tempfile.mkdtemp(prefix="dl_selftest_")
+    out = os.path.join(work, "standin.mbtiles")
+    for p in (out, out + "-wal", out + "-shm"):
+        if os.path.exists(p):
+            os.remove(p)
+    server = StandInServer(fail_rate=0.2, fail_times=1, latency_ms=5, missing_rate=0.01)
+    url = server.start()
+    try:
+        first = Downloader(out, url, concurrency=concurrency).run(bbox, zooms, max_tiles=expected // 2, quiet=True)
+        second = Downloader(out, url, concurrency=concurrency).run(bbox, zooms, quiet=True)
+    finally:
+        server.stop()
+    with sqlite3.connect(out) as db:
+        stored = db.execute("SELECT count(*) FROM tiles").fetchone()[0]
+        states = dict(db.execute("SELECT status, count(*) FROM download_state GROUP BY status"))
+    got = states.get(DONE, 0) + states.get(MISSING, 0)
+    ok = got == expected and stored == states.get(DONE, 0) and not states.get(FAILED) and second["skipped"] == first["done"] + first["missing"]
+    res = {"expected": expected, "first_run": first["done"] + first["missing"], "resumed_skipped": second["skipped"],
+           "stored": stored, "states": states, "retries": first["retries"] + second["retries"],
+           "requests": server.requests, "connections": server.connections,
+           "tiles_per_s": second["tiles_per_s"], "ok": ok}
+    print(f"{'PASS' if ok else 'FAIL'}  expected {expected} tiles (estimate_total_tiles), "
+          f"run 1 {res['first_run']}, run 2 skipped {res['resumed_skipped']}, stored {stored}, states {states}")
+    print(f"      {res['retries']} retries, {server.requests} requests over {server.connections} connections, "
+          f"{second['tiles_per_s']} tiles/s at concurrency {concurrency}")
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description="并发底图瓦片下载（keep-alive 连接池、限速、断点续传，输出 MBTiles）")
+    ap.add_argument("output", nargs="?", help="输出 *.mbtiles（同库保存下载状态）")
+    ap.add_argument("-z", "--zoom", default="10", help='缩放级，如 "16-19"')
+    ap.add_argument("--bbox", default=None, help="west,south,east,north（度）；缺省为全球")
+    ap.add_argument("--url", default=ESRI_URL, help="瓦片 URL 模板，含 {z} {x} {y}")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--rate", type=float, default=0.0, help="每秒请求上限，0 = 不限")
+    ap.add_argument("--retry", type=int, default=3, help="每张瓦片最多尝试次数")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--user-agent", default=USER_AGENT)
+    ap.add_argument("--no-retry-failed", action="store_true", help="续传时跳过上次已失败的瓦片")
+    ap.add_argument("--list-failed", action="store_true", help="列出失败瓦片后退出")
+    ap.add_argument("--selftest", action="store_true", help="在本地替身瓦片服务器上测试")
+    args = ap.parse_args()
+
+    if args.selftest:
+        sys.exit(0 if selftest(args.output, args.concurrency)["ok"] else 1)
+    if not args.output:
+        ap.print_help()
+        sys.exit(1)
+    if args.list_failed:
+        for z, x, y, err in failed_tiles(args.output):
+            print(f"{z}/{x}/{y}\t{err}\t{args.url.format(z=z, x=x, y=y)}")
+        return
+    bbox = tuple(float(v) for v in args.bbox.split(",")) if args.bbox else None
+    if bbox is not None and len(bbox) != 4:
+        raise SystemExit("--bbox 需要 west,south,east,north 四个数")
+    zooms = parse_zoom(args.zoom)
+    print(f"i {count_tiles(bbox, zooms)} tiles, zooms {zooms[0]}-{zooms[-1]}")
+    Downloader(args.output, args.url, args.concurrency, args.rate, args.retry, args.timeout,
+               args.user_agent).run(bbox, zooms, retry_failed=not args.no_retry_failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+逐瓦片自适应编码（代替固定 tile_driver = "PNG"）
+- 全不透明的影像瓦片 → JPEG 或 WEBP（目标质量）；范围边缘带部分透明的瓦片 → PNG 或带 alpha 的 WEBP
+- 颜色数不超过 256 的瓦片（纯色、分类图、色带渲染）→ 无损调色板 PNG，通常比 JPEG 还小
+- quantize=N：多色瓦片一律量化为 N 色调色板 PNG（DEM 色带 / 晕渲等可视化瓦片）
+- 目录布局的文件名不变（仍为 .png），浏览器与 Cesium 按内容识别格式；MBTiles 由 main.py 按内容返回 Content-Type
+- report：在已有瓦片集上比较各编码方式的总体积与 PSNR；recode：把已有 PNG 金字塔（如 gdal2tiles 输出）就地改为自适应编码
+用法：
+  python tiler.py DOM.tif map/ --tiledriver AUTO --auto-opaque WEBP --quality 80
+  python tile_encode.py report map/ --sample 300
+  python tile_encode.py recode map/ --quality 85 --processes 8
+  python tile_encode.py recode dem_map/ --quantize 64
+"""
+import os
+import sys
+import math
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from tile_store import is_mbtiles, sniff_format, write_file_atomic
+
+OPAQUE_FORMATS = ("JPEG", "WEBP")
+ALPHA_FORMATS = ("PNG", "WEBP")
+TILE_EXTS = (".png", ".jpg", ".jpeg", ".webp")
+RECODE_MIN_SAVING = 0.05   # recode 至少省下这一比例才替换
+
+
+# ========== 编码 ==========
+def _unique_colors(rgba: np.ndarray, limit: int = 256) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """颜色数不超过 limit 时返回 (调色板 uint32, 索引)，否则 None。先在抽样像元上粗判，避免整图 unique。"""
+    v = np.ascontiguousarray(rgba).view(np.uint32)[..., 0]
+    if len(np.unique(v[::7, ::7])) > limit:
+        return None
+    pal, idx = np.unique(v, return_inverse=True)
+    if len(pal) > limit:
+        return None
+    return pal, idx.reshape(v.shape).astype(np.uint8)
+
+
+def _palette_png(pal: np.ndarray, idx: np.ndarray) -> bytes:
+    """无损调色板 PNG（alpha 存在 tRNS 中）。"""
+    rgba = pal.view(np.uint8).reshape(-1, 4)
+    img = Image.fromarray(idx, "P")
+    img.putpalette(rgba[:, :3].ravel().tolist())
+    buf = BytesIO()
+    if rgba[:, 3].min() < 255:
+        img.save(buf, "PNG", optimize=True, transparency=bytes(rgba[:, 3].tolist()))
+    else:
+        img.save(buf, "PNG", optimize=True)
+    return buf.getvalue()
+
+
+def _quantized_png(rgba: np.ndarray, colors: int) -> bytes:
+    """
+    量化调色板 PNG：只量化 RGB；有透明像元时按 alpha > 0 取二值掩膜，透明像元用保留的最后一个调色板
+    索引（tRNS 中 alpha 为 0）。直接量化 RGBA（FASTOCTREE）会把部分不透明像元归到透明色，影像出现空洞。
+    """
+    visible = rgba[..., 3] > 0
+    masked = not visible.all()
+    colors = max(2, min(255 if masked else 256, colors))
+    # 只用可见像元参与量化（1 行图像），透明像元的 RGB 不占调色板
+    src = rgba[..., :3][visible][None] if masked else rgba[..., :3]
+    q = Image.fromarray(np.ascontiguousarray(src), "RGB").quantize(
+        colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    palette = q.getpalette()[:3 * colors]
+    if masked:
+        k = len(palette) // 3
+        idx = np.full(visible.shape, k, np.uint8)
+        idx[visible] = np.asarray(q)[0]
+        img = Image.fromarray(idx, "P")
+        img.putpalette(palette + [0, 0, 0])
+        transparency = bytes([255] * k + [0])
+    else:
+        img, transparency = q, None
+    buf = BytesIO()
+    if transparency is None:
+        img.save(buf, "PNG", optimize=True)
+    else:
+        img.save(buf, "PNG", optimize=True, transparency=transparency)
+    return buf.getvalue()
+
+
+def _png(rgba: np.ndarray, quantize: int = 0) -> bytes:
+    pal = _unique_colors(rgba)
+    if pal is not None:
+        return _palette_png(*pal)
+    if quantize:
+        return _quantized_png(rgba, quantize)
+    opaque = rgba[..., 3].min() == 255
+    img = Image.fromarray(rgba[..., :3], "RGB") if opaque else Image.fromarray(rgba, "RGBA")
+    buf = BytesIO()
+    img.save(buf, "PNG", compress_level=6)
+    return buf.getvalue()
+
+
+def encode_adaptive(rgba: np.ndarray, quality: int = 85, opaque: str = "JPEG", alpha: str = "PNG",
+                    quantize: int = 0) -> bytes:
+    """按瓦片内容选择编码：少色 → 调色板 PNG；quantize > 0 → 量化 PNG；全不透明 → opaque；部分透明 → alpha。"""
+    pal = _unique_colors(rgba)
+    if pal is not None:
+        return _palette_png(*pal)
+    if quantize:
+        return _png(rgba, quantize)
+    buf = BytesIO()
+    if rgba[..., 3].min() == 255:
+        if opaque.upper() == "WEBP":
+            Image.fromarray(rgba[..., :3], "RGB").save(buf, "WEBP", quality=quality, method=4)
+        else:
+            Image.fromarray(rgba[..., :3], "RGB").save(buf, "JPEG", quality=quality, optimize=True)
+        return buf.getvalue()
+    if alpha.upper() == "WEBP":
+        # alpha 通道无损，颜色有损
+        Image.fromarray(rgba, "RGBA").save(buf, "WEBP", quality=quality, method=4, alpha_quality=100)
+        return buf.getvalue()
+    img = Image.fromarray(rgba, "RGBA")
+    img.save(buf, "PNG", compress_level=6)
+    return buf.getvalue()
+
+
+def decode(data: bytes) -> np.ndarray:
+    """任意格式瓦片 → (H, W, 4) RGBA uint8。"""
+    with Image.open(BytesIO(data)) as im:
+        return np.asarray(im.convert("RGBA"))
+
+
+def psnr(ref: np.ndarray, out: np.ndarray) -> float:
+    """RGB 通道 PSNR（只计 alpha > 0 的像元）；完全一致返回 inf。"""
+    m = ref[..., 3] > 0
+    if not m.any():
+        return math.inf
+    d = ref[..., :3][m].astype(np.float64) - out[..., :3][m].astype(np.float64)
+    mse = float((d * d).mean())
+    return math.inf if mse == 0 else 10 * math.log10(255.0 ** 2 / mse)
+
+
+# ========== 已有瓦片集 ==========
+def iter_tileset(path: str) -> Iterator[Tuple[str, bytes]]:
+    """(标识, 瓦片字节)：目录布局（跳过 .objects 内部对象）或 MBTiles。"""
+    if is_mbtiles(path):
+        import sqlite3
+        with sqlite3.connect(path) as db:
+            for z, x, y, data in db.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"):
+                if data:
+                    yield f"{z}/{x}/{y}", bytes(data)
+        return
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for fn in filenames:
+            if fn.lower().endswith(TILE_EXTS):
+                p = os.path.join(dirpath, fn)
+                with open(p, "rb") as f:
+                    yield p, f.read()
+
+
+CANDIDATES = {
+    "png": lambda t, q, n: _png(t),
+    "jpeg": lambda t, q, n: _jpeg(t, q) if t[..., 3].min() == 255 else _png(t),
+    "webp": lambda t, q, n: _webp(t, q),
+    "auto(jpeg/png)": lambda t, q, n: encode_adaptive(t, q, "JPEG", "PNG", n),
+    "auto(webp)": lambda t, q, n: encode_adaptive(t, q, "WEBP", "WEBP", n),
+}
+
+
+def _jpeg(t: np.ndarray, q: int) -> bytes:
+    buf = BytesIO()
+    Image.fromarray(t[..., :3], "RGB").save(buf, "JPEG", quality=q, optimize=True)
+    return buf.getvalue()
+
+
+def _webp(t: np.ndarray, q: int) -> bytes:
+    buf = BytesIO()
+    Image.fromarray(t, "RGBA").save(buf, "WEBP", quality=q, method=4, alpha_quality=100)
+    return buf.getvalue()
+
+
+def report(path: str, sample: int = 200, quality: int = 85, quantize: int = 0, seed: int = 0) -> Dict[str, dict]:
+    """
+    抽样 sample 张瓦片，按各编码方式重新编码：总体积、相对原始体积、平均 / 最低 PSNR、编码耗时。
+    （"jpeg" 行对部分透明瓦片退回 PNG，否则边缘会出现黑边。）
+    """
+    tiles = list(iter_tileset(path))
+    if not tiles:
+        raise FileNotFoundError(f"{path}: 没有瓦片")
+    random.Random(seed).shuffle(tiles)
+    tiles = tiles[:sample]
+    imgs = [decode(d) for _, d in tiles]
+    orig = sum(len(d) for _, d in tiles)
+    edge = sum(1 for t in imgs if t[..., 3].min() < 255)
+    rows = {"original": {"bytes": orig, "ratio": 1.0, "psnr_mean": math.inf, "psnr_min": math.inf, "ms": 0.0}}
+    for name, fn in CANDIDATES.items():
+        size, ps, t0 = 0, [], time.perf_counter()
+        for t in imgs:
+            b = fn(t, quality, quantize)
+            size += len(b)
+            ps.append(psnr(t, decode(b)))
+        ms = (time.perf_counter() - t0) * 1000 / len(imgs)
+        finite = [p for p in ps if math.isfinite(p)]
+        rows[name] = {"bytes": size, "ratio": round(size / orig, 4),
+                      "psnr_mean": round(sum(finite) / len(finite), 2) if finite else math.inf,
+                      "psnr_min": round(min(ps), 2), "ms": round(ms, 2)}
+    print(f"{len(imgs)} tiles sampled from {path} ({edge} with partial alpha), quality {quality}")
+    print(f"{'encoding':16s} {'KiB':>9s} {'ratio':>7s} {'PSNR mean':>10s} {'PSNR min':>9s} {'ms/tile':>8s}")
+    for name, r in rows.items():
+        print(f"{name:16s} {r['bytes'] / 1024:9.1f} {r['ratio']:7.3f} {r['psnr_mean']:10.2f} "
+              f"{r['psnr_min']:9.2f} {r['ms']:8.2f}")
+    return rows
+
+
+def _recode_one(path: str, quality: int, opaque: str, alpha: str, quantize: int) -> Tuple[int, int]:
+    with open(path, "rb") as f:
+        data = f.read()
+    # 已是有损格式（上次 recode 的结果或原本就是 JPEG / WEBP）：再编码只会叠加损失
+    if sniff_format(data) in ("jpg", "webp"):
+        return len(data), len(data)
+    out = encode_adaptive(decode(data), quality, opaque, alpha, quantize)
+    if len(out) > len(data) * (1 - RECODE_MIN_SAVING):
+        return len(data), len(data)
+    if os.stat(path).st_nlink > 1:
+        # 去重目录（tile_store.LooseStore）中的硬链接：原地改写，所有链接同时生效
+        with open(path, "r+b") as f:
+            f.write(out)
+            f.truncate()
+    else:
+        write_file_atomic(path, out)
+    return len(data), len(out)
+
+
+def recode(path: str, quality: int = 85, opaque: str = "JPEG", alpha: str = "PNG", quantize: int = 0,
+           processes: int = 0) -> dict:
+    """
+    就地把目录布局中的瓦片改为自适应编码；文件名不变。已是 JPEG / WEBP 的瓦片跳过，
+    其余只在至少省下 RECODE_MIN_SAVING 时替换，重复运行不会叠加有损压缩。
+    """
+    files, seen = [], set()
+    for dp, _, fns in os.walk(path):
+        for fn in fns:
+            if fn.lower().endswith(TILE_EXTS):
+                p = os.path.join(dp, fn)
+                st = os.stat(p)
+                if (st.st_dev, st.st_ino) not in seen:      # 硬链接只处理一次
+                    seen.add((st.st_dev, st.st_ino))
+                    files.append(p)
+    fn = partial(_recode_one, quality=quality, opaque=opaque, alpha=alpha, quantize=quantize)
+    t0 = time.time()
+    procs = processes or os.cpu_count() or 1
+    if procs <= 1:
+        res = list(map(fn, files))
+    else:
+        with ProcessPoolExecutor(procs) as ex:
+            res = list(ex.map(fn, files, chunksize=64))
+    before, after = sum(r[0] for r in res), sum(r[1] for r in res)
+    st = {"files": len(files), "before": before, "after": after, "seconds": round(time.time() - t0, 2)}
+    print(f"OK {len(files)} tiles  {before / 1048576:.1f} MiB → {after / 1048576:.1f} MiB "
+          f"({after / max(1, before) * 100:.1f}%)  {st['seconds']}s")
+    return st
+
+
+def main():
+    ap = argparse.ArgumentParser(description="瓦片自适应编码：体积 / PSNR 报告与已有金字塔重编码")
+    sub = ap.add_subparsers(dest="cmd")
+    rp = sub.add_parser("report", help="抽样比较各编码方式的体积与 PSNR")
+    rp.add_argument("tileset", help="瓦片目录或 *.mbtiles")
+    rp.add_argument("--sample", type=int, default=200)
+    rc = sub.add_parser("recode", help="就地改为自适应编码（目录布局）")
+    rc.add_argument("tileset")
+    rc.add_argument("--opaque", default="JPEG", choices=OPAQUE_FORMATS)
+    rc.add_argument("--alpha", default="PNG", choices=ALPHA_FORMATS)
+    rc.add_argument("--processes", type=int, default=0)
+    for p in (rp, rc):
+        p.add_argument("--quality", type=int, default=85)
+        p.add_argument("--quantize", type=int, default=0, help="PNG 量化色数（DEM 可视化瓦片），0 = 不量化")
+    args = ap.parse_args()
+
+    if args.cmd == "report":
+        report(args.tileset, args.sample, args.quality, args.quantize)
+    elif args.cmd == "recode":
+        if is_mbtiles(args.tileset):
+            raise SystemExit("recode 只支持目录布局；MBTiles 请用 tiler.py --tiledriver AUTO 重新生成")
+        recode(args.tileset, args.quality, args.opaque, args.alpha, args.quantize, args.processes)
+    else:
+        ap.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
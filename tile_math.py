@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Web Mercator 瓦片坐标换算
+- lonlat_to_tilexy 与 QGIS_code 脚本的 estimate_total_tiles、basemap/EsriTileDownloader.ps1 的
+  Get-TileX / Get-TileY 完全一致（向下取整 + 夹紧到 [0, 2^z-1]，纬度夹紧到 ±85.05112878）
+- 各模块（切片、动态切片、底图下载、预取）共用
+"""
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ORIGIN_SHIFT = 20037508.342789244   # EPSG:3857 半周长（米）
+MAX_LAT = 85.05112878
+TILE_SIZE = 256
+
+
+def clamp_lat(lat: float) -> float:
+    return max(min(lat, MAX_LAT), -MAX_LAT)
+
+
+def parse_zoom(zs) -> List[int]:
+    """"0-19" / "18" / 18 → 缩放级列表（同 QGIS_code 脚本）。"""
+    zs = str(zs).strip()
+    if "-" in zs:
+        a, b = zs.split("-", 1)
+        a, b = int(a), int(b)
+        return list(range(min(a, b), max(a, b) + 1))
+    return [int(zs)]
+
+
+def lonlat_to_tilexy(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    """经纬度 → XYZ 瓦片号。"""
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    lr = math.radians(clamp_lat(lat))
+    y = int((1.0 - math.log(math.tan(lr) + 1 / math.cos(lr)) / math.pi) / 2.0 * n)
+    return max(0, min(n - 1, x)), max(0, min(n - 1, y))
+
+
+def lonlat_to_tile_frac(lon: float, lat: float, z: int) -> Tuple[float, float]:
+    """经纬度 → 连续瓦片坐标（不取整），用于预测与插值。"""
+    n = 2 ** z
+    lr = math.radians(clamp_lat(lat))
+    return ((lon + 180.0) / 360.0 * n,
+            (1.0 - math.log(math.tan(lr) + 1 / math.cos(lr)) / math.pi) / 2.0 * n)
+
+
+def flip_y(y: int, z: int) -> int:
+    """XYZ ↔ TMS 的 Y 翻转。"""
+    return (2 ** z) - 1 - y
+
+
+def tile_bounds_3857(x: int, y: int, z: int) -> Tuple[float, float, float, float]:
+    """XYZ 瓦片的 EPSG:3857 范围 (left, bottom, right, top)。"""
+    size = 2 * ORIGIN_SHIFT / (2 ** z)
+    left = -ORIGIN_SHIFT + x * size
+    top = ORIGIN_SHIFT - y * size
+    return left, top - size, left + size, top
+
+
+def tile_bounds_lonlat(x: int, y: int, z: int) -> Tuple[float, float, float, float]:
+    """XYZ 瓦片的经纬度范围 (west, south, east, north)。"""
+    n = 2 ** z
+
+    def lat_of(yy):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * yy / n))))
+
+    return x / n * 360.0 - 180.0, lat_of(y + 1), (x + 1) / n * 360.0 - 180.0, lat_of(y)
+
+
+def tile_range(bounds: Tuple[float, float, float, float], z: int) -> Tuple[int, int, int, int]:
+    """经纬度范围 (west, south, east, north) 在 z 级覆盖的瓦片号 (xmin, ymin, xmax, ymax)。"""
+    w, s, e, n = bounds
+    x0, y0 = lonlat_to_tilexy(w, n, z)
+    x1, y1 = lonlat_to_tilexy(e, s, z)
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def tiles_per_zoom(bounds, zooms: Iterable[int]) -> Dict[int, int]:
+    """各缩放级瓦片数（同 estimate_total_tiles 的计算方式）。"""
+    out = {}
+    for z in zooms:
+        xmin, ymin, xmax, ymax = tile_range(bounds, z)
+        out[z] = max(0, xmax - xmin + 1) * max(0, ymax - ymin + 1)
+    return out
+
+
+def resolution(z: int, tile_size: int = TILE_SIZE) -> float:
+    """z 级地面分辨率（EPSG:3857 米/像素）。"""
+    return 2 * ORIGIN_SHIFT / (tile_size * 2 ** z)
+
+
+def zoom_for_resolution(res_m: float, tile_size: int = TILE_SIZE) -> int:
+    """不低于给定分辨率（米/像素，3857）的最小缩放级。"""
+    return max(0, int(math.ceil(math.log2(2 * ORIGIN_SHIFT / (tile_size * res_m)))))
+
+
+def raster_lonlat_bounds(crs, bounds, densify: int = 21) -> Optional[Tuple[float, float, float, float]]:
+    """栅格范围（源坐标系）→ 经纬度范围，纬度夹紧；需要 rasterio。"""
+    from rasterio.warp import transform_bounds
+    if crs is None:
+        return None
+    w, s, e, n = transform_bounds(crs, "EPSG:4326", *bounds, densify_pts=densify)
+    return w, clamp_lat(s), e, clamp_lat(n)
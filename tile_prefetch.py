@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""
+沿行驶路线的瓦片预取（USB 盘 / 散文件金字塔读取慢时，避免驶入新区域后地图卡顿）
+- TileCache：按字节计的有界 LRU，main.py 的 /tiles/<name>/ 与目录瓦片先查这里；统计命中率、
+  预取命中（预取进来后被请求到）与预取浪费（未被请求就被淘汰）
+- 条目带版本（tile_stamp：瓦片文件或 MBTiles 的大小 + 修改时间），版本不符即失效，
+  tiler.py --incremental / tile_encode.py recode 后下一次请求即读到新瓦片
+- Prefetcher 作为 LiveFeed 订阅者：按当前位置、航向、速度推算未来 horizon 秒的路线，
+  取沿途每个采样点周围 margin 圈瓦片，按到达先后排序后由后台线程读入 TileCache
+- 缩放级与瓦片集取自最近 ACTIVE_S 秒内客户端实际请求过的（即“当前显示的”），不猜测
+- 缓存中预取进来且尚未被请求的字节数不超过缓存上限的 share 比例（至多超出一张），其余留给按需读取；
+  新位置到来时放弃旧计划，预算满时先淘汰旧计划中不在新路线上的未用预取条目
+用法：
+  main.py 自动启用（环境变量 TILE_CACHE_MB、PREFETCH_S；PREFETCH_S=0 关闭预取），统计见 /api/prefetch/stats
+  python tile_prefetch.py replay mqtt_log_20251021_162012.txt --zoom 18-19   # 回放日志，对比有无预取的命中率
+  python tile_prefetch.py replay synthetic --speed 15 --load-ms 20            # 合成行驶轨迹
+"""
+import os
+import sys
+import math
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from gpchc import Fix, iter_file_fixes
+from tile_math import TILE_SIZE, lonlat_to_tile_frac, parse_zoom
+
+EARTH_R = 6378137.0
+CACHE_BYTES = 128 << 20
+PREFETCH_S = 20.0       # 预测时长（秒）
+MARGIN_TILES = 1        # 路线采样点周围再取几圈（视口宽度、转弯）
+PLAN_EVERY_S = 1.0      # 两次规划的最短间隔（按定位时间）
+ACTIVE_S = 120.0        # 最近多久内被请求过的瓦片集 / 缩放级才预取
+PREFETCH_SHARE = 0.5    # 预取最多占缓存上限的比例
+MIN_SPEED_MPS = 0.3     # 低于此速度只预取当前位置周围
+MAX_PLAN = 4096         # 单次计划的瓦片数上限
+ABSENT_TTL_S = 60.0     # 不存在的瓦片在此时间内不重复尝试
+ENTRY_OVERHEAD = 64
+
+Source = tuple          # ("mbtiles", path) 或 ("dir", 目录, 扩展名)
+Key = Tuple[Source, int, int, int]
+
+
+# ========== 缓存 ==========
+class TileCache:
+    """
+    按字节计的有界 LRU；get() 计入请求统计，contains() / put() 不计。线程安全。
+    传入 stamp 时与条目记录的版本比较，不一致视为未缓存（get() 同时删除该条目）。
+    """
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lru: "OrderedDict[Key, List]" = OrderedDict()   # key → [data, 是否预取且尚未被请求, 版本]
+        self._size = 0
+        self.prefetched_bytes = 0       # 预取进来且尚未被请求的条目占用
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "hits": 0, "prefetch_hits": 0, "prefetched": 0,
+                         "prefetch_wasted": 0, "evicted": 0, "stale": 0}
+
+    def get(self, key: Key, stamp=None) -> Optional[bytes]:
+        with self._lock:
+            self.counters["requests"] += 1
+            ent = self._lru.get(key)
+            if ent is None:
+                return None
+            if stamp is not None and ent[2] != stamp:
+                self._remove(key)
+                self.counters["stale"] += 1
+                return None
+            self._lru.move_to_end(key)
+            self.counters["hits"] += 1
+            if ent[1]:
+                ent[1] = False
+                self.prefetched_bytes -= len(ent[0]) + ENTRY_OVERHEAD
+                self.counters["prefetch_hits"] += 1
+            return ent[0]
+
+    def contains(self, key: Key, stamp=None) -> bool:
+        """是否已缓存（顺带移到最近使用端，使仍在路线上的瓦片不被淘汰）。"""
+        with self._lock:
+            ent = self._lru.get(key)
+            if ent is None or (stamp is not None and ent[2] != stamp):
+                return False
+            self._lru.move_to_end(key)
+            return True
+
+    def put(self, key: Key, data: bytes, prefetched: bool = False, stamp=None) -> None:
+        with self._lock:
+            old = self._lru.get(key)
+            if old is not None:
+                if old[2] == stamp:
+                    return
+                self._remove(key)
+            self._lru[key] = [data, prefetched, stamp]
+            self._size += len(data) + ENTRY_OVERHEAD
+            if prefetched:
+                self.prefetched_bytes += len(data) + ENTRY_OVERHEAD
+                self.counters["prefetched"] += 1
+            while self._size > self.max_bytes and self._lru:
+                self._remove(next(iter(self._lru)))
+                self.counters["evicted"] += 1
+
+    def drop_prefetched(self, keep: set) -> int:
+        """淘汰不在 keep 中、预取进来后一直未被请求的条目（旧计划的预测），返回淘汰数。"""
+        with self._lock:
+            stale = [k for k, ent in self._lru.items() if ent[1] and k not in keep]
+            for k in stale:
+                self._remove(k)
+            return len(stale)
+
+    def _remove(self, key: Key) -> None:
+        data, unused, _ = self._lru.pop(key)
+        self._size -= len(data) + ENTRY_OVERHEAD
+        if unused:
+            self.prefetched_bytes -= len(data) + ENTRY_OVERHEAD
+            self.counters["prefetch_wasted"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self.counters)
+            c.update(entries=len(self._lru), bytes=self._size, max_bytes=self.max_bytes,
+                     prefetched_bytes=self.prefetched_bytes)
+        c["hit_rate"] = round(c["hits"] / c["requests"], 4) if c["requests"] else None
+        c["misses"] = c["requests"] - c["hits"]
+        return c
+
+
+def load_tile(reader, src: Source, z: int, x: int, y: int) -> Optional[bytes]:
+    """从瓦片集读取一张瓦片：bytes、BLANK（记录为空白）或 None（不存在）。reader 为 tile_store.TileReader。"""
+    from tile_store import BLANK
+    if src[0] == "mbtiles":
+        return reader.get(src[1], z, x, y)
+    try:
+        with open(os.path.join(src[1], str(z), str(x), f"{y}.{src[2]}"), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return BLANK if reader.is_blank(src[1], z, x, y) else None
+
+
+def tile_stamp(src: Source, z: int, x: int, y: int) -> tuple:
+    """
+    瓦片当前版本：目录布局取瓦片文件（不存在时取空白记录）的大小 + 修改时间；MBTiles 取整个库的
+    （WAL 模式下提交先写 -wal 文件，checkpoint 后才改主库，两者都计入）。应在 load_tile 之前取。
+    """
+    if src[0] == "mbtiles":
+        return _file_stamp(src[1]), _file_stamp(src[1] + "-wal")
+    st = _file_stamp(os.path.join(src[1], str(z), str(x), f"{y}.{src[2]}"))
+    if st is not None:
+        return (st,)
+    from tile_store import BLANK_LIST
+    return None, _file_stamp(os.path.join(src[1], BLANK_LIST))
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+# ========== 路线预测 ==========
+def velocity_en(fix: Fix) -> Tuple[float, float]:
+    """东、北向速度（m/s）；ve/vn 缺失时用航向 + 速度。"""
+    if math.hypot(fix.ve, fix.vn) > 1e-3:
+        return fix.ve, fix.vn
+    h = math.radians(fix.heading)
+    return fix.speed * math.sin(h), fix.speed * math.cos(h)
+
+
+def predict_tiles(fix: Fix, zooms: Iterable[int], horizon_s: float = PREFETCH_S,
+                  margin: int = MARGIN_TILES, limit: int = MAX_PLAN) -> List[Tuple[int, int, int]]:
+    """
+    匀速直线外推 horizon_s 秒，按半个瓦片的步长采样，返回沿途 (z, x, y)（含周围 margin 圈），
+    按预计到达时间排序、去重；同一时刻低缩放级在前。
+    """
+    ve, vn = velocity_en(fix)
+    v = math.hypot(ve, vn)
+    cos_lat = max(math.cos(math.radians(fix.lat)), 1e-6)
+    samples = []   # (t, z, fx, fy)
+    for z in zooms:
+        tile_m = 2 * math.pi * EARTH_R * cos_lat / (1 << z)
+        n = int(v * horizon_s / (tile_m / 2)) if v >= MIN_SPEED_MPS else 0
+        for i in range(n + 1):
+            t = i * (tile_m / 2) / v if n else 0.0
+            lat = fix.lat + math.degrees(vn * t / EARTH_R)
+            lon = fix.lon + math.degrees(ve * t / (EARTH_R * cos_lat))
+            fx, fy = lonlat_to_tile_frac(lon, lat, z)
+            samples.append((t, z, fx, fy))
+    samples.sort(key=lambda s: (s[0], s[1]))
+    out: Dict[Tuple[int, int, int], None] = {}
+    for _, z, fx, fy in samples:
+        n = 1 << z
+        cx, cy = int(fx), int(fy)
+        for dy in range(-margin, margin + 1):
+            y = cy + dy
+            if not 0 <= y < n:
+                continue
+            for dx in range(-margin, margin + 1):
+                out.setdefault((z, (cx + dx) % n, y))
+        if len(out) >= limit:
+            break
+    return list(out)[:limit]
+
+
+# ========== 预取 ==========
+class Prefetcher:
+    """
+    LiveFeed 订阅者。serve_tile 每次请求调用 note_request() 登记瓦片集与缩放级；
+    新定位到来（至少间隔 plan_every_s）时重新规划，后台线程按计划读入 cache。
+    load(src, z, x, y) → bytes / BLANK / None；stamp(src, z, x, y) 给出瓦片版本（见 tile_stamp），None 时不校验。
+    """
+
+    def __init__(self, cache: TileCache, load: Callable[[Source, int, int, int], Optional[bytes]],
+                 horizon_s: float = PREFETCH_S, margin: int = MARGIN_TILES, plan_every_s: float = PLAN_EVERY_S,
+                 active_s: float = ACTIVE_S, share: float = PREFETCH_SHARE, clock: Callable[[], float] = time.monotonic,
+                 stamp: Optional[Callable[[Source, int, int, int], tuple]] = None):
+        self.cache = cache
+        self.load = load
+        self.stamp = stamp
+        self.horizon_s = horizon_s
+        self.margin = margin
+        self.plan_every_s = plan_every_s
+        self.active_s = active_s
+        self.share = share
+        self.clock = clock
+        self._active: Dict[Source, Dict[int, float]] = {}
+        self._absent: Dict[Key, float] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending: Optional[Fix] = None
+        self._last_plan_t: Dict[str, float] = {}
+        self._gen = 0
+        self.counters = {"fixes": 0, "plans": 0, "planned": 0, "cached": 0, "loaded": 0, "absent": 0,
+                         "abandoned": 0, "load_s": 0.0, "plan_s": 0.0}
+
+    def note_request(self, src: Source, z: int) -> None:
+        now = self.clock()
+        with self._lock:
+            self._active.setdefault(src, {})[z] = now
+
+    def targets(self) -> List[Tuple[Source, List[int]]]:
+        """最近 active_s 秒内被请求过的 (瓦片集, 缩放级列表)。"""
+        cutoff = self.clock() - self.active_s
+        with self._lock:
+            out = []
+            for src, zs in list(self._active.items()):
+                live = sorted(z for z, t in zs.items() if t >= cutoff)
+                if live:
+                    out.append((src, live))
+                else:
+                    del self._active[src]
+            return out
+
+    def __call__(self, fix: Fix) -> None:
+        if fix.lat == 0.0 and fix.lon == 0.0:
+            return
+        self.counters["fixes"] += 1
+        last = self._last_plan_t.get(fix.device)
+        if last is not None and 0 <= fix.t - last < self.plan_every_s:
+            return
+        self._last_plan_t[fix.device] = fix.t
+        with self._lock:
+            self._pending = fix
+            self._gen += 1
+        self._wake.set()
+
+    def plan(self, fix: Fix) -> List[Key]:
+        """fix → 需要预取的瓦片键（按到达先后；各瓦片集交替）。"""
+        t0 = time.perf_counter()
+        per_src = [[(src, z, x, y) for z, x, y in predict_tiles(fix, zs, self.horizon_s, self.margin)]
+                   for src, zs in self.targets()]
+        keys = [k for group in _interleave(per_src) for k in group]
+        self.counters["plans"] += 1
+        self.counters["planned"] += len(keys)
+        self.counters["plan_s"] += time.perf_counter() - t0
+        return keys
+
+    def warm(self, keys: List[Key], gen: Optional[int] = None, limit: Optional[int] = None) -> int:
+        """
+        按顺序把 keys 读入缓存，返回处理到的位置；已缓存的跳过，缓存中未被请求的预取字节达到
+        max_bytes * share、处理 limit 张（仅回放时用于模拟读盘速度）或出现更新的计划（gen 改变）时停止。
+        """
+        budget = self.cache.max_bytes * self.share
+        loads, now, keep = 0, self.clock(), None
+        for i, key in enumerate(keys):
+            if gen is not None and gen != self._gen:
+                self.counters["abandoned"] += 1
+                return i
+            if limit is not None and loads >= limit:
+                return i
+            if self.cache.prefetched_bytes >= budget:
+                if keep is not None:
+                    return i
+                # 预算已满：先淘汰旧计划中不在本计划里的未用预测，仍满则停止
+                keep = set(keys)
+                self.cache.drop_prefetched(keep)
+                if self.cache.prefetched_bytes >= budget:
+                    return i
+            stamp = self.stamp(*key) if self.stamp is not None else None
+            if self.cache.contains(key, stamp):
+                self.counters["cached"] += 1
+                continue
+            seen = self._absent.get(key)
+            if seen is not None and now - seen < ABSENT_TTL_S:
+                continue
+            t0 = time.perf_counter()
+            data = self.load(*key)
+            self.counters["load_s"] += time.perf_counter() - t0
+            loads += 1
+            if data is None:
+                self._absent[key] = now
+                self.counters["absent"] += 1
+                if len(self._absent) > MAX_PLAN * 4:
+                    self._absent = {k: t for k, t in self._absent.items() if now - t < ABSENT_TTL_S}
+                continue
+            self.counters["loaded"] += 1
+            self.cache.put(key, data, prefetched=True, stamp=stamp)
+        return len(keys)
+
+    def run(self, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            if not self._wake.wait(0.5):
+                continue
+            self._wake.clear()
+            with self._lock:
+                fix, gen = self._pending, self._gen
+            if fix is None:
+                continue
+            try:
+                self.warm(self.plan(fix), gen)
+            except Exception:
+                # 瓦片集被替换 / 删除时读取可能失败，等下一次定位重新规划
+                pass
+
+    def start(self, stop_event: threading.Event) -> threading.Thread:
+        t = threading.Thread(target=self.run, args=(stop_event,), daemon=True)
+        t.start()
+        return t
+
+    def stats(self) -> dict:
+        c = dict(self.counters)
+        plans = c["plans"] or 1
+        c.update(horizon_s=self.horizon_s, margin=self.margin,
+                 plan_ms=round(c.pop("plan_s") * 1000 / plans, 3),
+                 load_ms=round(c.pop("load_s") * 1000 / max(c["loaded"] + c["absent"], 1), 3),
+                 targets=[{"source": os.path.basename(src[1]), "zooms": zs} for src, zs in self.targets()])
+        return c
+
+
+def _interleave(groups: List[List[Key]]) -> Iterator[List[Key]]:
+    """多个瓦片集的计划交替合并，避免第一个瓦片集占满预取预算。"""
+    for i in range(max((len(g) for g in groups), default=0)):
+        yield [g[i] for g in groups if i < len(g)]
+
+
+# ========== 回放评估 ==========
+def synthetic_drive(duration_s: float = 600.0, speed: float = 15.0, hz: float = 5.0,
+                    lon: float = 120.6474, lat: float = 31.4636) -> Iterator[Fix]:
+    """匀速行驶、航向缓慢摆动并每 2 分钟转弯 90° 的合成轨迹。"""
+    heading, t0 = 30.0, 1.7e9
+    for i in range(int(duration_s * hz)):
+        t = i / hz
+        h = heading + 90.0 * int(t // 120) + 10.0 * math.sin(t / 15.0)
+        ve, vn = speed * math.sin(math.radians(h)), speed * math.cos(math.radians(h))
+        lat += math.degrees(vn / hz / EARTH_R)
+        lon += math.degrees(ve / hz / (EARTH_R * math.cos(math.radians(lat))))
+        yield Fix(t=t0 + t, lat=lat, lon=lon, alt=0.0, heading=h % 360, ve=ve, vn=vn, speed=speed,
+                  status=42, device="synthetic", recv_t=t0 + t)
+
+
+def viewport_tiles(fix: Fix, z: int, width: int, height: int) -> set:
+    """以当前位置为中心的 width × height 像素视口覆盖的瓦片。"""
+    fx, fy = lonlat_to_tile_frac(fix.lon, fix.lat, z)
+    hw, hh = width / 2 / TILE_SIZE, height / 2 / TILE_SIZE
+    n = 1 << z
+    return {(z, x % n, y) for x in range(int(math.floor(fx - hw)), int(math.floor(fx + hw)) + 1)
+            for y in range(max(0, int(math.floor(fy - hh))), min(n - 1, int(math.floor(fy + hh))) + 1)}
+
+
+def replay(fixes: Iterable[Fix], zooms: List[int], horizon_s: float, margin: int = MARGIN_TILES,
+           cache_bytes: int = CACHE_BYTES, tile_bytes: int = 20000, load_ms: float = 20.0,
+           width: int = 1280, height: int = 800, view_every_s: float = 1.0,
+           prefetch: bool = True) -> dict:
+    """
+    按定位时间模拟：客户端每 view_every_s 秒把视口移到当前位置并请求新出现的瓦片；
+    预取线程在两次视口更新之间按 load_ms 一张的速度读盘（按需读取占用同一磁盘）。
+    瓦片内容为固定大小的占位数据，只统计缓存行为。
+    """
+    src = ("dir", "replay", "png")
+    sim = {"now": 0.0}
+    cache = TileCache(cache_bytes)
+    pf = Prefetcher(cache, lambda s, z, x, y: b"\0" * tile_bytes, horizon_s, margin, clock=lambda: sim["now"])
+    shown: set = set()
+    queue: List[Key] = []
+    pos, last_view, last_t, stall_s = 0, None, None, 0.0
+    for fix in fixes:
+        if fix.lat == 0.0 and fix.lon == 0.0:
+            continue
+        sim["now"] = fix.t
+        if prefetch and last_t is not None and queue:
+            # 上一段时间内磁盘空闲部分用于预取
+            budget = int(max(0.0, (fix.t - last_t) * 1000 - stall_s * 1000) / load_ms)
+            if budget:
+                pos += pf.warm(queue[pos:], limit=budget)
+            stall_s = 0.0
+        last_t = fix.t
+        if last_view is None or fix.t - last_view >= view_every_s:
+            last_view = fix.t
+            view = set()
+            for z in zooms:
+                view |= viewport_tiles(fix, z, width, height)
+            for z, x, y in sorted(view - shown):
+                key = (src, z, x, y)
+                pf.note_request(src, z)
+                if cache.get(key) is None:
+                    cache.put(key, b"\0" * tile_bytes)
+                    stall_s += load_ms / 1000
+            shown = view
+        if prefetch:
+            gen = pf._gen
+            pf(fix)
+            if pf._gen != gen:
+                queue, pos = pf.plan(fix), 0
+    st = cache.stats()
+    st["prefetch"] = pf.stats() if prefetch else None
+    return st
+
+
+def main():
+    ap = argparse.ArgumentParser(description="瓦片预取：回放日志评估命中率")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("replay", help="回放定位日志（或 synthetic），对比有无预取的瓦片缓存命中率")
+    rp.add_argument("logs", nargs="+", help="mqtt_log_*.txt，或 synthetic")
+    rp.add_argument("--zoom", default="18-19", help="客户端显示的缩放级，如 18 或 17-19")
+    rp.add_argument("--horizon", type=float, default=PREFETCH_S, help="预测时长（秒）")
+    rp.add_argument("--margin", type=int, default=MARGIN_TILES)
+    rp.add_argument("--budget-mb", type=float, default=CACHE_BYTES >> 20, help="缓存上限（MB）")
+    rp.add_argument("--tile-kb", type=float, default=20.0, help="平均瓦片大小（KB）")
+    rp.add_argument("--load-ms", type=float, default=20.0, help="单张瓦片读盘耗时（毫秒）")
+    rp.add_argument("--speed", type=float, default=15.0, help="synthetic 轨迹速度（m/s）")
+    rp.add_argument("--duration", type=float, default=600.0, help="synthetic 轨迹时长（秒）")
+    args = ap.parse_args()
+
+    def fixes():
+        for p in args.logs:
+            if p == "synthetic":
+                yield from synthetic_drive(args.duration, args.speed)
+            else:
+                yield from iter_file_fixes(p)
+
+    zooms = parse_zoom(args.zoom)
+    kw = dict(zooms=zooms, horizon_s=args.horizon, margin=args.margin, cache_bytes=int(args.budget_mb * (1 << 20)),
+              tile_bytes=int(args.tile_kb * 1024), load_ms=args.load_ms)
+    base = replay(fixes(), prefetch=False, **kw)
+    pre = replay(fixes(), prefetch=True, **kw)
+    print(f"zoom {args.zoom}  horizon {args.horizon:g}s  margin {args.margin}  budget {args.budget_mb:g} MB  "
+          f"load {args.load_ms:g} ms/tile")
+    print(f"{'':12s} {'requests':>9s} {'misses':>7s} {'hit rate':>9s} {'prefetched':>11s} {'used':>6s} {'wasted':>7s}")
+    for name, st in (("no prefetch", base), ("prefetch", pre)):
+        hr = f"{st['hit_rate']:.1%}" if st["hit_rate"] is not None else "-"
+        print(f"{name:12s} {st['requests']:9d} {st['misses']:7d} {hr:>9s} {st['prefetched']:11d} "
+              f"{st['prefetch_hits']:6d} {st['prefetch_wasted']:7d}")
+    if pre["prefetch"]:
+        p = pre["prefetch"]
+        print(f"plans {p['plans']}, {p['planned']} tiles planned, {p['plan_ms']:.2f} ms/plan")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+由最深一级瓦片向上合成金字塔（代替每一级都从原图重投影重采样）
+- 只有最深一级从源影像渲染；父瓦片由 4 个子瓦片 2×2 降采样得到
+- 降采样：average（默认）/ bilinear（4×4 帐篷核）/ mode（分类数据取众数，不产生新颜色）
+- 预乘 alpha 后再平均：边缘处透明像元不会把颜色拉暗（无黑边），alpha 按覆盖比例过渡
+- Z 序深度优先遍历：任一时刻只持有“当前块 + 每层至多 4 张”子瓦片，内存与影像大小无关
+"""
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+OVERVIEW_METHODS = ("average", "bilinear", "mode")
+
+
+def _tent_rows(a: np.ndarray) -> np.ndarray:
+    """沿第 0 轴 2 倍降采样，核 [1, 3, 3, 1] / 8，边界复制。"""
+    p = np.pad(a, ((1, 1),) + ((0, 0),) * (a.ndim - 1), mode="edge")
+    n = a.shape[0] // 2
+    return (p[0:2 * n:2] + 3 * p[1:2 * n + 1:2] + 3 * p[2:2 * n + 2:2] + p[3:2 * n + 3:2]) * 0.125
+
+
+def _mode_2x2(img: np.ndarray) -> np.ndarray:
+    v = np.ascontiguousarray(img).view(np.uint32)[..., 0]
+    a, b, c, d = v[0::2, 0::2], v[0::2, 1::2], v[1::2, 0::2], v[1::2, 1::2]
+    out = np.where((b == c) | (b == d), b, a)
+    out = np.where((c == d) & ~((b == c) | (b == d)), c, out)
+    out = np.where((a == b) | (a == c) | (a == d), a, out)
+    return out[..., None].view(np.uint8).reshape(out.shape + (4,))
+
+
+def downsample_2x(img: np.ndarray, method: str = "average") -> np.ndarray:
+    """(H, W, 4) RGBA uint8 → (H/2, W/2, 4)；H、W 须为偶数。"""
+    if method == "mode":
+        return _mode_2x2(img)
+    if method == "average" and img[..., 3].min() == 255:
+        # 全不透明（影像内部的常见情况）：整数直接平均
+        v = img.astype(np.uint16)
+        v = v[0::2, 0::2] + v[0::2, 1::2] + v[1::2, 0::2] + v[1::2, 1::2]
+        return ((v + 2) >> 2).astype(np.uint8)
+    a = img[..., 3].astype(np.float32)
+    pm = img[..., :3].astype(np.float32) * a[..., None]
+    if method == "bilinear":
+        pm = _tent_rows(_tent_rows(pm).swapaxes(0, 1)).swapaxes(0, 1)
+        a = _tent_rows(_tent_rows(a).T).T
+    else:
+        pm = pm[0::2, 0::2] + pm[0::2, 1::2] + pm[1::2, 0::2] + pm[1::2, 1::2]
+        a = a[0::2, 0::2] + a[0::2, 1::2] + a[1::2, 0::2] + a[1::2, 1::2]
+        pm *= 0.25
+        a *= 0.25
+    out = np.empty(a.shape + (4,), dtype=np.uint8)
+    safe = np.where(a > 0, a, 1.0)
+    out[..., :3] = np.clip(pm / safe[..., None] + 0.5, 0, 255).astype(np.uint8)
+    out[..., 3] = np.clip(a + 0.5, 0, 255).astype(np.uint8)
+    out[out[..., 3] == 0] = 0
+    return out
+
+
+class PyramidBuilder:
+    """
+    以 (z, x, y) 为根、向下到 base_zoom 的子树合成器。
+    - render(z, x0, y0, x1, y1) → base_zoom 上闭区间瓦片块的 RGBA 图（无交集返回 None）
+    - emit(z, x, y, rgba) 处理一张非空瓦片（编码 / 写出）；blank(z, x, y) 记录范围内的空白瓦片（可选）
+    - ranges[z] = (xmin, ymin, xmax, ymax)：各级有效瓦片范围，范围外的瓦片不渲染、不输出
+    - block_levels：子树高度不超过该值时一次性渲染整块，再在内存中逐级降采样
+    """
+
+    def __init__(self, base_zoom: int, ranges: Dict[int, Tuple[int, int, int, int]],
+                 render: Callable, emit: Callable, tile_size: int = 256,
+                 method: str = "average", block_levels: int = 3, blank: Optional[Callable] = None):
+        if method not in OVERVIEW_METHODS:
+            raise ValueError(f"未知降采样方法：{method}")
+        self.base = base_zoom
+        self.ranges = ranges
+        self.render = render
+        self.emit = emit
+        self.blank = blank or (lambda z, x, y: None)
+        self.ts = tile_size
+        self.method = method
+        self.block_levels = block_levels
+        self.counts: Dict[int, int] = {}
+
+    def _in_range(self, z: int, x: int, y: int) -> bool:
+        r = self.ranges.get(z)
+        return r is not None and r[0] <= x <= r[2] and r[1] <= y <= r[3]
+
+    def _overlap(self, z: int, x0: int, y0: int, x1: int, y1: int):
+        r = self.ranges[z]
+        ox0, oy0, ox1, oy1 = max(x0, r[0]), max(y0, r[1]), min(x1, r[2]), min(y1, r[3])
+        return (ox0, oy0, ox1, oy1) if ox0 <= ox1 and oy0 <= oy1 else None
+
+    def _count(self, z: int, n: int) -> None:
+        self.counts[z] = self.counts.get(z, 0) + n
+
+    def _emit_level(self, z: int, x0: int, y0: int, img: np.ndarray) -> None:
+        """img 覆盖 z 级 (x0, y0) 起的若干瓦片；逐张输出范围内的非空瓦片。"""
+        ts = self.ts
+        ny, nx = img.shape[0] // ts, img.shape[1] // ts
+        ov = self._overlap(z, x0, y0, x0 + nx - 1, y0 + ny - 1)
+        if ov is None:
+            return
+        self._count(z, (ov[2] - ov[0] + 1) * (ov[3] - ov[1] + 1))
+        for y in range(ov[1], ov[3] + 1):
+            for x in range(ov[0], ov[2] + 1):
+                tile = img[(y - y0) * ts:(y - y0 + 1) * ts, (x - x0) * ts:(x - x0 + 1) * ts]
+                if tile[..., 3].any():
+                    self.emit(z, x, y, tile)
+                else:
+                    self.blank(z, x, y)
+
+    def _finish(self, z: int, x: int, y: int, tile: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """输出子树根瓦片（范围内时），返回非空瓦片或 None。"""
+        if tile is not None and not tile[..., 3].any():
+            tile = None
+        if self._in_range(z, x, y):
+            self._count(z, 1)
+            if tile is None:
+                self.blank(z, x, y)
+            else:
+                self.emit(z, x, y, tile)
+        return tile
+
+    def base_block(self, z: int, x: int, y: int):
+        """(z, x, y) 覆盖的最深级瓦片中处于范围内的部分 (x0, y0, x1, y1)；无交集返回 None。"""
+        k = self.base - z
+        n = 1 << k
+        return self._overlap(self.base, x << k, y << k, (x << k) + n - 1, (y << k) + n - 1)
+
+    def _build_block(self, z: int, x: int, y: int) -> Optional[np.ndarray]:
+        k = self.base - z
+        n = 1 << k
+        bx0, by0 = x << k, y << k
+        ov = self.base_block(z, x, y)
+        if ov is None:
+            return None
+        part = self.render(self.base, *ov)
+        ts = self.ts
+        img = np.zeros((n * ts, n * ts, 4), dtype=np.uint8)
+        if part is not None:
+            img[(ov[1] - by0) * ts:(ov[3] - by0 + 1) * ts, (ov[0] - bx0) * ts:(ov[2] - bx0 + 1) * ts] = part
+        for lvl in range(self.base, z - 1, -1):
+            s = 1 << (lvl - z)
+            self._emit_level(lvl, x * s, y * s, img)
+            if lvl > z:
+                img = downsample_2x(img, self.method)
+        return img if img[..., 3].any() else None
+
+    def build(self, z: int, x: int, y: int) -> Optional[np.ndarray]:
+        """合成 (z, x, y) 子树并返回根瓦片（全透明时返回 None）。"""
+        if self.base - z <= self.block_levels:
+            return self._build_block(z, x, y)
+        ts = self.ts
+        canvas = None
+        for dy in (0, 1):
+            for dx in (0, 1):
+                cx, cy = 2 * x + dx, 2 * y + dy
+                if not self._overlap(z + 1, cx, cy, cx, cy):
+                    continue
+                child = self.build(z + 1, cx, cy)
+                if child is None:
+                    continue
+                if canvas is None:
+                    canvas = np.zeros((2 * ts, 2 * ts, 4), dtype=np.uint8)
+                canvas[dy * ts:(dy + 1) * ts, dx * ts:(dx + 1) * ts] = child
+        return self._finish(z, x, y, None if canvas is None else downsample_2x(canvas, self.method))
+
+    def build_from_children(self, z: int, x: int, y: int, children: Dict[Tuple[int, int], np.ndarray]) -> Optional[np.ndarray]:
+        """由已有的 z+1 级子瓦片（(cx, cy) → RGBA）合成并输出 (z, x, y)。"""
+        ts = self.ts
+        canvas = np.zeros((2 * ts, 2 * ts, 4), dtype=np.uint8)
+        hit = False
+        for dy in (0, 1):
+            for dx in (0, 1):
+                c = children.get((2 * x + dx, 2 * y + dy))
+                if c is not None:
+                    canvas[dy * ts:(dy + 1) * ts, dx * ts:(dx + 1) * ts] = c
+                    hit = True
+        return self._finish(z, x, y, downsample_2x(canvas, self.method) if hit else None)
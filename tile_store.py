@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+瓦片输出存储（tiler.py 的输出阶段）：内容去重 + 空白瓦片省略
+- 按像素内容哈希（BLAKE2b-128）：相同内容只编码、只存一次
+  · 目录布局 {z}/{x}/{y}.ext：实体存于 .objects/<hash>.ext，瓦片路径为其硬链接
+    （文件系统不支持硬链接或链接数达上限时退回普通文件）
+  · MBTiles：images / map 分表（标准 tiles 视图），tile_id 为内容哈希
+- 全透明瓦片不写出，记录在 blank_tiles.txt（目录）或 map.tile_id 为空（MBTiles），
+  服务器据此返回 204 或共享的空白瓦片，而不是 404
+- 多进程：工作进程 put() 后 drain() 交给主进程 absorb()；
+  目录布局由工作进程直接写文件，MBTiles 统一由主进程写库
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from tile_math import flip_y
+
+BLANK_LIST = "blank_tiles.txt"
+TILESET_JSON = "tileset.json"
+OBJECTS = ".objects"
+STAT_KEYS = ("tiles", "unique", "duplicates", "blank", "bytes", "dup_bytes")
+
+
+def pixel_hash(rgba: np.ndarray, encode_key: str = "") -> str:
+    """像素内容 + 编码参数的哈希：同样的像素换了格式 / 质量 / 量化后是不同的对象。"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(rgba).data)
+    h.update(repr(rgba.shape).encode())
+    h.update(encode_key.encode())
+    return h.hexdigest()
+
+
+def tile_path(out_dir: str, z: int, x: int, y: int, scheme: str, ext: str) -> str:
+    """XYZ 瓦片号 → 输出路径（TMS 时翻转 Y）。"""
+    yy = flip_y(y, z) if scheme == "tms" else y
+    return os.path.join(out_dir, str(z), str(x), f"{yy}.{ext}")
+
+
+def write_file_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def is_mbtiles(path: str) -> bool:
+    return path.lower().endswith(".mbtiles")
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """按文件头识别瓦片格式：png / jpg / webp；无法识别返回 None。"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class _Store:
+    def __init__(self, encode: Callable[[np.ndarray], bytes], dedup: bool = True, encode_key: str = ""):
+        self.encode = encode
+        self.dedup = dedup
+        self.encode_key = encode_key
+        self.stats = {k: 0 for k in STAT_KEYS}
+        self._pending_blank = []
+
+    def put_blank(self, z: int, x: int, y: int) -> None:
+        self.stats["tiles"] += 1
+        self.stats["blank"] += 1
+        self._pending_blank.append((z, x, y))
+
+    def drain(self) -> dict:
+        """工作进程：取出本批统计与待主进程处理的记录。"""
+        out = {"stats": self.stats, "blank": self._pending_blank}
+        self.stats = {k: 0 for k in STAT_KEYS}
+        self._pending_blank = []
+        return out
+
+    def summary(self, blank_tile_bytes: int = 0) -> dict:
+        s = dict(self.stats)
+        s["saved_bytes"] = s["dup_bytes"] + s["blank"] * blank_tile_bytes
+        s["saved_tiles"] = s["duplicates"] + s["blank"]
+        return s
+
+
+class LooseStore(_Store):
+    """{z}/{x}/{y}.ext 目录布局，重复内容以硬链接共享。"""
+
+    def __init__(self, out_dir: str, scheme: str, ext: str, encode, dedup: bool = True, encode_key: str = ""):
+        super().__init__(encode, dedup, encode_key)
+        self.out_dir = out_dir
+        self.scheme = scheme
+        self.ext = ext
+        self._blank_file = None
+
+    def path(self, z: int, x: int, y: int) -> str:
+        return tile_path(self.out_dir, z, x, y, self.scheme, self.ext)
+
+    def put(self, z: int, x: int, y: int, rgba: np.ndarray) -> None:
+        st = self.stats
+        st["tiles"] += 1
+        path = self.path(z, x, y)
+        if not self.dedup:
+            data = self.encode(rgba)
+            write_file_atomic(path, data)
+            st["unique"] += 1
+            st["bytes"] += len(data)
+            return
+        h = pixel_hash(rgba, self.encode_key)
+        obj = os.path.join(self.out_dir, OBJECTS, f"{h}.{self.ext}")
+        if os.path.exists(obj):
+            st["duplicates"] += 1
+            st["dup_bytes"] += os.path.getsize(obj)
+        else:
+            data = self.encode(rgba)
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            tmp = f"{obj}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            try:
+                os.link(tmp, obj)          # 多进程同时写同一内容时只有一个成功
+                st["unique"] += 1
+                st["bytes"] += len(data)
+            except FileExistsError:
+                st["duplicates"] += 1
+                st["dup_bytes"] += len(data)
+            except OSError:
+                # 文件系统不支持硬链接：直接写普通文件
+                self._mkdir(path)
+                os.replace(tmp, path)
+                st["unique"] += 1
+                st["bytes"] += len(data)
+                return
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        self._link(obj, path)
+
+    @staticmethod
+    def _mkdir(path: str) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _link(self, obj: str, path: str) -> None:
+        self._mkdir(path)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.link(obj, tmp)
+        except OSError:
+            # 不支持硬链接 / 链接数达上限（NTFS 1023）：写普通文件
+            with open(obj, "rb") as f:
+                data = f.read()
+            with open(tmp, "wb") as f:
+                f.write(data)
+        os.replace(tmp, path)
+
+    def put_blank(self, z: int, x: int, y: int) -> None:
+        super().put_blank(z, x, y)
+        p = self.path(z, x, y)
+        if os.path.exists(p):
+            os.remove(p)               # 重新切片后变为空白的旧瓦片
+
+    def read(self, z: int, x: int, y: int) -> Optional[bytes]:
+        p = self.path(z, x, y)
+        if not os.path.isfile(p):
+            return None
+        with open(p, "rb") as f:
+            return f.read()
+
+    def absorb(self, drained: dict) -> None:
+        """主进程：合并统计，追加空白瓦片记录（按磁盘上的 Y 记录）。"""
+        for k, v in drained["stats"].items():
+            self.stats[k] += v
+        if drained["blank"]:
+            if self._blank_file is None:
+                self._blank_file = open(os.path.join(self.out_dir, BLANK_LIST), "a", encoding="utf-8")
+            for z, x, y in drained["blank"]:
+                yy = flip_y(y, z) if self.scheme == "tms" else y
+                self._blank_file.write(f"{z} {x} {yy}\n")
+            self._blank_file.flush()
+
+    def reset(self) -> None:
+        """重新切片（非续切）时清空旧的空白记录。"""
+        p = os.path.join(self.out_dir, BLANK_LIST)
+        if os.path.exists(p):
+            os.remove(p)
+
+    def close(self, meta: Optional[dict] = None) -> None:
+        if self._blank_file is not None:
+            self._blank_file.close()
+            self._blank_file = None
+        # 清理已没有瓦片引用的实体（重切后被覆盖的旧内容）
+        objs = os.path.join(self.out_dir, OBJECTS)
+        if os.path.isdir(objs):
+            for e in os.scandir(objs):
+                # Windows 上 DirEntry.stat() 的 st_nlink 恒为 0，须对路径 os.stat
+                if e.is_file() and os.stat(e.path).st_nlink <= 1:
+                    os.remove(e.path)
+        if meta is not None:
+            meta = dict(meta, scheme=self.scheme, format=self.ext, blank_list=BLANK_LIST)
+            write_file_atomic(os.path.join(self.out_dir, TILESET_JSON),
+                              json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+class MBTilesStore(_Store):
+    """MBTiles（images / map 分表）。工作进程只编码并交出记录，写库在主进程。"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB);
+    CREATE TABLE IF NOT EXISTS map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT,
+                                    PRIMARY KEY (zoom_level, tile_column, tile_row));
+    CREATE VIEW IF NOT EXISTS tiles AS
+        SELECT map.zoom_level, map.tile_column, map.tile_row, images.tile_data
+        FROM map JOIN images ON images.tile_id = map.tile_id;
+    """
+
+    def __init__(self, path: str, ext: str, encode, dedup: bool = True, worker: bool = False, encode_key: str = ""):
+        super().__init__(encode, dedup, encode_key)
+        self.path = path
+        self.ext = ext
+        self._records = []
+        self._sent = set()
+        self._sizes: Dict[str, int] = {}
+        self.autocommit = True        # False 时直到 close() 才提交（增量更新整体原子可见）
+        self.db = None
+        if not worker:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path)
+            self.db.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;" + self.SCHEMA)
+            self._sizes = dict(self.db.execute("SELECT tile_id, length(tile_data) FROM images"))
+
+    def put(self, z: int, x: int, y: int, rgba: np.ndarray) -> None:
+        h = pixel_hash(rgba, self.encode_key) if self.dedup else f"{z}/{x}/{y}"
+        if h in self._sent:
+            self._records.append((z, x, y, h, None))
+        else:
+            self._records.append((z, x, y, h, self.encode(rgba)))
+            self._sent.add(h)
+
+    def put_encoded(self, z: int, x: int, y: int, data: bytes) -> None:
+        """已编码的瓦片（如下载得到的 JPEG）：按字节内容去重。"""
+        h = hashlib.blake2b(data, digest_size=16).hexdigest() if self.dedup else f"{z}/{x}/{y}"
+        self._records.append((z, x, y, h, None if h in self._sent else data))
+        self._sent.add(h)
+
+    def drain(self) -> dict:
+        out = super().drain()
+        out["tiles"] = self._records
+        self._records = []
+        self._sent = set()   # 批次之间由主进程按哈希去重（各批到达顺序不定）
+        return out
+
+    def absorb(self, drained: dict) -> None:
+        st = self.stats
+        for k, v in drained["stats"].items():
+            st[k] += v
+        rows = []
+        for z, x, y, h, data in drained.get("tiles", ()):
+            st["tiles"] += 1
+            # 不去重时键为 z/x/y，已存在说明是重切：必须覆盖旧图像
+            if self.dedup and h in self._sizes:
+                st["duplicates"] += 1
+                st["dup_bytes"] += self._sizes[h]
+            else:
+                self.db.execute("INSERT OR REPLACE INTO images VALUES (?, ?)", (h, sqlite3.Binary(data)))
+                self._sizes[h] = len(data)
+                st["unique"] += 1
+                st["bytes"] += len(data)
+            rows.append((z, x, flip_y(y, z), h))
+        rows.extend((z, x, flip_y(y, z), None) for z, x, y in drained["blank"])
+        self.db.executemany("INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?)", rows)
+        if self.autocommit:
+            self.db.commit()
+
+    def read(self, z: int, x: int, y: int) -> Optional[bytes]:
+        row = self.db.execute(
+            "SELECT images.tile_data FROM map JOIN images ON images.tile_id = map.tile_id "
+            "WHERE zoom_level=? AND tile_column=? AND tile_row=?", (z, x, flip_y(y, z))).fetchone()
+        return bytes(row[0]) if row else None
+
+    def reset(self) -> None:
+        self.db.executescript("DELETE FROM map; DELETE FROM images;")
+        self._sizes.clear()
+
+    def close(self, meta: Optional[dict] = None) -> None:
+        if self.db is None:
+            return
+        if meta is not None:
+            items = {
+                "name": meta.get("name", ""), "format": self.ext, "type": meta.get("type", "overlay"), "version": "1.1",
+                "minzoom": meta.get("minzoom"), "maxzoom": meta.get("maxzoom"),
+                "bounds": ",".join(f"{v:.7f}" for v in meta.get("bounds", ())),
+                "dedup": json.dumps(self.summary(meta.get("blank_tile_bytes", 0))),
+            }
+            self.db.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                                [(k, str(v)) for k, v in items.items() if v is not None])
+        # 删除被覆盖后不再引用的图像（续切 / 增量更新时出现）
+        self.db.execute("DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map WHERE tile_id IS NOT NULL)")
+        self.db.commit()
+        self.db.close()
+        self.db = None
+
+
+def open_store(out: str, scheme: str, ext: str, encode, dedup: bool = True, worker: bool = False,
+               encode_key: str = ""):
+    """
+    out 以 .mbtiles 结尾时输出 MBTiles，否则为目录布局。encode_key 为编码参数摘要，计入去重键，
+    换参数重切时不会复用旧编码的对象。
+    """
+    if is_mbtiles(out):
+        return MBTilesStore(out, ext, encode, dedup, worker, encode_key)
+    return LooseStore(out, scheme, ext, encode, dedup, encode_key)
+
+
+# ========== 服务端读取 ==========
+BLANK = b""   # 已记录的空白瓦片
+
+
+class TileReader:
+    """
+    供 main.py 使用：按 XYZ 读取 MBTiles，或查询目录布局的空白记录。
+    get() 返回 bytes（瓦片）、BLANK（空白瓦片）或 None（不存在）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blank_sets: Dict[str, Tuple[float, set]] = {}
+        self._local = threading.local()
+
+    def is_blank(self, tileset_dir: str, z: int, x: int, y: int) -> bool:
+        p = os.path.join(tileset_dir, BLANK_LIST)
+        try:
+            mtime = os.path.getmtime(p)
+        except OSError:
+            return False
+        with self._lock:
+            cached = self._blank_sets.get(p)
+            if cached is None or cached[0] != mtime:
+                with open(p, "r", encoding="utf-8") as f:
+                    s = {tuple(int(v) for v in ln.split()) for ln in f if ln.strip()}
+                cached = self._blank_sets[p] = (mtime, s)
+        return (z, x, y) in cached[1]
+
+    def _conn(self, path: str) -> sqlite3.Connection:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        c = conns.get(path)
+        if c is None:
+            c = conns[path] = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        return c
+
+    def mbtiles_format(self, path: str) -> str:
+        row = self._conn(path).execute("SELECT value FROM metadata WHERE name='format'").fetchone()
+        return row[0] if row else "png"
+
+    def get(self, path: str, z: int, x: int, y: int) -> Optional[bytes]:
+        row = self._conn(path).execute(
+            "SELECT images.tile_data FROM map LEFT JOIN images ON images.tile_id = map.tile_id "
+            "WHERE zoom_level=? AND tile_column=? AND tile_row=?", (z, x, flip_y(y, z))).fetchone()
+        if row is None:
+            return None
+        return BLANK if row[0] is None else bytes(row[0])
+
+
+def blank_png(size: int = 256) -> bytes:
+    """共享的全透明 PNG。"""
+    from io import BytesIO
+    from PIL import Image
+    buf = BytesIO()
+    Image.new("RGBA", (size, size), (0, 0, 0, 0)).save(buf, "PNG", optimize=True)
+    return buf.getvalue()
+
+
+def dedup_report(stats: dict) -> str:
+    t = max(1, stats["tiles"])
+    return (f"{stats['tiles']} tiles: {stats['unique']} unique, {stats['duplicates']} duplicate, "
+            f"{stats['blank']} blank skipped ({stats['saved_tiles'] / t * 100:.1f}% fewer files); "
+            f"stored {stats['bytes'] / 1e6:.1f} MB, saved {stats['saved_bytes'] / 1e6:.1f} MB")
+
@@ -0,0 +1,854 @@
+# -*- coding: utf-8 -*-
+"""
+无需 QGIS 的栅格切片工具（代替 QGIS_code/瓦片24*.py + gdal2tiles）
+- XYZ / TMS，PNG / JPEG / WEBP，支持断点续切（--resume）
+- 任务按“缩放级 × 空间块”切分（每块 block×block 张瓦片），进程池并行
+- 默认金字塔模式：只从源影像渲染最深一级，上层由子瓦片 2×2 合成（tile_pyramid.py），
+  按子树（Z 序）分发给进程池；--no-pyramid 时每一级都从源影像重采样
+- 每块只做一次窗口读取（按需降采样读取），内存占用与块大小有关、与原图大小无关
+- 进度按缩放级计数（O(1)），不扫描输出目录
+- 输出阶段按内容去重、省略全透明瓦片（tile_store.py）；输出路径以 .mbtiles 结尾时写 MBTiles
+- --tiledriver AUTO：逐瓦片选择 JPEG / WEBP / PNG（tile_encode.py），文件名仍为 .png
+用法：
+  python tiler.py DOM.tif map/ -z 16-22 --tiledriver PNG --processes 8 --resume
+  python tiler.py DOM_new.tif map/ --incremental    # 新航次更新部分区域后只重建变化的瓦片（仅金字塔模式）
+  python tiler.py --bench [工作目录]            # 合成 GeoTIFF 上的吞吐基准
+"""
+import os
+import sys
+import math
+import time
+import argparse
+import hashlib
+import json
+import tempfile
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from io import BytesIO
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import Affine, from_bounds
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds as window_from_bounds
+
+from tile_math import (TILE_SIZE, parse_zoom, raster_lonlat_bounds, tile_bounds_3857,
+                       tile_range, tiles_per_zoom, zoom_for_resolution)
+from profiling import sampled
+from tile_pyramid import OVERVIEW_METHODS, PyramidBuilder
+from tile_store import dedup_report, is_mbtiles, open_store, write_file_atomic
+
+DST_CRS = CRS.from_epsg(3857)
+EXTS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp", "AUTO": "png"}
+JOURNAL = ".tiler_journal"
+PYRAMID_JOBS = 64               # 金字塔模式按瓦片数约为此值的缩放级划分子树任务
+
+
+@dataclass
+class TilerOptions:
+    zooms: List[int]
+    scheme: str = "xyz"             # xyz（Y 自上而下）/ tms（Y 自下而上）
+    driver: str = "PNG"             # PNG / JPEG / WEBP / AUTO（逐瓦片选择）
+    tile_size: int = TILE_SIZE
+    resampling: str = "bilinear"
+    processes: int = 0              # 0 = CPU 数
+    resume: bool = False
+    s_srs: Optional[str] = None     # 源文件无坐标系时指定，如 "EPSG:4490"
+    block: int = 8                  # 每个任务块 block×block 张瓦片
+    quality: int = 85               # JPEG / WEBP 质量
+    scale: Optional[Tuple[float, float]] = None  # 非 8 位数据的拉伸范围；None = 自动 2%~98%
+    pyramid: bool = True            # 只从源渲染最深级，其余各级由子瓦片 2×2 合成
+    overview_resampling: str = "average"  # average / bilinear / mode
+    dedup: bool = True              # 相同内容只存一次（目录布局用硬链接，MBTiles 用 images/map 分表）
+    auto_opaque: str = "JPEG"       # AUTO：全不透明瓦片的格式（JPEG / WEBP）
+    auto_alpha: str = "PNG"         # AUTO：部分透明瓦片的格式（PNG / WEBP）
+    quantize: int = 0               # PNG / AUTO：量化为 N 色调色板（DEM 可视化瓦片），0 = 不量化
+
+    @property
+    def ext(self) -> str:
+        return EXTS[self.driver.upper()]
+
+
+@dataclass
+class SourceInfo:
+    path: str
+    crs: CRS
+    transform: Affine
+    width: int
+    height: int
+    count: int
+    dtype: str
+    nodata: Optional[float]
+    lonlat_bounds: Tuple[float, float, float, float]
+    native_zoom: int
+    alpha_band: Optional[int] = None
+    scale: Optional[Tuple[float, float]] = None
+    extra: dict = field(default_factory=dict)
+
+
+# ========== 源数据 ==========
+def _read_world_file(path: str) -> Optional[Affine]:
+    """读取 .tfw / .tifw / .wld 世界文件（像元中心 → 左上角）。"""
+    stem = os.path.splitext(path)[0]
+    for ext in (".tfw", ".tifw", ".wld"):
+        wf = stem + ext
+        if os.path.isfile(wf):
+            with open(wf, "r", encoding="utf-8", errors="ignore") as f:
+                a, d, b, e, c, ff = [float(v) for v in f.read().split()[:6]]
+            return Affine(a, b, c - a / 2 - b / 2, d, e, ff - d / 2 - e / 2)
+    return None
+
+
+def _read_prj(path: str) -> Optional[CRS]:
+    prj = os.path.splitext(path)[0] + ".prj"
+    if os.path.isfile(prj):
+        with open(prj, "r", encoding="utf-8", errors="ignore") as f:
+            return CRS.from_wkt(f.read())
+    return None
+
+
+def source_info(path: str, s_srs: Optional[str] = None, tile_size: int = TILE_SIZE) -> SourceInfo:
+    """读取源栅格的坐标系 / 仿射变换（缺失时用 .prj / .tfw 旁车文件）及范围。"""
+    with rasterio.open(path) as src:
+        crs = CRS.from_user_input(s_srs) if s_srs else (src.crs or _read_prj(path))
+        transform = src.transform
+        if transform == Affine.identity():
+            transform = _read_world_file(path) or transform
+        if crs is None or transform == Affine.identity():
+            raise ValueError(f"{path}: 缺少坐标系或地理参考（可用 --s_srs / .prj / .tfw）")
+        west, south, east, north = rasterio.transform.array_bounds(src.height, src.width, transform)
+        ll = raster_lonlat_bounds(crs, (west, south, east, north))
+        b3857 = transform_bounds(crs, DST_CRS, west, south, east, north, densify_pts=21)
+        res = max((b3857[2] - b3857[0]) / src.width, (b3857[3] - b3857[1]) / src.height)
+        alpha = None
+        for i, ci in enumerate(src.colorinterp, start=1):
+            if ci.name == "alpha":
+                alpha = i
+        if alpha is None and src.count in (2, 4):
+            alpha = src.count
+        return SourceInfo(
+            path=path, crs=crs, transform=transform, width=src.width, height=src.height,
+            count=src.count, dtype=src.dtypes[0], nodata=src.nodata, lonlat_bounds=ll,
+            native_zoom=zoom_for_resolution(res, tile_size), alpha_band=alpha,
+        )
+
+
+def auto_scale(src, info: SourceInfo, max_side: int = 1024) -> Tuple[float, float]:
+    """非 8 位数据：在降采样全图上取 2%~98% 作为拉伸范围。"""
+    f = max(1.0, max(info.width, info.height) / max_side)
+    shape = (max(1, int(info.height / f)), max(1, int(info.width / f)))
+    arr = src.read(1, out_shape=shape, masked=True).astype("float64")
+    vals = arr.compressed()
+    vals = vals[np.isfinite(vals)]
+    if vals.size == 0:
+        return 0.0, 255.0
+    lo, hi = np.percentile(vals, [2, 98])
+    return float(lo), float(hi if hi > lo else lo + 1)
+
+
+# ========== 渲染 ==========
+def read_source(src, info: SourceInfo, bounds_3857, width: int, height: int,
+                resampling: Resampling = Resampling.bilinear):
+    """
+    读取覆盖 EPSG:3857 区域的源窗口（按目标分辨率降采样读取），返回 (data, mask, read_transform)；
+    与源无交集时返回 None。data 已拉伸为 uint8。
+    """
+    left, bottom, right, top = bounds_3857
+    sb = transform_bounds(DST_CRS, info.crs, left, bottom, right, top, densify_pts=21)
+    win = window_from_bounds(*sb, transform=info.transform)
+    col0 = max(0, int(math.floor(win.col_off)) - 2)
+    row0 = max(0, int(math.floor(win.row_off)) - 2)
+    col1 = min(info.width, int(math.ceil(win.col_off + win.width)) + 2)
+    row1 = min(info.height, int(math.ceil(win.row_off + win.height)) + 2)
+    if col1 <= col0 or row1 <= row0:
+        return None
+    win = Window(col0, row0, col1 - col0, row1 - row0)
+
+    # 源窗口比目标更精细时按比例降采样读取（有内部金字塔时 GDAL 会直接用金字塔）
+    f = max(1.0, min(win.width / width, win.height / height))
+    out_w, out_h = max(1, int(round(win.width / f))), max(1, int(round(win.height / f)))
+    read_tf = info.transform * Affine.translation(col0, row0) * Affine.scale(win.width / out_w, win.height / out_h)
+
+    bands = [1, 2, 3] if info.count >= 3 else [1]
+    data = src.read(bands, window=win, out_shape=(len(bands), out_h, out_w), resampling=resampling)
+    if info.alpha_band:
+        mask = src.read(info.alpha_band, window=win, out_shape=(out_h, out_w), resampling=Resampling.nearest)
+    else:
+        mask = src.dataset_mask(window=win, out_shape=(out_h, out_w), resampling=Resampling.nearest)
+    if data.dtype != np.uint8:
+        lo, hi = info.scale or (0.0, 255.0)
+        valid = np.isfinite(data).all(axis=0)
+        data = np.clip((np.nan_to_num(data.astype("float64")) - lo) / (hi - lo) * 255.0, 0, 255).astype(np.uint8)
+        mask = np.where(valid, mask, 0).astype(np.uint8)
+    return data, mask.astype(np.uint8), read_tf
+
+
+def _digest_read(digest, read) -> None:
+    data, mask, tf = read
+    digest.update(repr((tf.a, tf.b, tf.c, tf.d, tf.e, tf.f, data.shape)).encode())
+    digest.update(data.tobytes())
+    digest.update(mask.tobytes())
+
+
+def render_region(src, info: SourceInfo, bounds_3857, width: int, height: int,
+                  resampling: Resampling = Resampling.bilinear, digest=None) -> Optional[np.ndarray]:
+    """
+    把源栅格渲染到 EPSG:3857 的一个矩形区域，返回 (height, width, 4) RGBA uint8；与源无交集时返回 None。
+    只读取覆盖该区域的源窗口，内存与输出尺寸成正比。digest（hashlib 对象）非空时累加所读源数据的哈希。
+    """
+    read = read_source(src, info, bounds_3857, width, height, resampling)
+    if read is None:
+        return None
+    if digest is not None:
+        _digest_read(digest, read)
+    data, mask, read_tf = read
+    dst_tf = from_bounds(*bounds_3857, width, height)
+    nb = data.shape[0]
+    out = np.zeros((nb + 1, height, width), dtype=np.uint8)
+    # 掩膜作为 alpha 波段一起重投影：GDAL 不会把无效像元混进边缘的有效像元
+    reproject(np.concatenate([data, mask[None]]), out, src_transform=read_tf,
+              src_crs=info.crs, dst_transform=dst_tf, dst_crs=DST_CRS, resampling=resampling,
+              src_alpha=nb + 1, dst_alpha=nb + 1)
+    if nb == 1:
+        out = out[[0, 0, 0, 1]]
+    return np.ascontiguousarray(out.transpose(1, 2, 0))
+
+
+def encode_tile(rgba: np.ndarray, driver: str = "PNG", quality: int = 85, opaque: str = "JPEG",
+                alpha: str = "PNG", quantize: int = 0) -> bytes:
+    """RGBA 数组编码为瓦片字节；JPEG 不支持透明，直接丢弃 alpha；AUTO 逐瓦片选择格式。"""
+    from PIL import Image
+    driver = driver.upper()
+    if driver == "AUTO" or (driver == "PNG" and quantize):
+        from tile_encode import encode_adaptive
+        return encode_adaptive(rgba, quality, opaque, alpha, quantize)
+    buf = BytesIO()
+    if driver == "JPEG":
+        Image.fromarray(rgba[..., :3], "RGB").save(buf, "JPEG", quality=quality)
+    elif driver == "WEBP":
+        Image.fromarray(rgba, "RGBA").save(buf, "WEBP", quality=quality, method=4)
+    else:
+        img = Image.fromarray(rgba, "RGBA") if rgba[..., 3].min() < 255 else Image.fromarray(rgba[..., :3], "RGB")
+        img.save(buf, "PNG", compress_level=6)
+    return buf.getvalue()
+
+
+# ========== 任务划分 ==========
+def iter_blocks(info: SourceInfo, zooms: List[int], block: int) -> Iterator[Tuple[int, int, int, int, int]]:
+    """(z, x0, y0, x1, y1)：按缩放级从深到浅、块内瓦片闭区间。"""
+    for z in sorted(zooms, reverse=True):
+        xmin, ymin, xmax, ymax = tile_range(info.lonlat_bounds, z)
+        for bx in range(xmin, xmax + 1, block):
+            for by in range(ymin, ymax + 1, block):
+                yield z, bx, by, min(bx + block - 1, xmax), min(by + block - 1, ymax)
+
+
+def block_tiles(job) -> int:
+    _, x0, y0, x1, y1 = job
+    return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+
+# ========== 进程池工作函数 ==========
+_W: dict = {}
+
+
+def _tile_encoder(opts: TilerOptions):
+    return partial(encode_tile, driver=opts.driver, quality=opts.quality, opaque=opts.auto_opaque,
+                   alpha=opts.auto_alpha, quantize=opts.quantize)
+
+
+def _open_store(out: str, opts: TilerOptions, worker: bool = False):
+    # 编码参数计入去重键：AUTO 与 PNG 同为 .png、换 --quality 等重切时不能复用旧对象
+    key = f"{opts.driver}|q{opts.quality}|k{opts.quantize}|{opts.auto_opaque}|{opts.auto_alpha}"
+    return open_store(out, opts.scheme, opts.ext, _tile_encoder(opts), opts.dedup, worker, key)
+
+
+def _init_worker(info: SourceInfo, opts: TilerOptions, out_dir: str) -> None:
+    _W["src"] = rasterio.open(info.path)
+    _W["info"] = info
+    _W["opts"] = opts
+    _W["store"] = _open_store(out_dir, opts, worker=True)
+
+
+def _block_geom(opts: TilerOptions, job):
+    z, x0, y0, x1, y1 = job
+    ts = opts.tile_size
+    left, _, _, top = tile_bounds_3857(x0, y0, z)
+    _, bottom, right, _ = tile_bounds_3857(x1, y1, z)
+    return (left, bottom, right, top), (x1 - x0 + 1) * ts, (y1 - y0 + 1) * ts
+
+
+def render_block(src, info: SourceInfo, opts: TilerOptions, job, digest=None) -> Optional[np.ndarray]:
+    """渲染一个任务块为 RGBA 大图。"""
+    bounds, w, h = _block_geom(opts, job)
+    return render_region(src, info, bounds, w, h, Resampling[opts.resampling], digest)
+
+
+def block_digest(src, info: SourceInfo, opts: TilerOptions, job) -> str:
+    """只读取、不渲染：与 render_block(digest=...) 得到相同的源数据哈希，用于增量切片的变化检测。"""
+    d = hashlib.blake2b(digest_size=16)
+    bounds, w, h = _block_geom(opts, job)
+    read = read_source(src, info, bounds, w, h, Resampling[opts.resampling])
+    if read is not None:
+        _digest_read(d, read)
+    return d.hexdigest()
+
+
+@sampled("tiler")
+def _run_block(job) -> dict:
+    src, info, opts, store = _W["src"], _W["info"], _W["opts"], _W["store"]
+    z, x0, y0, x1, y1 = job
+    ts = opts.tile_size
+    img = render_block(src, info, opts, job)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            tile = None if img is None else img[(y - y0) * ts:(y - y0 + 1) * ts, (x - x0) * ts:(x - x0 + 1) * ts]
+            if tile is not None and tile[..., 3].any():
+                store.put(z, x, y, tile)
+            else:
+                store.put_blank(z, x, y)
+    return {"job": job, "counts": {z: block_tiles(job)}, "store": store.drain()}
+
+
+def _pyramid_builder(info: SourceInfo, opts: TilerOptions, store, src=None,
+                     regions: Optional[dict] = None) -> PyramidBuilder:
+    """
+    regions 非空时记录每个区域（region_zoom 级瓦片，其下一次渲染的整块）的源数据哈希，写入清单供增量切片比较。
+    """
+    zmin, zmax = min(opts.zooms), max(opts.zooms)
+    rz = info.extra.get("region_zoom", zmax)
+    ranges = {z: tile_range(info.lonlat_bounds, z) for z in range(zmin, zmax + 1)}
+
+    def render(z, x0, y0, x1, y1):
+        if regions is None:
+            return render_block(src, info, opts, (z, x0, y0, x1, y1))
+        d = hashlib.blake2b(digest_size=16)
+        img = render_block(src, info, opts, (z, x0, y0, x1, y1), d)
+        regions[region_key(x0 >> (zmax - rz), y0 >> (zmax - rz))] = d.hexdigest()
+        return img
+
+    return PyramidBuilder(
+        zmax, ranges, render=render, emit=store.put, blank=store.put_blank,
+        tile_size=opts.tile_size, method=opts.overview_resampling, block_levels=zmax - rz,
+    )
+
+
+def region_key(x: int, y: int) -> str:
+    return f"{x}/{y}"
+
+
+@sampled("tiler")
+def _run_subtree(job) -> dict:
+    """金字塔模式：渲染 job=(z, x, y) 以下到最深级的整棵子树，返回根瓦片供上层合成。"""
+    src, info, opts, store = _W["src"], _W["info"], _W["opts"], _W["store"]
+    regions = {}
+    pb = _pyramid_builder(info, opts, store, src, regions)
+    root = pb.build(*job)
+    return {"job": job, "counts": pb.counts, "root": root, "regions": regions, "store": store.drain()}
+
+
+def _hash_regions(keys) -> dict:
+    """工作进程：计算一批区域的源数据哈希（区域与源无交集时不记录）。"""
+    src, info, opts, store = _W["src"], _W["info"], _W["opts"], _W["store"]
+    pb = _pyramid_builder(info, opts, store)
+    rz = info.extra["region_zoom"]
+    out = {}
+    for x, y in keys:
+        ov = pb.base_block(rz, x, y)
+        if ov is not None:
+            out[region_key(x, y)] = block_digest(src, info, opts, (max(opts.zooms),) + ov)
+    return {"job": (), "counts": {}, "regions": out, "store": store.drain()}
+
+
+def pyramid_split_zoom(info: SourceInfo, zooms: List[int], target: int = PYRAMID_JOBS) -> int:
+    """金字塔模式的任务划分级：瓦片数首次达到 target 的缩放级（不超过最深级）。"""
+    for z in range(min(zooms), max(zooms) + 1):
+        if tiles_per_zoom(info.lonlat_bounds, [z])[z] >= target:
+            return z
+    return max(zooms)
+
+
+def subtree_counts(info: SourceInfo, zmax: int, z: int, x: int, y: int) -> Dict[int, int]:
+    """(z, x, y) 子树在各级范围内的瓦片数。"""
+    out = {}
+    for zz in range(z, zmax + 1):
+        xmin, ymin, xmax, ymax = tile_range(info.lonlat_bounds, zz)
+        s = 1 << (zz - z)
+        nx = min(xmax, x * s + s - 1) - max(xmin, x * s) + 1
+        ny = min(ymax, y * s + s - 1) - max(ymin, y * s) + 1
+        out[zz] = max(0, nx) * max(0, ny)
+    return out
+
+
+def _decode_tile(data: Optional[bytes]) -> Optional[np.ndarray]:
+    """续切时读回已输出的子树根瓦片（不存在即为空白）。"""
+    if data is None:
+        return None
+    from PIL import Image
+    with Image.open(BytesIO(data)) as im:
+        return np.asarray(im.convert("RGBA"))
+
+
+# ========== 主流程 ==========
+def _hms(sec: float) -> str:
+    sec = max(0, int(sec))
+    return f"{sec // 3600:02d}:{(sec % 3600) // 60:02d}:{sec % 60:02d}"
+
+
+class Progress:
+    """按缩放级累计的进度（每块完成时 O(1) 更新）。"""
+
+    def __init__(self, per_zoom: Dict[int, int]):
+        self.per_zoom = per_zoom
+        self.done = {z: 0 for z in per_zoom}
+        self.total = sum(per_zoom.values())
+        self.start = time.time()
+        self.last_print = 0.0
+
+    def add(self, z: int, n: int) -> None:
+        self.done[z] += n
+
+    def line(self, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self.last_print < 1.0:
+            return
+        self.last_print = now
+        done = sum(self.done.values())
+        el = now - self.start
+        rate = done / el if el > 0 else 0.0
+        eta = _hms((self.total - done) / rate) if rate > 0 else "--:--:--"
+        cur = next((z for z in sorted(self.per_zoom, reverse=True) if self.done[z] < self.per_zoom[z]), None)
+        zs = f"z{cur} {self.done[cur] / max(1, self.per_zoom[cur]) * 100:5.1f}%" if cur is not None else "all zooms"
+        pct = done / max(1, self.total) * 100
+        print(f"\r{pct:5.1f}%  tiles {done}/{self.total}  {zs}  {rate:7.1f}/s  "
+              f"elapsed {_hms(el)}  ETA {eta}", end="", flush=True)
+
+
+def journal_path(out: str) -> str:
+    return out + JOURNAL if is_mbtiles(out) else os.path.join(out, JOURNAL)
+
+
+def _load_journal(out: str) -> set:
+    path = journal_path(out)
+    if not os.path.isfile(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {tuple(int(v) for v in ln.split()) for ln in f if ln.strip()}
+
+
+def _run_jobs(worker, todo: list, info: SourceInfo, opts: TilerOptions, out_dir: str, collect) -> None:
+    procs = opts.processes or os.cpu_count() or 1
+    if procs <= 1:
+        _init_worker(info, opts, out_dir)
+        for j in todo:
+            collect(worker(j))
+        return
+    with ProcessPoolExecutor(procs, initializer=_init_worker, initargs=(info, opts, out_dir)) as ex:
+        pending = set()
+        for j in todo:
+            pending.add(ex.submit(worker, j))
+            if len(pending) >= procs * 4:
+                fin, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fu in fin:
+                    collect(fu.result())
+        for fu in pending:
+            collect(fu.result())
+
+
+def tile_raster(src_path: str, out_dir: str, opts: TilerOptions, quiet: bool = False) -> dict:
+    """切片主入口；out_dir 以 .mbtiles 结尾时输出 MBTiles。返回统计信息。"""
+    info = source_info(src_path, opts.s_srs, opts.tile_size)
+    if info.dtype != "uint8":
+        with rasterio.open(src_path) as src:
+            info.scale = opts.scale or auto_scale(src, info)
+    if not is_mbtiles(out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+    pyramid = opts.pyramid and len(opts.zooms) > 1
+    if pyramid:
+        opts.zooms = list(range(min(opts.zooms), max(opts.zooms) + 1))
+        zs = pyramid_split_zoom(info, opts.zooms)
+        info.extra["region_zoom"] = max(zs, max(opts.zooms) - int(math.log2(max(1, opts.block))))
+        xmin, ymin, xmax, ymax = tile_range(info.lonlat_bounds, zs)
+        jobs = [(zs, x, y) for y in range(ymin, ymax + 1) for x in range(xmin, xmax + 1)]
+    else:
+        jobs = list(iter_blocks(info, opts.zooms, opts.block))
+    store = _open_store(out_dir, opts)
+    done_jobs = _load_journal(out_dir) if opts.resume else set()
+    if not opts.resume:
+        if os.path.exists(journal_path(out_dir)):
+            os.remove(journal_path(out_dir))
+        store.reset()
+    per_zoom = tiles_per_zoom(info.lonlat_bounds, opts.zooms)
+    prog = Progress(per_zoom)
+    todo = [j for j in jobs if tuple(j) not in done_jobs]
+    if not quiet:
+        print(f"i Source: {info.width}x{info.height} {info.dtype} x{info.count}, native zoom ~{info.native_zoom}")
+        print("i Per zoom:", ", ".join(f"z{z}={n}" for z, n in sorted(per_zoom.items())))
+        mode = f"pyramid from z{max(opts.zooms)} ({opts.overview_resampling}), split at z{zs}" if pyramid else "per-zoom blocks"
+        print(f"i Jobs: {len(todo)} to render ({len(jobs) - len(todo)} resumed), {mode}")
+
+    roots: Dict[Tuple[int, int], np.ndarray] = {}
+    regions: Dict[str, str] = {}
+    t0 = time.perf_counter()
+    with open(journal_path(out_dir), "a", encoding="utf-8") as journal:
+        def collect(r):
+            store.absorb(r["store"])
+            regions.update(r.get("regions", {}))
+            for z, n in r["counts"].items():
+                prog.add(z, n)
+            if r.get("root") is not None:
+                roots[r["job"][1:]] = r["root"]
+            journal.write(" ".join(str(v) for v in r["job"]) + "\n")
+            journal.flush()
+            if not quiet:
+                prog.line()
+
+        if pyramid:
+            for j in jobs:
+                if tuple(j) in done_jobs:
+                    # 已完成的子树：计入进度，并读回根瓦片供上层合成
+                    for z, n in subtree_counts(info, max(opts.zooms), *j).items():
+                        prog.add(z, n)
+                    tile = _decode_tile(store.read(*j))
+                    if tile is not None:
+                        roots[j[1:]] = tile
+            _run_jobs(_run_subtree, todo, info, opts, out_dir, collect)
+            # 划分级以上：在主进程内由子树根瓦片逐级合成
+            pb = _pyramid_builder(info, opts, store)
+            for z in range(zs - 1, min(opts.zooms) - 1, -1):
+                xmin, ymin, xmax, ymax = tile_range(info.lonlat_bounds, z)
+                level = {}
+                for y in range(ymin, ymax + 1):
+                    for x in range(xmin, xmax + 1):
+                        tile = pb.build_from_children(z, x, y, roots)
+                        if tile is not None:
+                            level[(x, y)] = tile
+                prog.add(z, pb.counts.pop(z, 0))
+                roots = level
+            store.absorb(store.drain())
+            if done_jobs:
+                # 续切跳过的子树没有区域哈希：补算（只读不渲染）
+                rz = info.extra["region_zoom"]
+                xmin, ymin, xmax, ymax = tile_range(info.lonlat_bounds, rz)
+                missing = [(x, y) for y in range(ymin, ymax + 1) for x in range(xmin, xmax + 1)
+                           if region_key(x, y) not in regions]
+                _run_jobs(_hash_regions, _chunks(missing, 16), info, opts, out_dir,
+                          lambda r: regions.update(r["regions"]))
+            write_manifest(out_dir, info, opts, regions)
+        else:
+            # 逐级重采样的输出无法按区域增量更新：删除先前金字塔切片留下的清单，免得 --incremental 拿旧哈希比较
+            for p in (manifest_path(out_dir), manifest_path(out_dir) + ".pending"):
+                if os.path.exists(p):
+                    os.remove(p)
+            for j in jobs:
+                if tuple(j) in done_jobs:
+                    prog.add(j[0], block_tiles(j))
+            _run_jobs(_run_block, todo, info, opts, out_dir, collect)
+
+    blank_bytes = len(_tile_encoder(opts)(np.zeros((opts.tile_size, opts.tile_size, 4), np.uint8)))
+    stats = store.summary(blank_bytes)
+    store.close({"name": os.path.splitext(os.path.basename(src_path))[0], "minzoom": min(opts.zooms),
+                 "maxzoom": max(opts.zooms), "bounds": list(info.lonlat_bounds), "tile_size": opts.tile_size,
+                 "blank_tile_bytes": blank_bytes, "dedup": stats})
+    stats.update(jobs=len(todo), total=prog.total, written=stats["unique"] + stats["duplicates"])
+    stats["seconds"] = time.perf_counter() - t0
+    stats["tiles_per_s"] = prog.total / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    if not quiet:
+        prog.line(force=True)
+        print(f"\n✅ Done in {stats['seconds']:.1f}s. {dedup_report(stats)}")
+    return stats
+
+
+# ========== 增量切片 ==========
+MANIFEST = "tile_manifest.json"
+MANIFEST_KEYS = ("zooms", "scheme", "driver", "tile_size", "resampling", "quality", "s_srs", "block",
+                 "overview_resampling", "dedup", "auto_opaque", "auto_alpha", "quantize")
+
+
+def manifest_path(out: str) -> str:
+    return out + ".manifest.json" if is_mbtiles(out) else os.path.join(out, MANIFEST)
+
+
+def load_manifest(out: str) -> Optional[dict]:
+    p = manifest_path(out)
+    if not os.path.isfile(p):
+        return None
+    with open(p, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(out: str, info: SourceInfo, opts: TilerOptions, regions: Dict[str, str],
+                   footprint=None) -> None:
+    """源影像（路径、大小、修改时间、坐标系、范围）+ 瓦片覆盖范围 + 切片参数 + 各区域源数据哈希。"""
+    st = os.stat(info.path)
+    m = {
+        "version": 1,
+        "source": {"path": os.path.abspath(info.path), "size": st.st_size, "mtime": st.st_mtime,
+                   "crs": info.crs.to_wkt(), "footprint": list(footprint or info.lonlat_bounds)},
+        "coverage": list(info.lonlat_bounds),
+        "options": {k: getattr(opts, k) for k in MANIFEST_KEYS},
+        "scale": list(info.scale) if info.scale else None,
+        "region_zoom": info.extra["region_zoom"],
+        "regions": regions,
+    }
+    write_file_atomic(manifest_path(out), json.dumps(m, ensure_ascii=False).encode("utf-8"))
+
+
+def _chunks(items: list, n: int) -> list:
+    return [items[i:i + n] for i in range(0, len(items), n)]
+
+
+def _union(a, b):
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def dirty_tiles(regions: List[Tuple[int, int]], region_zoom: int, zmin: int, zmax: int,
+                bounds) -> Dict[int, set]:
+    """脏区域 → 各级需要重建的瓦片集合（区域以下的全部子瓦片 + 向上所有父瓦片），限于 bounds 范围内。"""
+    out: Dict[int, set] = {}
+    for z in range(zmin, zmax + 1):
+        xmin, ymin, xmax, ymax = tile_range(bounds, z)
+        tiles = set()
+        for rx, ry in regions:
+            if z <= region_zoom:
+                tiles.add((rx >> (region_zoom - z), ry >> (region_zoom - z)))
+            else:
+                k = z - region_zoom
+                for x in range(max(xmin, rx << k), min(xmax, ((rx + 1) << k) - 1) + 1):
+                    for y in range(max(ymin, ry << k), min(ymax, ((ry + 1) << k) - 1) + 1):
+                        tiles.add((x, y))
+        out[z] = {(x, y) for x, y in tiles if xmin <= x <= xmax and ymin <= y <= ymax}
+    return out
+
+
+@sampled("tiler")
+def _run_region(job) -> dict:
+    """增量：重建一个脏区域（其下到最深级），返回区域根瓦片与新哈希。"""
+    src, info, opts, store = _W["src"], _W["info"], _W["opts"], _W["store"]
+    regions = {}
+    pb = _pyramid_builder(info, opts, store, src, regions)
+    root = pb.build(*job)
+    return {"job": job, "counts": pb.counts, "root": root, "regions": regions, "store": store.drain()}
+
+
+def retile(src_path: str, out: str, processes: int = 0, verify: bool = False, quiet: bool = False) -> dict:
+    """
+    增量切片：按清单比较各区域的源数据哈希，只重建变化的区域及其所有父瓦片。
+    - 切片参数沿用清单（缩放级、格式、拉伸范围等），保证新旧瓦片一致
+    - 新旧覆盖范围取并集：缩小后落在范围外的旧瓦片被标记为空白并删除
+    - 待重建列表先写入 .pending，中断后再次运行会补做；清单在全部写完后原子替换
+    - MBTiles 在一个事务内提交（读者看到的要么全旧、要么全新）；目录布局逐张原子替换
+    """
+    man = load_manifest(out)
+    if man is None:
+        raise FileNotFoundError(f"{manifest_path(out)}（先完整切片一次）")
+    opts = TilerOptions(**man["options"], processes=processes,
+                        scale=tuple(man["scale"]) if man["scale"] else None)
+    info = source_info(src_path, opts.s_srs, opts.tile_size)
+    if info.crs.to_wkt() != man["source"]["crs"]:
+        raise ValueError("源影像坐标系与清单不同，请完整重新切片")
+    info.scale = opts.scale
+    if info.dtype != "uint8" and info.scale is None:
+        raise ValueError("清单中没有拉伸范围，非 8 位数据无法保证一致，请完整重新切片")
+    st = os.stat(src_path)
+    pending_path = manifest_path(out) + ".pending"
+    pending = set()
+    if os.path.isfile(pending_path):
+        with open(pending_path, "r", encoding="utf-8") as f:
+            pending = {tuple(v) for v in json.load(f)}
+    same_file = (os.path.abspath(src_path) == man["source"]["path"] and st.st_size == man["source"]["size"]
+                 and st.st_mtime == man["source"]["mtime"])
+    if same_file and not verify and not pending:
+        if not quiet:
+            print("i Source unchanged (size / mtime), nothing to do.")
+        return {"dirty_regions": 0, "tiles": 0}
+
+    footprint = info.lonlat_bounds
+    info.lonlat_bounds = _union(footprint, man["coverage"])
+    rz = info.extra["region_zoom"] = man["region_zoom"]
+    zmin, zmax = min(opts.zooms), max(opts.zooms)
+    t0 = time.perf_counter()
+
+    # 1) 区域哈希（只读不渲染）
+    xmin, ymin, xmax, ymax = tile_range(info.lonlat_bounds, rz)
+    keys = [(x, y) for y in range(ymin, ymax + 1) for x in range(xmin, xmax + 1)]
+    new_regions: Dict[str, str] = {}
+    _run_jobs(_hash_regions, _chunks(keys, 16), info, opts, out, lambda r: new_regions.update(r["regions"]))
+    old = man["regions"]
+    dirty = sorted({(x, y) for x, y in keys if old.get(region_key(x, y)) != new_regions.get(region_key(x, y))}
+                   | {(x, y) for _, x, y in pending})
+    t_hash = time.perf_counter() - t0
+    per_zoom = {z: len(v) for z, v in dirty_tiles(dirty, rz, zmin, zmax, info.lonlat_bounds).items()}
+    if not quiet:
+        print(f"i Regions at z{rz}: {len(keys)} checked in {t_hash:.1f}s, {len(dirty)} dirty")
+        print("i Dirty tiles:", ", ".join(f"z{z}={n}" for z, n in sorted(per_zoom.items())))
+    if not dirty:
+        write_manifest(out, info, opts, new_regions, footprint)
+        return {"dirty_regions": 0, "tiles": 0, "seconds": time.perf_counter() - t0}
+    write_file_atomic(pending_path, json.dumps([(rz, x, y) for x, y in dirty]).encode("utf-8"))
+
+    # 2) 重建脏区域（最深级渲染 + 区域内合成）
+    store = _open_store(out, opts)
+    if hasattr(store, "autocommit"):
+        store.autocommit = False
+    prog = Progress(per_zoom)
+    roots: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def collect(r):
+        store.absorb(r["store"])
+        for z, n in r["counts"].items():
+            prog.add(z, n)
+        if r["root"] is not None:
+            roots[r["job"][1:]] = r["root"]
+        if not quiet:
+            prog.line()
+
+    _run_jobs(_run_region, [(rz, x, y) for x, y in dirty], info, opts, out, collect)
+
+    # 3) 父瓦片：变化的子瓦片取内存中的新结果，其余从已有输出读回
+    pb = _pyramid_builder(info, opts, store)
+    level = set(dirty)
+    for z in range(rz - 1, zmin - 1, -1):
+        parents = {(x >> 1, y >> 1) for x, y in level}
+        kids = {}
+        for px, py in parents:
+            for c in ((2 * px, 2 * py), (2 * px + 1, 2 * py), (2 * px, 2 * py + 1), (2 * px + 1, 2 * py + 1)):
+                if c in roots:
+                    kids[c] = roots[c]
+                elif c not in level:
+                    t = _decode_tile(store.read(z + 1, *c))
+                    if t is not None:
+                        kids[c] = t
+        new_roots = {}
+        for px, py in parents:
+            t = pb.build_from_children(z, px, py, kids)
+            if t is not None:
+                new_roots[(px, py)] = t
+        prog.add(z, pb.counts.pop(z, 0))
+        roots, level = new_roots, parents
+    store.absorb(store.drain())
+
+    # 4) 提交：MBTiles 事务 / 清单原子替换，最后删除 .pending
+    stats = store.summary()
+    store.close({"name": os.path.splitext(os.path.basename(src_path))[0], "minzoom": zmin, "maxzoom": zmax,
+                 "bounds": list(info.lonlat_bounds), "tile_size": opts.tile_size})
+    write_manifest(out, info, opts, new_regions, footprint)
+    os.remove(pending_path)
+    stats.update(dirty_regions=len(dirty), regions=len(keys), dirty_tiles=sum(per_zoom.values()),
+                 seconds=time.perf_counter() - t0, hash_seconds=t_hash)
+    if not quiet:
+        prog.line(force=True)
+        print(f"\n✅ Updated {stats['dirty_tiles']} tiles ({len(dirty)}/{len(keys)} regions) "
+              f"in {stats['seconds']:.1f}s")
+    return stats
+
+
+# ========== 基准 ==========
+def make_synthetic_geotiff(path: str, size: int = 8192, pixel_m: float = 0.05,
+                           lon: float = 120.6474, lat: float = 31.4636) -> str:
+    """在测区附近生成一张带内部分块的 RGB GeoTIFF（UTM 51N，默认 5cm 分辨率）。"""
+    from rasterio.warp import transform as warp_transform
+    crs = CRS.from_epsg(32651)
+    (x,), (y,) = warp_transform("EPSG:4326", crs, [lon], [lat])
+    tf = Affine(pixel_m, 0, x - size * pixel_m / 2, 0, -pixel_m, y + size * pixel_m / 2)
+    rng = np.random.default_rng(0)
+    profile = dict(driver="GTiff", width=size, height=size, count=3, dtype="uint8", crs=crs, transform=tf,
+                   tiled=True, blockxsize=512, blockysize=512, compress="deflate", photometric="RGB")
+    with rasterio.open(path, "w", **profile) as dst:
+        step = 1024
+        for r in range(0, size, step):
+            h = min(step, size - r)
+            yy, xx = np.mgrid[r:r + h, 0:size]
+            base = ((np.sin(xx / 97.0) + np.cos(yy / 61.0)) * 60 + 128).astype(np.int16)
+            for b in range(3):
+                band = np.clip(base + rng.integers(-20, 20, base.shape) + b * 15, 0, 255).astype(np.uint8)
+                dst.write(band, b + 1, window=Window(0, r, size, h))
+    return path
+
+
+def bench(work_dir: Optional[str] = None, size: int = 8192, zooms: str = "0-19",
+          procs_list=(1, 2, 4), driver: str = "PNG") -> List[dict]:
+    """逐级从源重采样 vs 由最深级合成金字塔，在不同进程数下的吞吐对比。"""
+    work = work_dir or tempfile.mkdtemp(prefix="tiler_bench_")
+    src = os.path.join(work, "synthetic.tif")
+    if not os.path.exists(src):
+        print(f"i Generating {size}x{size} synthetic GeoTIFF ...")
+        make_synthetic_geotiff(src, size)
+    rows = []
+    for p in procs_list:
+        for pyramid in (False, True):
+            mode = "pyramid" if pyramid else "source"
+            out = os.path.join(work, f"tiles_{mode}_p{p}")
+            opts = TilerOptions(zooms=parse_zoom(zooms), driver=driver, processes=p, pyramid=pyramid)
+            st = tile_raster(src, out, opts, quiet=True)
+            rows.append({"mode": mode, "processes": p,
+                         **{k: st[k] for k in ("total", "written", "seconds", "tiles_per_s")}})
+            print(f"{mode:8s} processes={p:2d}  tiles={st['total']:6d}  {st['seconds']:7.2f}s  "
+                  f"{st['tiles_per_s']:8.1f} tiles/s")
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="无需 QGIS 的并行栅格切片（XYZ/TMS，PNG/JPEG/WEBP）")
+    ap.add_argument("input", nargs="?", help="输入 GeoTIFF")
+    ap.add_argument("output", nargs="?", help="输出目录，或 *.mbtiles 文件")
+    ap.add_argument("-z", "--zoom", default=None, help='缩放级，如 "0-19"（默认 0 到原始分辨率级）')
+    ap.add_argument("--tms", action="store_true", help="TMS 目录结构（默认 XYZ）")
+    ap.add_argument("--tiledriver", default="PNG", choices=sorted(EXTS))
+    ap.add_argument("--resampling", default="bilinear", choices=["nearest", "bilinear", "cubic", "average", "lanczos"])
+    ap.add_argument("--processes", type=int, default=0)
+    ap.add_argument("--tilesize", type=int, default=TILE_SIZE)
+    ap.add_argument("--block", type=int, default=8, help="每个任务块的瓦片边长数")
+    ap.add_argument("--no-dedup", action="store_true", help="不做内容去重（每张瓦片单独写文件）")
+    ap.add_argument("--no-pyramid", action="store_true", help="每一级都从源影像重采样（默认只渲染最深级，其余由子瓦片合成）")
+    ap.add_argument("--overview-resampling", default="average", choices=OVERVIEW_METHODS,
+                    help="金字塔 2×2 合成方式；分类数据用 mode")
+    ap.add_argument("--quality", type=int, default=85)
+    ap.add_argument("--auto-opaque", default="JPEG", choices=["JPEG", "WEBP"], help="AUTO：全不透明瓦片的格式")
+    ap.add_argument("--auto-alpha", default="PNG", choices=["PNG", "WEBP"], help="AUTO：边缘部分透明瓦片的格式")
+    ap.add_argument("--quantize", type=int, default=0, help="PNG / AUTO 量化色数（DEM 可视化瓦片），0 = 不量化")
+    ap.add_argument("--resume", action="store_true")
+    ap.add_argument("--s_srs", default=None)
+    ap.add_argument("--scale", default=None, help="非 8 位数据拉伸范围 min,max")
+    ap.add_argument("--incremental", action="store_true",
+                    help="按已有输出的清单增量更新：只重建源数据有变化的区域及其父瓦片（参数沿用清单；不支持 --no-pyramid）")
+    ap.add_argument("--verify", action="store_true", help="增量模式下即使源文件大小 / 时间未变也逐区域比较")
+    ap.add_argument("--bench", action="store_true", help="在合成 GeoTIFF 上测试吞吐")
+    ap.add_argument("--bench-size", type=int, default=8192)
+    args = ap.parse_args()
+
+    if args.bench:
+        bench(args.input, args.bench_size, args.zoom or "0-19", driver=args.tiledriver)
+        return
+    if not args.input or not args.output:
+        ap.print_help()
+        sys.exit(1)
+    if not os.path.exists(args.input):
+        raise SystemExit(f"输入影像不存在：{args.input}")
+    if args.incremental:
+        if args.no_pyramid:
+            ap.error("--incremental 依赖金字塔模式（区域哈希 + 子瓦片合成父瓦片），不能与 --no-pyramid 同用")
+        if load_manifest(args.output) is not None:
+            retile(args.input, args.output, args.processes, args.verify)
+            return
+        print("i No manifest in output, running a full tiling.")
+    zoom = args.zoom
+    if zoom is None:
+        zoom = f"0-{source_info(args.input, args.s_srs, args.tilesize).native_zoom}"
+    opts = TilerOptions(
+        zooms=parse_zoom(zoom), scheme="tms" if args.tms else "xyz", driver=args.tiledriver.upper(),
+        tile_size=args.tilesize, resampling=args.resampling, processes=args.processes,
+        resume=args.resume, s_srs=args.s_srs, block=args.block, quality=args.quality,
+        pyramid=not args.no_pyramid, overview_resampling=args.overview_resampling, dedup=not args.no_dedup,
+        auto_opaque=args.auto_opaque, auto_alpha=args.auto_alpha, quantize=args.quantize,
+        scale=tuple(float(v) for v in args.scale.split(",")) if args.scale else None,
+    )
+    tile_raster(args.input, args.output, opts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+// track_codec.js —— GTRK 轨迹二进制段解码（格式见 track_codec.py）
+// 用法：
+//   const seg = decodeTrackSegment(await (await fetch('/api/track/segment?log=xxx&seg=0')).arrayBuffer());
+//   seg.lat / seg.lon / seg.alt 为 Float64Array，seg.time 为毫秒时间戳 Float64Array
+(function (global) {
+  'use strict';
+
+  function pad8(n) { return (n + 7) & ~7; }
+
+  function decodeTrackSegment(buffer) {
+    const dv = new DataView(buffer);
+    const magic = String.fromCharCode(dv.getUint8(0), dv.getUint8(1), dv.getUint8(2), dv.getUint8(3));
+    if (magic !== 'GTRK' || dv.getUint16(4, true) !== 1) throw new Error('不是 GTRK v1 数据');
+    const ncols = dv.getUint16(6, true);
+    const count = dv.getUint32(8, true);
+    let off = dv.getUint32(12, true);
+    const out = { count };
+    for (let k = 0; k < ncols; k++) {
+      const d = 16 + k * 24;
+      const name = String.fromCharCode(dv.getUint8(d), dv.getUint8(d + 1), dv.getUint8(d + 2), dv.getUint8(d + 3)).trim();
+      const width = dv.getUint8(d + 4);
+      const base = Number(dv.getBigInt64(d + 8, true));
+      const scale = dv.getFloat64(d + 16, true);
+      const View = width === 1 ? Uint8Array : (width === 2 ? Uint16Array : Uint32Array);
+      const z = new View(buffer, off, count);
+      const col = new Float64Array(count);
+      let acc = base;
+      for (let i = 0; i < count; i++) {
+        const v = z[i];
+        // zigzag 还原（Uint32 时避免位运算溢出）
+        acc += (v % 2) ? -(v + 1) / 2 : v / 2;
+        col[i] = acc * scale;
+      }
+      // time 列还原为毫秒
+      out[name] = name === 'time' ? col.map(t => t * 1000) : col;
+      off += pad8(count * width);
+    }
+    return out;
+  }
+
+  async function fetchTrack(log, onSegment) {
+    const idx = await (await fetch(`/api/track/index?log=${encodeURIComponent(log)}`, { cache: 'no-cache' })).json();
+    for (const s of idx.segments) {
+      const res = await fetch(`/api/track/segment?log=${encodeURIComponent(log)}&seg=${s.index}`, { cache: 'no-cache' });
+      if (!res.ok) break;
+      onSegment(decodeTrackSegment(await res.arrayBuffer()), s);
+    }
+    return idx;
+  }
+
+  global.decodeTrackSegment = decodeTrackSegment;
+  global.fetchTrack = fetchTrack;
+})(typeof window !== 'undefined' ? window : globalThis);
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+轨迹二进制传输格式（GTRK）
+- 列存：lat / lon / alt / time 四列，定点整数 + 差分 + zigzag，按列选最小定宽（1/2/4 字节）
+- 每列 8 字节对齐，浏览器端可直接用 Uint8Array/Uint16Array/Uint32Array 视图解码（见 track_codec.js）
+- 日志按固定点数切段，增量解析：已完成的段不再重读，只解析文件新增部分
+- 用法：python track_codec.py --bench mqtt_log_*.txt   （对比文本日志与二进制的体积与解码耗时）
+
+格式（小端）：
+  头部 16 字节：magic "GTRK" | version u16 | ncols u16 | count u32 | header_len u32
+  列描述 24 字节 × ncols：name 4s | width u8 | pad 3 | base i64 | scale f64
+  数据区：每列 count 个 zigzag(差分) 无符号整数，首个差分为 0，列起点 8 字节对齐
+  还原：value[i] = (base + Σ unzigzag(d[0..i])) * scale
+"""
+import os
+import sys
+import glob
+import time
+import struct
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from gpchc import iter_file_fixes, iter_lines_with_offsets, parse_log_line, parse_timestamp_from_filename
+
+MAGIC = b"GTRK"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+COLUMN = struct.Struct("<4sB3xqd")
+
+# 列定义：(名称, 定点比例)。lat/lon 1e-7 度（约 1cm），alt 毫米，time 毫秒
+COLUMNS = (
+    (b"lat ", 1e-7),
+    (b"lon ", 1e-7),
+    (b"alt ", 1e-3),
+    (b"time", 1e-3),
+)
+
+SEGMENT_POINTS = 4096                 # 每段点数
+CACHE_MAX_BYTES = 32 * 1024 * 1024    # 段缓存上限
+
+
+def _zigzag(d: np.ndarray) -> np.ndarray:
+    return ((d << 1) ^ (d >> 63)).astype(np.uint64)
+
+
+def _unzigzag(z: np.ndarray) -> np.ndarray:
+    z = z.astype(np.int64)
+    return (z >> 1) ^ -(z & 1)
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def encode_columns(lat, lon, alt, t) -> bytes:
+    """把四列浮点数组（度 / 米 / Unix 秒）编码为一个 GTRK 段。"""
+    cols = [np.asarray(c, dtype=np.float64) for c in (lat, lon, alt, t)]
+    count = int(cols[0].size)
+    descs, blobs = [], []
+    for (name, scale), col in zip(COLUMNS, cols):
+        q = np.rint(col / scale).astype(np.int64)
+        base = int(q[0]) if count else 0
+        d = np.diff(q, prepend=q[:1]) if count else q
+        z = _zigzag(d)
+        zmax = int(z.max()) if count else 0
+        if zmax < 1 << 8:
+            width, dtype = 1, "<u1"
+        elif zmax < 1 << 16:
+            width, dtype = 2, "<u2"
+        elif zmax < 1 << 32:
+            width, dtype = 4, "<u4"
+        else:
+            raise ValueError(f"列 {name.decode().strip()} 差分超出 32 位，需切段")
+        descs.append(COLUMN.pack(name, width, base, scale))
+        raw = z.astype(dtype).tobytes()
+        blobs.append(raw + b"\0" * (_pad8(len(raw)) - len(raw)))
+    header_len = _pad8(HEADER.size + COLUMN.size * len(COLUMNS))
+    head = HEADER.pack(MAGIC, VERSION, len(COLUMNS), count, header_len) + b"".join(descs)
+    return head + b"\0" * (header_len - len(head)) + b"".join(blobs)
+
+
+def decode_columns(buf: bytes) -> Dict[str, np.ndarray]:
+    """解码 GTRK 段，返回 {lat, lon, alt, time} 浮点数组（与 JS 端解码逻辑一致）。"""
+    magic, version, ncols, count, header_len = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("不是 GTRK v1 数据")
+    out = {}
+    off = header_len
+    for k in range(ncols):
+        name, width, base, scale = COLUMN.unpack_from(buf, HEADER.size + k * COLUMN.size)
+        z = np.frombuffer(buf, dtype=f"<u{width}", count=count, offset=off)
+        out[name.decode().strip()] = (base + np.cumsum(_unzigzag(z))) * scale
+        off += _pad8(count * width)
+    return out
+
+
+# ========== 增量切段 ==========
+class TrackSegmenter:
+    """
+    单个日志文件的增量切段器。
+    记录每个已完成段的字节范围；文件增长时只从“未完成段”的起始偏移继续解析。
+    """
+
+    def __init__(self, path: str, segment_points: int = SEGMENT_POINTS):
+        self.path = path
+        self.segment_points = segment_points
+        self.file_time = parse_timestamp_from_filename(path)
+        self.segments: List[dict] = []     # 已完成段：{start, end, count, t0, t1}
+        self.tail: Optional[dict] = None   # 未完成段（可能为空）
+        self._scanned = 0                  # 已扫描到的字节偏移
+        self._tail_cols = None
+        self._idx = 0
+        self._ident = None
+        self.lock = threading.RLock()   # TrackStore 取段时持有，使缓存键与编码内容来自同一状态
+
+    def _identity(self):
+        st = os.stat(self.path)
+        with open(self.path, "rb") as f:
+            first = f.read(64)
+        return st.st_size, first
+
+    def _reset(self):
+        self.segments.clear()
+        self.tail = None
+        self._scanned = 0
+        self._tail_cols = None
+        self._idx = 0
+
+    def refresh(self) -> None:
+        """增量扫描文件新增部分；文件被截断或替换时从头重建。"""
+        with self.lock:
+            size, first = self._identity()
+            if self._ident is not None and (size < self._scanned or first != self._ident[1]):
+                self._reset()
+            self._ident = (size, first)
+            if size == self._scanned:
+                return
+            if self._tail_cols is None:
+                self._tail_cols = ([], [], [], [])
+                self.tail = {"start": self._scanned, "end": self._scanned, "count": 0, "t0": None, "t1": None}
+            for _, end, line in iter_lines_with_offsets(self.path, self._scanned):
+                self._scanned = end
+                fix = parse_log_line(line, self.file_time, self._idx)
+                if fix is None:
+                    continue
+                self._idx += 1
+                lat, lon, alt, tt = self._tail_cols
+                lat.append(fix.lat); lon.append(fix.lon); alt.append(fix.alt); tt.append(fix.t)
+                tail = self.tail
+                tail["count"] += 1
+                tail["end"] = end
+                if tail["t0"] is None:
+                    tail["t0"] = fix.t
+                tail["t1"] = fix.t
+                if tail["count"] >= self.segment_points:
+                    self.segments.append(tail)
+                    self._tail_cols = ([], [], [], [])
+                    self.tail = {"start": end, "end": end, "count": 0, "t0": None, "t1": None}
+            self.tail["end"] = self._scanned
+
+    def index(self) -> List[dict]:
+        with self.lock:
+            segs = list(self.segments)
+            if self.tail and self.tail["count"]:
+                segs.append(dict(self.tail, partial=True))
+        return [dict(s, index=i) for i, s in enumerate(segs)]
+
+    def segment_key(self, i: int):
+        """段缓存键：已完成段按字节范围，未完成段再带上当前点数。"""
+        with self.lock:
+            s = self.index()[i]
+        return (self.path, s["start"], s["end"], s["count"])
+
+    def encode_segment(self, i: int) -> bytes:
+        """编码第 i 段：已完成段按字节范围重新解析该段，未完成段直接用内存中的列。"""
+        with self.lock:
+            if i < len(self.segments):
+                s = self.segments[i]
+                cols = ([], [], [], [])
+                idx = sum(seg["count"] for seg in self.segments[:i])
+                for _, _, line in iter_lines_with_offsets(self.path, s["start"], s["end"]):
+                    fix = parse_log_line(line, self.file_time, idx)
+                    if fix is None:
+                        continue
+                    idx += 1
+                    cols[0].append(fix.lat); cols[1].append(fix.lon); cols[2].append(fix.alt); cols[3].append(fix.t)
+            elif i == len(self.segments) and self._tail_cols and self.tail["count"]:
+                cols = tuple(list(c) for c in self._tail_cols)
+            else:
+                raise IndexError(i)
+        return encode_columns(*cols)
+
+
+class TrackStore:
+    """按日志文件维护切段器，并用字节上限的 LRU 缓存已编码的段。"""
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._segmenters: Dict[str, TrackSegmenter] = {}
+        self._cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def segmenter(self, path: str) -> TrackSegmenter:
+        path = os.path.abspath(path)
+        with self._lock:
+            seg = self._segmenters.get(path)
+            if seg is None:
+                seg = self._segmenters[path] = TrackSegmenter(path)
+        seg.refresh()
+        return seg
+
+    def index(self, path: str) -> dict:
+        seg = self.segmenter(path)
+        return {
+            "log": os.path.basename(path),
+            "segment_points": seg.segment_points,
+            "segments": seg.index(),
+        }
+
+    def segment(self, path: str, i: int) -> bytes:
+        seg = self.segmenter(path)
+        # 并发 refresh() 追加数据时，键与编码内容须取自同一时刻
+        with seg.lock:
+            key = seg.segment_key(i)
+            with self._lock:
+                buf = self._cache.get(key)
+                if buf is not None:
+                    self._cache.move_to_end(key)
+                    return buf
+            buf = seg.encode_segment(i)
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = buf
+                self._bytes += len(buf)
+            while self._bytes > self.max_bytes and self._cache:
+                _, old = self._cache.popitem(last=False)
+                self._bytes -= len(old)
+        return buf
+
+
+# ========== 体积 / 解码耗时对比 ==========
+def _parse_text(text: str):
+    """模拟页面端：逐行解析文本为点对象。"""
+    pts = []
+    for i, line in enumerate(text.splitlines()):
+        fix = parse_log_line(line, None, i)
+        if fix is not None:
+            pts.append({"time": fix.t, "lon": fix.lon, "lat": fix.lat, "alt": fix.alt})
+    return pts
+
+
+def bench(paths: List[str], repeat: int = 5) -> None:
+    print(f"{'file':32s} {'points':>7s} {'text':>10s} {'binary':>10s} {'ratio':>6s} {'parse ms':>9s} {'decode ms':>9s}")
+    for path in paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        fixes = list(iter_file_fixes(path))
+        if not fixes:
+            continue
+        buf = encode_columns([p.lat for p in fixes], [p.lon for p in fixes],
+                             [p.alt for p in fixes], [p.t for p in fixes])
+        text = raw.decode("utf-8", errors="ignore")
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            _parse_text(text)
+        t_parse = (time.perf_counter() - t0) / repeat * 1000
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            dec = decode_columns(buf)
+        t_dec = (time.perf_counter() - t0) / repeat * 1000
+        err = float(np.max(np.abs(dec["lat"] - np.array([p.lat for p in fixes]))))
+        print(f"{os.path.basename(path):32s} {len(fixes):7d} {len(raw):10d} {len(buf):10d} "
+              f"{len(raw) / len(buf):6.1f} {t_parse:9.2f} {t_dec:9.3f}   max|Δlat|={err:.1e}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="GTRK 轨迹二进制格式工具")
+    ap.add_argument("--bench", nargs="*", metavar="LOG", help="对比文本日志与二进制的体积与解码耗时")
+    ap.add_argument("--encode", metavar="LOG", help="将日志整体编码为单个 .gtrk 文件")
+    ap.add_argument("--out", help="--encode 输出路径（默认同名 .gtrk）")
+    args = ap.parse_args()
+
+    if args.encode:
+        fixes = list(iter_file_fixes(args.encode))
+        buf = encode_columns([p.lat for p in fixes], [p.lon for p in fixes],
+                             [p.alt for p in fixes], [p.t for p in fixes])
+        out = args.out or os.path.splitext(args.encode)[0] + ".gtrk"
+        with open(out, "wb") as f:
+            f.write(buf)
+        print(f"{out}: {len(fixes)} points, {len(buf)} bytes")
+    elif args.bench is not None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        bench(args.bench or sorted(glob.glob(os.path.join(here, "mqtt_log_*.txt"))))
+    else:
+        ap.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+轨迹流式导出：mqtt_log_*.txt / test_data 目录 → GeoJSON 序列 / KML / GPX / Parquet / GTRK
+- 生成器流水线：读取 → 解析 → 过滤 / 抽稀 → 流式写出，全程常量内存
+- 多个日志文件可用进程池并行导出（每个文件一个输出）
+- main.py 的 /api/export 直接把写出器产生的字节块作为 HTTP 分块响应发送
+用法：
+  python track_export.py -f gpx -o export/ mqtt_log_*.txt --jobs 4
+  python track_export.py -f kml --merge all.kml mqtt_log_*.txt --simplify 0.3
+"""
+import os
+import sys
+import glob
+import json
+import math
+import time
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional
+from xml.sax.saxutils import escape
+
+from gpchc import Fix, fix_rank, iter_file_fixes, parse_log_line, parse_timestamp_from_filename
+
+EARTH_R = 6378137.0
+SIMPLIFY_WINDOW = 256     # 流式抽稀的最大缓冲点数
+PARQUET_ROW_GROUP = 65536
+GTRK_SEGMENT = 4096
+
+FORMATS = {
+    # 名称: (扩展名, Content-Type)
+    # 换行分隔（GeoJSONL / ndjson），不是 RFC 8142 的 RS 分隔序列
+    "geojsonseq": (".geojsonl", "application/x-ndjson"),
+    "kml": (".kml", "application/vnd.google-earth.kml+xml"),
+    "gpx": (".gpx", "application/gpx+xml"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "gtrk": (".gtrk", "application/octet-stream"),
+}
+
+
+# ========== 读取 ==========
+def iter_spool(dir_path: str) -> Iterator[Fix]:
+    """按文件名顺序读取 test_data 目录中的单条消息文件。"""
+    for name in sorted(os.listdir(dir_path)):
+        if not name.endswith(".txt"):
+            continue
+        path = os.path.join(dir_path, name)
+        file_time = parse_timestamp_from_filename(name)
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            idx = 0
+            for line in f:
+                fix = parse_log_line(line, file_time, idx)
+                if fix is not None:
+                    idx += 1
+                    yield fix
+
+
+def iter_source(path: str) -> Iterator[Fix]:
+    """日志文件或 spool 目录。"""
+    return iter_spool(path) if os.path.isdir(path) else iter_file_fixes(path)
+
+
+# ========== 过滤 ==========
+def filter_fixes(fixes: Iterable[Fix], bbox=None, t0: float = None, t1: float = None,
+                 min_quality: int = None, drop_zero: bool = True, every: int = 1) -> Iterator[Fix]:
+    """常量内存过滤：零坐标、范围、时间段、GNSS 质量等级（gpchc.fix_rank）、等间隔抽点。"""
+    k = 0
+    for f in fixes:
+        if drop_zero and f.lat == 0.0 and f.lon == 0.0:
+            continue
+        if bbox and not (bbox[0] <= f.lon <= bbox[2] and bbox[1] <= f.lat <= bbox[3]):
+            continue
+        if t0 is not None and f.t < t0:
+            continue
+        if t1 is not None and f.t > t1:
+            continue
+        if min_quality is not None and fix_rank(f.status) < min_quality:
+            continue
+        k += 1
+        if every > 1 and (k - 1) % every:
+            continue
+        yield f
+
+
+def simplify(fixes: Iterable[Fix], tol_m: float, window: int = SIMPLIFY_WINDOW) -> Iterator[Fix]:
+    """
+    流式抽稀（有界缓冲的 Douglas-Peucker 变体）：
+    以最后保留点为锚，缓冲内任一点到“锚→最新点”的垂距超过 tol_m 时，保留上一个点作为新锚。
+    """
+    anchor: Optional[Fix] = None
+    buf: List[Fix] = []
+    last: Optional[Fix] = None
+    for f in fixes:
+        last = f
+        if anchor is None:
+            anchor = f
+            yield f
+            continue
+        kx = EARTH_R * math.cos(math.radians(anchor.lat)) * math.pi / 180.0
+        ky = EARTH_R * math.pi / 180.0
+        bx, by = (f.lon - anchor.lon) * kx, (f.lat - anchor.lat) * ky
+        blen = math.hypot(bx, by)
+        split = len(buf) >= window
+        if not split:
+            for q in buf:
+                qx, qy = (q.lon - anchor.lon) * kx, (q.lat - anchor.lat) * ky
+                d = abs(bx * qy - by * qx) / blen if blen > 0 else math.hypot(qx, qy)
+                if d > tol_m:
+                    split = True
+                    break
+        if split:
+            anchor = buf[-1]
+            yield anchor
+            buf = []
+        buf.append(f)
+    if last is not None and buf:
+        yield last
+
+
+# ========== 写出器（生成字节块） ==========
+def _iso(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def write_geojsonseq(fixes: Iterable[Fix], name: str = "track", batch: int = 512) -> Iterator[bytes]:
+    """每行一个 Point Feature（换行分隔的 GeoJSON，无 RS 前缀；GDAL / QGIS 的 GeoJSONSeq 驱动可直接打开）。"""
+    out = []
+    for f in fixes:
+        out.append(json.dumps({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [f.lon, f.lat, f.alt]},
+            "properties": {"track": name, "time": _iso(f.t), "speed": f.speed, "heading": f.heading,
+                           "status": f.status, "nsv1": f.nsv1, "nsv2": f.nsv2},
+        }, ensure_ascii=False))
+        if len(out) >= batch:
+            yield ("\n".join(out) + "\n").encode("utf-8")
+            out = []
+    if out:
+        yield ("\n".join(out) + "\n").encode("utf-8")
+
+
+def write_kml(fixes: Iterable[Fix], name: str = "track", batch: int = 2048) -> Iterator[bytes]:
+    """单个 Placemark / LineString，坐标逐批写出。"""
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n'
+        f'<name>{escape(name)}</name><Placemark><name>{escape(name)}</name>\n'
+        '<LineString><altitudeMode>absolute</altitudeMode><coordinates>\n'
+    ).encode("utf-8")
+    out = []
+    for f in fixes:
+        out.append(f"{f.lon:.8f},{f.lat:.8f},{f.alt:.3f}")
+        if len(out) >= batch:
+            yield ("\n".join(out) + "\n").encode("utf-8")
+            out = []
+    if out:
+        yield ("\n".join(out) + "\n").encode("utf-8")
+    yield b"</coordinates></LineString></Placemark></Document></kml>\n"
+
+
+def write_gpx(fixes: Iterable[Fix], name: str = "track", batch: int = 1024) -> Iterator[bytes]:
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx version="1.1" creator="Hyh_webgis track_export" xmlns="http://www.topografix.com/GPX/1/1">\n'
+        f'<trk><name>{escape(name)}</name><trkseg>\n'
+    ).encode("utf-8")
+    out = []
+    for f in fixes:
+        out.append(f'<trkpt lat="{f.lat:.8f}" lon="{f.lon:.8f}"><ele>{f.alt:.3f}</ele><time>{_iso(f.t)}</time></trkpt>')
+        if len(out) >= batch:
+            yield ("\n".join(out) + "\n").encode("utf-8")
+            out = []
+    if out:
+        yield ("\n".join(out) + "\n").encode("utf-8")
+    yield b"</trkseg></trk></gpx>\n"
+
+
+class _ChunkSink:
+    """把 ParquetWriter 的输出收集为字节块，便于按行组流式发送。"""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.pos = 0
+        self.closed = False
+
+    def write(self, b) -> int:
+        b = bytes(b)
+        self.parts.append(b)
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        out = b"".join(self.parts)
+        self.parts = []
+        return out
+
+
+PARQUET_FIELDS = ("t", "lat", "lon", "alt", "heading", "pitch", "roll", "ve", "vn", "vu",
+                  "speed", "nsv1", "nsv2", "status")
+
+
+def write_parquet(fixes: Iterable[Fix], name: str = "track", row_group: int = PARQUET_ROW_GROUP) -> Iterator[bytes]:
+    """按行组写 Parquet（需要 pyarrow）。"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet 导出需要 pyarrow（conda install pyarrow），可改用 gtrk 列存格式")
+    schema = pa.schema([(k, pa.int32() if k in ("nsv1", "nsv2", "status") else pa.float64()) for k in PARQUET_FIELDS]
+                       + [("track", pa.string())])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    cols = {k: [] for k in PARQUET_FIELDS}
+
+    def flush():
+        n = len(cols["t"])
+        writer.write_table(pa.table({**cols, "track": [name] * n}, schema=schema))
+        for v in cols.values():
+            v.clear()
+
+    for f in fixes:
+        for k in PARQUET_FIELDS:
+            cols[k].append(getattr(f, k))
+        if len(cols["t"]) >= row_group:
+            flush()
+            yield sink.drain()
+    if cols["t"]:
+        flush()
+    writer.close()
+    yield sink.drain()
+
+
+def write_gtrk(fixes: Iterable[Fix], name: str = "track", segment: int = GTRK_SEGMENT) -> Iterator[bytes]:
+    """GTRK 列存段（见 track_codec.py），每 segment 点一段，顺序拼接。"""
+    from track_codec import encode_columns
+    cols = ([], [], [], [])
+    for f in fixes:
+        cols[0].append(f.lat); cols[1].append(f.lon); cols[2].append(f.alt); cols[3].append(f.t)
+        if len(cols[0]) >= segment:
+            yield encode_columns(*cols)
+            cols = ([], [], [], [])
+    if cols[0]:
+        yield encode_columns(*cols)
+
+
+WRITERS = {
+    "geojsonseq": write_geojsonseq,
+    "kml": write_kml,
+    "gpx": write_gpx,
+    "parquet": write_parquet,
+    "gtrk": write_gtrk,
+}
+
+
+# ========== 流水线 ==========
+def pipeline(sources: List[str], fmt: str, name: str = None, simplify_m: float = 0.0,
+             stage: Callable[[Iterable[Fix]], Iterable[Fix]] = None, clean: bool = False,
+             **filters) -> Iterator[bytes]:
+    """多个来源依次串接 → 过滤 → 可选处理阶段（clean=True 时为粗差剔除）→ 可选抽稀 → 写出器。"""
+    if clean and stage is None:
+        from fix_filter import FixFilter
+        stage = FixFilter().process
+    if fmt not in WRITERS:
+        raise ValueError(f"不支持的格式：{fmt}（可选 {', '.join(WRITERS)}）")
+
+    def chain():
+        for src in sources:
+            yield from iter_source(src)
+
+    fixes = filter_fixes(chain(), **filters)
+    if stage is not None:
+        fixes = stage(fixes)
+    if simplify_m and simplify_m > 0:
+        fixes = simplify(fixes, simplify_m)
+    name = name or os.path.splitext(os.path.basename(sources[0].rstrip("/\\")))[0]
+    return WRITERS[fmt](fixes, name=name)
+
+
+def export_file(src: str, out_path: str, fmt: str, simplify_m: float = 0.0, **filters) -> dict:
+    """单个来源导出到文件（进程池任务）。写入临时文件后原子替换。"""
+    t0 = time.perf_counter()
+    tmp = out_path + ".part"
+    size = 0
+    with open(tmp, "wb") as f:
+        for chunk in pipeline([src], fmt, simplify_m=simplify_m, **filters):
+            f.write(chunk)
+            size += len(chunk)
+    os.replace(tmp, out_path)
+    return {"source": src, "out": out_path, "bytes": size, "seconds": time.perf_counter() - t0}
+
+
+def export_many(sources: List[str], out_dir: str, fmt: str, jobs: int = 0, **kw) -> List[dict]:
+    """多个来源并行导出，每个来源一个输出文件。"""
+    os.makedirs(out_dir, exist_ok=True)
+    ext = FORMATS[fmt][0]
+    outs = [os.path.join(out_dir, os.path.splitext(os.path.basename(s.rstrip("/\\")))[0] + ext) for s in sources]
+    jobs = jobs or min(len(sources), os.cpu_count() or 1)
+    if jobs <= 1 or len(sources) <= 1:
+        return [export_file(s, o, fmt, **kw) for s, o in zip(sources, outs)]
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        futs = [ex.submit(export_file, s, o, fmt, **kw) for s, o in zip(sources, outs)]
+        return [fu.result() for fu in futs]
+
+
+def _parse_bbox(s: str):
+    if not s:
+        return None
+    v = [float(x) for x in s.split(",")]
+    if len(v) != 4:
+        raise ValueError("bbox 格式：minlon,minlat,maxlon,maxlat")
+    return v
+
+
+def main():
+    ap = argparse.ArgumentParser(description="mqtt 日志流式导出（GeoJSON 序列 / KML / GPX / Parquet / GTRK）")
+    ap.add_argument("sources", nargs="*", help="mqtt_log_*.txt 或 test_data 目录（默认：脚本目录下全部日志）")
+    ap.add_argument("-f", "--format", default="geojsonseq", choices=sorted(WRITERS))
+    ap.add_argument("-o", "--out-dir", default="export", help="每个来源一个输出文件")
+    ap.add_argument("--merge", help="全部来源合并写到一个文件")
+    ap.add_argument("--jobs", type=int, default=0, help="并行进程数（默认 CPU 数）")
+    ap.add_argument("--simplify", type=float, default=0.0, help="抽稀容差（米）")
+    ap.add_argument("--every", type=int, default=1, help="每 N 点取 1 点")
+    ap.add_argument("--bbox", help="minlon,minlat,maxlon,maxlat")
+    ap.add_argument("--min-quality", type=int,
+                    help="GNSS 质量等级下限：1 单点、2 伪距差分、3 RTK 浮点、4 RTK 固定（无定向状态与对应状态同级）")
+    ap.add_argument("--keep-zero", action="store_true", help="保留零坐标点")
+    ap.add_argument("--clean", action="store_true", help="经 fix_filter 粗差剔除后再导出")
+    args = ap.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    sources = args.sources or sorted(glob.glob(os.path.join(here, "mqtt_log_*.txt")))
+    filters = dict(bbox=_parse_bbox(args.bbox), min_quality=args.min_quality,
+                   drop_zero=not args.keep_zero, every=args.every, clean=args.clean)
+    t0 = time.perf_counter()
+    if args.merge:
+        size = 0
+        with open(args.merge + ".part", "wb") as f:
+            for chunk in pipeline(sources, args.format, name=os.path.splitext(os.path.basename(args.merge))[0],
+                                  simplify_m=args.simplify, **filters):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(args.merge + ".part", args.merge)
+        print(f"{args.merge}: {size} bytes")
+    else:
+        for r in export_many(sources, args.out_dir, args.format, args.jobs, simplify_m=args.simplify, **filters):
+            print(f"{r['out']}: {r['bytes']} bytes  {r['seconds']:.2f}s")
+    print(f"total {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()